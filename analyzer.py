@@ -4,47 +4,92 @@
 from __future__ import division
 
 import numpy
-import audioop
 
-from scipy import fft
+from time import time
 
 from PyQt4 import Qt
 from PyQt4 import QtCore
 from PyQt4 import QtGui
 
 class QFftAnalyzer( QtGui.QWidget ):
-    def __init__( self, parent, columns=50 ):
+    """ Shows the spectrum of 16 bit stereo audio data on a logarithmic frequency scale.
+
+        Every pixel column shows the loudest FFT bin of its frequency range. The
+        window function and the mapping from columns to bins are only calculated
+        when the FFT size or widget width change, and no more than ``maxrate``
+        chunks per second get analyzed, no matter how often the widget is called.
+    """
+    def __init__( self, parent, fftsize=1024, maxrate=20 ):
         QtGui.QWidget.__init__(self, parent)
-        self.points  = []
-        self.columns = columns
+        self.fftsize  = fftsize
+        self.maxrate  = maxrate
+        self.spectrum = None
+        self.lastrun  = 0
+
+        # Hann window, scaled so a full-scale sine peaks at about the same height as before.
+        self.window   = numpy.hanning(fftsize) * (0.5 / 2**15) * (200 / fftsize)
+        self.samples  = numpy.zeros(fftsize)
+
+        self.colwidth = None
+        self.colstart = None
+
+    def _mapcolumns(self, width):
+        """ Calculate the first FFT bin of every pixel column, logarithmically spaced. """
+        nbins = self.fftsize // 2
+        edges = numpy.logspace(0, numpy.log10(nbins), width + 1)
+        self.colstart = numpy.minimum(edges[:-1].astype(int) - 1, nbins - 1)
+        self.colwidth = width
 
     def paintEvent(self, evt):
         painter = QtGui.QPainter(self)
         painter.fillRect(evt.rect(), self.palette().color(QtGui.QPalette.Window))
 
-        if len(self.points) == 0:
+        if self.spectrum is None:
+            return
+
+        rect   = self.rect()
+        width  = rect.width()
+        height = rect.height()
+        if width < 2:
             return
+        if self.colwidth != width:
+            self._mapcolumns(width)
+
+        # reduceat yields the maximum of each column's bins, or the single bin for
+        # columns that share one with their right neighbour.
+        columns = numpy.maximum.reduceat(self.spectrum, self.colstart)
+        heights = numpy.minimum(numpy.log10(numpy.sqrt(columns) + 1.) * height, height).astype(int)
+
+        bottom = rect.top() + height
+        points = numpy.empty((width + 2, 2), int)
+        points[0]       = (rect.left(), bottom)
+        points[1:-1, 0] = numpy.arange(width) + rect.left()
+        points[1:-1, 1] = bottom - heights
+        points[-1]      = (rect.left() + width - 1, bottom)
 
-        top    = evt.rect().top()
-        left   = evt.rect().left()
-        width  = evt.rect().width()
-        height = evt.rect().height()
-        plen = max(int(1 / float(width) * len(self.points)), 1)
-        for x in xrange(width):
-            pstart = int(x / width * len(self.points))
-            prange = self.points[pstart:pstart + plen]
-            thing = int(max(numpy.log10(numpy.sqrt(prange) + 1.)) * height)
-            painter.drawLine( left + x, top + height, left + x, top + height - thing)
+        polygon = QtGui.QPolygon()
+        polygon.setPoints(points.ravel().tolist())
+        painter.setBrush(QtGui.QBrush(painter.pen().color()))
+        painter.drawPolygon(polygon)
 
     def __call__(self, chunk):
         if not chunk:
-            self.points = []
+            self.spectrum = None
+            self.update()
+            return
+
+        now = time()
+        if now - self.lastrun < 1 / self.maxrate:
             return
+        self.lastrun = now
 
-        # we only need data for self.columns * 2 for FFT * 2 channels * 2 bytes per sample
-        mono = audioop.tomono(chunk[:self.columns * 2 * 2 * 2], 2, 0.5, 0.5)
-        mono = numpy.frombuffer(mono, numpy.short)
-        y = fft(mono / float(2**15))
+        # mix down to mono in the reused sample buffer, zero-padded if the chunk is too short
+        data = numpy.frombuffer(chunk, numpy.int16)
+        count = min(len(data) // 2, self.fftsize)
+        self.samples[:count]  = data[0:count * 2:2]
+        self.samples[:count] += data[1:count * 2:2]
+        self.samples[count:]  = 0
+        self.samples *= self.window
 
-        self.points = abs(y[1:self.columns])
+        self.spectrum = numpy.abs(numpy.fft.rfft(self.samples)[1:])
         self.update()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from time import time
+from Queue import Queue
+
+from PyQt4 import QtCore
+
+from metacache import stat_key
+
+
+class AvailabilityTracker(QtCore.QObject):
+    """ Knows which files exist, without ever making the caller wait for the disk.
+
+            AvailabilityTracker(ttl=60, workers=2)
+
+        Files are stat()ed by a few background threads, so a stat that hangs
+        (like on a share that has gone away) only holds up the check of that
+        file. Results are kept for ``ttl`` seconds; asking for a file whose
+        result is older than that returns the old result, and has the file
+        checked again.
+
+        sig_changed is emitted with the path whenever a file turns out to have
+        appeared or disappeared.
+    """
+    sig_changed = QtCore.SIGNAL( 'changed(const QString)' )
+
+    def __init__(self, ttl=60, workers=2):
+        QtCore.QObject.__init__(self)
+        self.ttl     = ttl
+        self.lock    = threading.Lock()
+        self.status  = {}     # path -> (available, time of the check)
+        self.queued  = set()
+        self.queue   = Queue()
+        self.threads = [ threading.Thread(target=self._worker) for i in range(workers) ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def check(self, path):
+        """ Have the file checked in the background, unless that's already going to happen. """
+        with self.lock:
+            if path in self.queued:
+                return
+            self.queued.add(path)
+        self.queue.put(path)
+
+    def check_many(self, paths):
+        for path in paths:
+            self.check(path)
+
+    def available(self, path):
+        """ Return True or False if we know whether the file is there, None if we don't know yet. """
+        status = self.status.get(path)
+        if status is None or time() - status[1] > self.ttl:
+            self.check(path)
+        if status is None:
+            return None
+        return status[0]
+
+    def is_dead(self, path):
+        """ Return True if the file is known to be missing. Files we don't know about yet are assumed to be fine. """
+        return self.available(path) is False
+
+    def mark_dead(self, path):
+        """ Record that the file could not be opened, without waiting for the next check to find out. """
+        self._record(path, False)
+
+    def _record(self, path, available):
+        old = self.status.get(path)
+        self.status[path] = (available, time())
+        if old is not None and old[0] != available or old is None and not available:
+            self.emit(AvailabilityTracker.sig_changed, path)
+
+    def _worker(self):
+        while True:
+            path = self.queue.get()
+            with self.lock:
+                self.queued.discard(path)
+            self._record(path, stat_key(path) is not None)
@@ -18,46 +18,131 @@
 
 import sys
 
-from os.path import exists
-from shutil import copyfile
+from time import time
 
 from PyQt4 import Qt
 from PyQt4 import QtCore
 
-import audioop
-import ao
-from myffmpeg.ffmpeg import Decoder
+from myffmpeg.ffmpeg import Decoder, Mixer, FileError, CURVE_LINEAR
+from metacache import info_from_decoder
+from playlistfile import read_playlist, write_playlist
+from availability import AvailabilityTracker
+from playclock import PlaybackClock
+from output import Output, open_output
+from loudness import REFERENCE_LOUDNESS, replaygain_from_tags, gain_factor
 import threading
 
 from ConfigParser import ConfigParser
 from Queue import Queue
+from collections import deque
+from itertools import islice
+
+
+class SourceStats(object):
+    """ Counters shared by all the Sources a Player creates. """
+    def __init__(self):
+        self.underruns = 0
+        self.chunks    = 0
 
 
 class Source(QtCore.QObject):
+    """ Decodes a file in a background thread and hands out its audio data.
+
+            Source(path, buffer_high=2.0, buffer_low=1.0, stats=None, loudness=None, verbose=False)
+
+        The decoder runs ahead of playback in its own thread, filling a queue with
+        chunks until ``buffer_high`` seconds of audio are waiting. Then it pauses
+        until the queue has been drained to ``buffer_low`` seconds. next() only
+        pops chunks off the queue, so slow disks or decoder hiccups don't go
+        straight to the sound card. Whenever next() has to wait for the decoder
+        anyway, that's counted as an underrun (in self.underruns, and in the
+        SourceStats object given as ``stats``).
+
+        The file's info is taken from the opened decoder. With ``verbose``, the
+        decoder's dump_format() output is printed.
+
+        The gain is taken from the file's ReplayGain tags, or from ``loudness``
+        (a tuple of the measured loudness and peak) if there are none. It is
+        reduced as far as necessary to keep the peak from clipping. Source never
+        touches the MetaCache itself, since it may be created in the Player thread.
+    """
     sig_start  = QtCore.SIGNAL( 'start(const QString)' )
 
-    def __init__(self, path):
+    def __init__(self, path, buffer_high=2.0, buffer_low=1.0, stats=None, loudness=None, verbose=False):
         QtCore.QObject.__init__(self)
         self.path  = path
         self.fd    = Decoder(path)
         self.title = (path.rsplit( '/', 1 )[1] if "/" in path else path).rsplit('.', 1)[0]
-        self.fd.dump_format()
+        if verbose:
+            self.fd.dump_format()
 
-        if "replaygain_track_gain" in self.fd.metadata:
-            self.gain_db  = float( self.fd.metadata["replaygain_track_gain"].split()[0] )
-            self.gain_fac = 10 ** (self.gain_db/10.)
+        self.info = info_from_decoder(self.fd)
+
+        self.gain_db, self.peak = replaygain_from_tags(self.info["metadata"])
+        if self.gain_db is None and loudness is not None and loudness[0] is not None:
+            self.gain_db = REFERENCE_LOUDNESS - loudness[0]
+            self.peak    = loudness[1]
+        self.gain_fac = gain_factor(self.gain_db, self.peak)
+        if self.gain_db is not None:
             print "ReplayGain: %fdB = %f Gain" % (self.gain_db, self.gain_fac)
-        else:
-            self.gain_fac = 1
 
-        self.in_gen   = self.fd.read()
-        self.out_gen  = self.data()
+        # the decoder outputs 44.1kHz S16 stereo.
+        chunktime = self.fd.chunksize / (44100. * 4)
+        self.buffer_high = max(int(buffer_high / chunktime), 1)
+        self.buffer_low  = min(int(buffer_low  / chunktime), self.buffer_high - 1)
+
+        self.stats     = stats
+        self.underruns = 0
+        self._pos      = 0
+        self._playing  = False
+        self._cond     = threading.Condition()
+        self._start_producer()
+
+    def _start_producer(self):
+        self._queue    = deque() # (chunk, position after that chunk) tuples
+        self._eof      = False
+        self._error    = None
+        self._stopped  = False
+        self._producer = threading.Thread(target=self._produce, args=(self.fd.read(),))
+        self._producer.daemon = True
+        self._producer.start()
+
+    def _produce(self, in_gen):
+        """ Decode chunks into the queue until we're stopped or the file ends. """
+        try:
+            for chunk in in_gen:
+                # the position is calculated here, where we still know which chunk it belongs to.
+                item = (chunk[0], self.fd.position)
+                with self._cond:
+                    if len(self._queue) >= self.buffer_high:
+                        while len(self._queue) > self.buffer_low and not self._stopped:
+                            self._cond.wait()
+                    if self._stopped:
+                        return
+                    self._queue.append(item)
+                    self._cond.notify_all()
+        except Exception, err:
+            with self._cond:
+                self._error = err
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def _stop_producer(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._producer.join()
 
     def start(self):
         self.emit( Source.sig_start, self.path )
 
     def stop(self):
-        pass
+        """ Stop decoding. """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
 
     @property
     def duration(self):
@@ -65,21 +150,212 @@ class Source(QtCore.QObject):
 
     @property
     def pos(self):
-        return self.fd.position
+        """ The position after the last chunk returned by next(). """
+        return self._pos
 
-    def data(self):
-        for chunk in self.in_gen:
-            if self.gain_fac == 1:
-                yield chunk[0]
-            else:
-                yield audioop.mul( chunk[0], 2, self.gain_fac )
-        raise StopIteration
+    @property
+    def buffered(self):
+        """ The number of chunks waiting in the queue. """
+        return len(self._queue)
+
+    def seek(self, seconds):
+        """ Continue playing at the given position. """
+        self._stop_producer()
+        self.fd.seek(seconds)
+        self._pos = seconds
+        self._start_producer()
 
     def next(self):
-        return next(self.out_gen)
+        """ Return the next chunk of audio data. ReplayGain (gain_fac) is applied by the Player's mixer. """
+        with self._cond:
+            if not self._queue and not self._eof:
+                if self._playing:
+                    self.underruns += 1
+                    if self.stats is not None:
+                        self.stats.underruns += 1
+                    print "Buffer underrun in %s" % self.path
+                while not self._queue and not self._eof:
+                    self._cond.wait()
+            if not self._queue:
+                if self._error is not None:
+                    raise self._error
+                raise StopIteration
+            chunk, self._pos = self._queue.popleft()
+            if len(self._queue) <= self.buffer_low:
+                self._cond.notify_all()
+        self._playing = True
+        if self.stats is not None:
+            self.stats.chunks += 1
+        return chunk
+
+class IndexedList(object):
+    """ A list of unique paths that knows the row of each path.
+
+        Paths are mapped to their rows in a dict, so ``in`` is O(1). Changes
+        that shift rows around only remember the first row whose entry might
+        now be wrong; the next index() call for a path behind that row rebuilds
+        the map from there. Any number of changes followed by lookups costs
+        one rebuild, but alternating a change near the front with a lookup near
+        the end costs O(n) per lookup.
+    """
+    def __init__(self, paths=()):
+        self._list  = []
+        self._rows  = {}
+        self._valid = 0    # _rows is correct for all paths before this row
+        self.insert_many(0, paths)
+
+    def __len__(self):
+        return len(self._list)
+
+    def __iter__(self):
+        return iter(self._list)
+
+    def __getitem__(self, index):
+        return self._list[index]
+
+    def __contains__(self, path):
+        return path in self._rows
+
+    def _invalidate(self, row):
+        self._valid = min(self._valid, row)
+
+    def index(self, path):
+        row = self._rows[path]
+        if row < self._valid:
+            return row
+        for row in xrange(self._valid, len(self._list)):
+            self._rows[self._list[row]] = row
+        self._valid = len(self._list)
+        return self._rows[path]
+
+    def append(self, path):
+        if self._valid == len(self._list):
+            self._valid += 1
+        self._rows[path] = len(self._list)
+        self._list.append(path)
+
+    def insert(self, index, path):
+        self.insert_many(index, [path])
+
+    def insert_many(self, index, paths):
+        """ Insert the paths before the given row. They must not be in the list yet. """
+        index = min(index, len(self._list))
+        self._list[index:index] = paths
+        for path in paths:
+            self._rows[path] = index
+        self._invalidate(index)
+
+    def remove(self, path):
+        self.remove_many([path])
+
+    def remove_many(self, paths):
+        """ Remove the given paths, in O(n) total. """
+        if not paths:
+            return
+        if len(paths) == 1:
+            row = self.index(paths[0])
+            del self._list[row]
+            del self._rows[paths[0]]
+            self._invalidate(row)
+            return
+        gone = set(paths)
+        first = min([ self.index(path) for path in gone ])
+        self._list[first:] = [ path for path in self._list[first:] if path not in gone ]
+        for path in gone:
+            del self._rows[path]
+        self._invalidate(first)
+
+    def pop(self, index=-1):
+        path = self._list[index]
+        self.remove(path)
+        return path
+
+
+class JumpQueue(object):
+    """ The queue of songs to be played next, knowing the position of each song.
+
+        Every song gets a sequence number when it is enqueued. Its position is that
+        number minus the sequence number of the song at the head, so popping the
+        head is O(1) and doesn't need to renumber anything. Only removing a song
+        from the middle renumbers the ones behind it.
+
+        The Player pops songs off the head while the GUI adds and removes them,
+        so every method holds the queue's lock. Iterating goes over a copy.
+    """
+    def __init__(self, paths=()):
+        self.lock   = threading.Lock()
+        self._queue = deque()
+        self._seq   = {}
+        self._head  = 0
+        for path in paths:
+            self.append(path)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self._queue))
+
+    def __getitem__(self, index):
+        with self.lock:
+            return self._queue[index]
+
+    def __contains__(self, path):
+        return path in self._seq
+
+    def index(self, path):
+        """ Return the position of path in the queue, or None if it isn't queued. """
+        with self.lock:
+            seq = self._seq.get(path)
+            if seq is None:
+                return None
+            return seq - self._head
+
+    def append(self, path):
+        with self.lock:
+            if path in self._seq:
+                return
+            self._seq[path] = self._head + len(self._queue)
+            self._queue.append(path)
+
+    def popleft(self):
+        """ Remove and return the song at the head, or None if the queue is empty. """
+        with self.lock:
+            return self._popleft()
+
+    def _popleft(self):
+        if not self._queue:
+            return None
+        path = self._queue.popleft()
+        del self._seq[path]
+        self._head += 1
+        return path
+
+    def remove(self, path):
+        """ Remove path from the queue. Returns the position it had, or None if it wasn't queued. """
+        with self.lock:
+            seq = self._seq.get(path)
+            if seq is None:
+                return None
+            pos = seq - self._head
+            if pos == 0:
+                self._popleft()
+                return pos
+            del self._queue[pos]
+            del self._seq[path]
+            for behind in range(pos, len(self._queue)):
+                self._seq[self._queue[behind]] -= 1
+            return pos
+
 
 class Playlist(QtCore.QAbstractTableModel):
-    """ Playlist management object. """
+    """ Playlist management object.
+
+        Whether the files still exist is checked in the background by an
+        AvailabilityTracker. next() and peek_next() skip the ones known to be
+        missing, and the model shows them grayed out.
+    """
 
     sig_append  = QtCore.SIGNAL( 'append(const QString)' )
     sig_insert  = QtCore.SIGNAL( 'insert(const int, const QString)' )
@@ -87,105 +363,147 @@ class Playlist(QtCore.QAbstractTableModel):
     sig_enqueue = QtCore.SIGNAL( 'enqueue(const QString)' )
     sig_dequeue = QtCore.SIGNAL( 'dequeue(const QString)' )
     sig_datachg = QtCore.SIGNAL( 'dataChanged (const QModelIndex, const QModelIndex)' )
+    sig_flush   = QtCore.SIGNAL( 'flushChanges()' )
 
-    def __init__(self):
+    def __init__(self, metacache=None, availability=None):
         QtCore.QObject.__init__(self)
-        self.playlist  = []
-        self.jmpqueue  = []
+        self.metacache = metacache
+        if availability is None:
+            availability = AvailabilityTracker()
+        self.availability = availability
+        self.playlist  = IndexedList()
+        self.jmpqueue  = JumpQueue()
         self.current   = None
         self.stopafter = None
         self.repeat    = None
+        self.position  = None  # where to resume the current track, see loadpls
+        self.resume_position = None
 
         self.currentBg = None
 
         self.playlist_dirty = False
         self.jmpqueue_dirty = False
+        self.journal        = None  # a PlaylistJournal, which gets told about every change
+
+        # Rows that need repainting, as path -> (first column, last column). Changes
+        # are collected here and emitted from the GUI thread once per event loop
+        # iteration, since next() is called by the Player thread.
+        self._changed      = {}
+        self._changed_lock = threading.Lock()
+        self.connect( self, Playlist.sig_flush, self._flush_changed, Qt.Qt.QueuedConnection )
+
+        if metacache is not None:
+            self.connect( metacache, metacache.sig_updated, self._metadata_updated )
+        self.connect( availability, AvailabilityTracker.sig_changed, self._availability_changed )
 
     def loadpls(self, fpath):
-        """ Load the playlist from a .pls file. Silently clears the current playlist. """
-        pls = ConfigParser()
-        if not pls.read(fpath):
+        """ Load the playlist from a .pls or .m3u file. Silently clears the current playlist.
+
+            The file is read in one pass. Whether the files still exist is checked in
+            the background afterwards.
+        """
+        try:
+            filepaths, options = read_playlist(fpath)
+        except IOError:
             raise ValueError("Could not read file")
 
-        self.playlist  = []
-        self.jmpqueue  = []
+        seen = set()
+        uniquepaths = []
+        for path in filepaths:
+            if path not in seen:
+                seen.add(path)
+                uniquepaths.append(path)
+
+        self.beginResetModel()
+        self.playlist  = IndexedList(uniquepaths)
+        self.jmpqueue  = JumpQueue()
         self.current   = None
         self.stopafter = None
         self.repeat    = None
+        self.position  = None
 
-        files = [opt for opt in pls.options("playlist") if opt.startswith("file")]
-        files.sort( cmp=lambda a, b: cmp(int(a[4:]), int(b[4:])) ) # sort numerically by FileXY
-        self.beginInsertRows(QtCore.QModelIndex(), 0, len(files) - 1)
-        for fileopt in files:
-            path = pls.get("playlist", fileopt).decode("utf-8")
-            if not exists(path):
-                print "Input file '%s' does not exist! Adding it anyway though." % path
-            self.playlist.append(path)
-            self.emit(Playlist.sig_append, path)
-        self.endInsertRows()
+        def pathOrNone(value):
+            # rows in the file are 1-based; ignore the ones that don't point to an entry
+            try:
+                row = int(value) - 1
+            except ValueError:
+                return None
+            if not 0 <= row < len(filepaths):
+                return None
+            return filepaths[row]
+
+        def intOrNone(name):
+            path = pathOrNone(options.get(name, "None"))
+            if path is None:
+                return None
+            # duplicate entries in the file have been dropped, so the row may differ
+            return self.playlist.index(path)
+
+        self.stopafter = intOrNone("stopafter")
+        self.current   = intOrNone("current")
+        self.repeat    = intOrNone("repeat")
+
+        if options.get("position", "None") != "None" and self.current is not None:
+            self.position = float(options["position"])
+
+        queuestr = options.get("queue", "").strip()
+        if queuestr:
+            queued = [ pathOrNone(idx) for idx in queuestr.split() ]
+            self.jmpqueue = JumpQueue([ path for path in queued if path is not None ])
 
-        if pls.has_section("failplay"):
-            def intOrNone(name):
-                if pls.has_option("failplay", name):
-                    value = pls.get("failplay", name)
-                else:
-                    value = "None"
-                if value == "None":
-                    value = None
-                else:
-                    value = int(value) - 1
-                return value
+        self.playlist_dirty = False
+        self.jmpqueue_dirty = False
+        self.endResetModel()
 
-            self.stopafter = intOrNone("stopafter")
-            self.current   = intOrNone("current")
-            self.repeat    = intOrNone("repeat")
+        self.availability.check_many(uniquepaths)
+        return self
+
+    def _log(self, *entry):
+        if self.journal is not None:
+            self.journal.log(entry)
 
-            if pls.has_option("failplay", "queue"):
-                queuestr = pls.get("failplay", "queue").strip()
-                if queuestr:
-                    self.jmpqueue  = [ self.playlist[int(idx) - 1] for idx in queuestr.split(' ') ]
+    def snapshot(self):
+        """ Copy what writepls() needs to write, and mark the playlist as saved.
 
+            The copy can be written while the playlist keeps changing. The Player
+            only pops songs off the queue in between, and list() copies it in one go.
+        """
+        def intOrNone(something):
+            if something is None:
+                return None
+            return something + 1
+
+        queue = list(self.jmpqueue)  # copied under the queue's lock
         self.playlist_dirty = False
         self.jmpqueue_dirty = False
+        return list(self.playlist), [
+            ("StopAfter", intOrNone(self.stopafter)),
+            ("Repeat",    intOrNone(self.repeat)),
+            ("Current",   intOrNone(self.current)),
+            ("Position",  None if self.position is None else "%.3f" % self.position),
+            ("Queue",     ' '.join([ str(self.playlist.index(path) + 1) for path in queue ])),
+            ]
+
+    def writepls(self, fpath, snapshot=None):
+        """ Write the playlist (or a snapshot() of it) to a file in .pls (or .m3u, if the name says so) format. """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        paths, options = snapshot
+        write_playlist(fpath, paths, self._parse_title, options)
         return self
 
-    def writepls(self, fpath):
-        """ Write the current playlist to a file in .pls format. """
-        if exists( fpath ):
-            copyfile( fpath, fpath+'~' )
-        fd = open(fpath, "wb")
-        try:
-            fd.write("[playlist]\n")
-            for i, path in enumerate(self.playlist):
-                i += 1
-                fd.write( ("File%d=%s\n" % (i, path)).encode("utf-8") )
-                fd.write( ("Title%d=%s\n" % (i, self._parse_title(path))).encode("utf-8") )
-                fd.write( "\n" )
-
-            fd.write("NumberOfEntries=%d\n" % len(self.playlist))
-            fd.write("Version=2\n")
-            fd.write( "\n" )
-
-            def intOrNone(something):
-                if something is None:
-                    return None
-                return something + 1
-
-            fd.write("[failplay]\n")
-            fd.write("StopAfter=%s\n" % intOrNone(self.stopafter))
-            fd.write("Repeat=%s\n"    % intOrNone(self.repeat))
-            fd.write("Current=%s\n"   % intOrNone(self.current))
-            fd.write("Queue=%s\n"     % ' '.join([ str(self.playlist.index(path) + 1) for path in self.jmpqueue ]))
-
-            self.playlist_dirty = False
-            self.jmpqueue_dirty = False
-        finally:
-            fd.close()
+    def next(self):
+        """ Move to the next song.
 
-        return self
+            If a position to resume at has been loaded from the playlist file, the
+            current song is returned again, and resume_position is set to where
+            playback should continue.
+
+            Songs that are known to be missing are skipped. Raises StopIteration if
+            there are none left that might be there.
+        """
+        self.resume_position = None
 
-    def next(self):
-        """ Move to the next song. """
         if self.current is not None:
             prevpath = self.playlist[self.current]
         else:
@@ -193,48 +511,81 @@ class Playlist(QtCore.QAbstractTableModel):
 
         if not self.playlist:
             raise StopIteration("No songs in playlist")
-        if self.stopafter is not None and self.current == self.stopafter:
-            self.stopafter = None
-            raise StopIteration("Set to stop after this track")
-        if self.repeat is not None and self.current == self.repeat:
-            pass
-        elif self.jmpqueue:
-            self.jmpqueue_dirty = True
-            path = self.jmpqueue.pop(0)
-            self.emit(Playlist.sig_dequeue, path)
-            self.current = self.playlist.index(path)
-        elif self.current is None or self.current == len(self.playlist) - 1:
-            # Not yet started or at end of list
-            self.current = 0
-        else:
-            self.current += 1
 
-        nextpath = self.playlist[self.current]
+        # every step either moves on in the playlist or pops a song off the queue
+        for step in xrange(len(self.playlist) + len(self.jmpqueue) + 1):
+            if self.position is not None and self.current is not None:
+                # Pick up where we left off when the playlist was saved.
+                self.resume_position = self.position
+                self.position = None
+            elif self.stopafter is not None and self.current == self.stopafter:
+                self.stopafter = None
+                self._log("stopafter", None)
+                raise StopIteration("Set to stop after this track")
+            elif self.repeat is not None and self.current == self.repeat:
+                pass
+            else:
+                # popleft() returns None if the GUI has emptied the queue in the meantime
+                path = self.jmpqueue.popleft()
+                if path is not None:
+                    self.jmpqueue_dirty = True
+                    self._log("dequeue", path)
+                    self.emit(Playlist.sig_dequeue, path)
+                    self.current = self.playlist.index(path)
+                    self._emit_changed(path, 1)
+                    # everything left in the queue moved up one position
+                    for queued in self.jmpqueue:
+                        self._emit_changed(queued, 1)
+                elif self.current is None or self.current == len(self.playlist) - 1:
+                    # Not yet started or at end of list
+                    self.current = 0
+                else:
+                    self.current += 1
 
-        if not exists(nextpath):
-            # skip
-            return self.next()
+            nextpath = self.playlist[self.current]
+            if not self.availability.is_dead(nextpath):
+                break
+            print "Skipping '%s', it is not available." % nextpath
+            self.resume_position = None
+            if self.current == self.repeat:
+                # don't repeat a song we can't play
+                self.repeat = None
+                self._log("repeat", None)
+                self._emit_changed(nextpath, 1)
+        else:
+            raise StopIteration("None of the songs in the playlist are available")
 
-        if prevpath is not None and prevpath != nextpath: # don't emit twice on repeat
-            self._emit_changed(prevpath)
+        if prevpath != nextpath: # don't emit twice on repeat
+            self._log("current", nextpath)
+            if prevpath is not None:
+                self._emit_changed(prevpath)
         self._emit_changed(nextpath)
         return nextpath
 
     def peek_next(self):
-        """ Get the song that is going to be played next. """
+        """ Get the song that is going to be played next, skipping the ones known to be missing. """
         if not self.playlist:
             return None
-        if self.stopafter is not None and self.current == self.stopafter:
-            return None
-        if self.repeat is not None and self.current == self.repeat:
-            return self.playlist[self.current]
-        elif self.jmpqueue:
-            return self.jmpqueue[0]
-        elif self.current is None or self.current == len(self.playlist) - 1:
-            # Not yet started or at end of list
-            return self.playlist[0]
-        else:
-            return self.playlist[self.current + 1]
+        current = self.current
+        queued  = iter(self.jmpqueue)  # a copy, the GUI may change the queue meanwhile
+        for step in xrange(len(self.playlist) + len(self.jmpqueue) + 1):
+            if self.stopafter is not None and current == self.stopafter:
+                return None
+            if self.repeat is not None and current == self.repeat and step == 0:
+                path = self.playlist[current]
+            else:
+                path = next(queued, None)
+                if path is not None:
+                    current = self.playlist.index(path)
+                elif current is None or current == len(self.playlist) - 1:
+                    # Not yet started or at end of list
+                    current = 0
+                else:
+                    current += 1
+                path = self.playlist[current]
+            if not self.availability.is_dead(path):
+                return path
+        return None
 
     @property
     def current_index(self):
@@ -269,97 +620,197 @@ class Playlist(QtCore.QAbstractTableModel):
             self.beginInsertRows(QtCore.QModelIndex(), len(self), len(self))
             self.playlist_dirty = True
             self.playlist.append(path)
+            self._log("append", path)
+            self.availability.check(path)
             self.endInsertRows()
             self.emit(Playlist.sig_append, path)
         return self
 
-    def _remove(self, path):
-        idx = self.playlist.index(path)
-        if idx <= self.current:
-            if self.current > 0:
-                self.current -= 1
-            else:
-                self.current = None
-        if idx == self.repeat:
-            self.repeat = None
-        elif idx < self.repeat:
-            self.repeat -= 1
-        if idx == self.stopafter:
-            self.stopafter = None
-        elif idx < self.stopafter:
-            self.stopafter -= 1
-
-        self.playlist_dirty = True
-        self.playlist.remove(path)
-        self.emit(Playlist.sig_remove, path)
+    def _rows_removed(self, first, last):
+        """ Update current, repeat and stopafter for rows first..last having been removed. """
+        count = last - first + 1
+        if self.current is not None:
+            if self.current > last:
+                self.current -= count
+            elif self.current >= first:
+                if first > 0:
+                    self.current = first - 1
+                else:
+                    self.current = None
+        if self.repeat is not None:
+            if self.repeat > last:
+                self.repeat -= count
+            elif self.repeat >= first:
+                self.repeat = None
+        if self.stopafter is not None:
+            if self.stopafter > last:
+                self.stopafter -= count
+            elif self.stopafter >= first:
+                self.stopafter = None
+
+    def _rows_inserted(self, first, count):
+        if first <= self.current:
+            self.current += count
+        if first <= self.repeat:
+            self.repeat += count
+        if first <= self.stopafter:
+            self.stopafter += count
 
     def remove(self, path):
         """ Remove a file from the playlist.
 
             If it is also in the queue, it will be dequeued first.
         """
-        self.dequeue(path)
-        if path in self.playlist:
-            idx = self.playlist.index(path)
-            self.beginRemoveRows(QtCore.QModelIndex(), idx, idx)
-            self._remove(path)
+        return self.removeMany([path])
+
+    def removeMany(self, paths):
+        """ Remove a number of files from the playlist, dequeueing them first. """
+        for path in paths:
+            self.dequeue(path)
+        rows = sorted(set([ self.playlist.index(path) for path in paths if path in self.playlist ]))
+        if not rows:
+            return self
+        self._log("remove", [ self.playlist[row] for row in rows ])
+        # Remove contiguous ranges of rows, last one first so the earlier rows stay put.
+        last = rows.pop()
+        first = last
+        while first is not None:
+            if rows and rows[-1] == first - 1:
+                first = rows.pop()
+                continue
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            removed = self.playlist[first:last + 1]
+            self.playlist_dirty = True
+            self._rows_removed(first, last)
+            self.playlist.remove_many(removed)
+            for path in removed:
+                self.emit(Playlist.sig_remove, path)
             self.endRemoveRows()
+            if rows:
+                last = first = rows.pop()
+            else:
+                first = None
         return self
 
-    def _insert(self, index, path):
-        self.playlist_dirty = True
-        self.playlist.insert(index, path)
-        self.emit(Playlist.sig_insert, index, path)
-        if index <= self.current:
-            self.current += 1
-        if index <= self.repeat:
-            self.repeat += 1
-        if index <= self.stopafter:
-            self.stopafter += 1
-
     def insert(self, index, path):
         """ Insert a new file before the given index. """
-        if path not in self.playlist:
-            self.beginInsertRows(QtCore.QModelIndex(), index, index)
-            self._insert(index, path)
-            self.endInsertRows()
+        return self.insertMany(index, [path])
+
+    def insertMany(self, index, paths):
+        """ Insert new files before the given index. Files already in the playlist are skipped. """
+        seen = set()
+        newpaths = []
+        for path in paths:
+            if path not in self.playlist and path not in seen:
+                seen.add(path)
+                newpaths.append(path)
+        if not newpaths:
+            return self
+        index = min(index, len(self))
+        self.beginInsertRows(QtCore.QModelIndex(), index, index + len(newpaths) - 1)
+        self.playlist_dirty = True
+        self.playlist.insert_many(index, newpaths)
+        self._log("insert", index, newpaths)
+        self.availability.check_many(newpaths)
+        self._rows_inserted(index, len(newpaths))
+        for offset, path in enumerate(newpaths):
+            self.emit(Playlist.sig_insert, index + offset, path)
+        self.endInsertRows()
         return self
 
     def move(self, index, path):
         """ Move a file to the given index without changing its status in the queue. """
-        oldidx = self.playlist.index(path)
-        if oldidx == index:
+        return self.moveMany(index, [path])
+
+    def moveMany(self, index, paths):
+        """ Move files so they end up in the given order before the given index.
+
+            The index refers to the playlist before the move. Current, repeat and
+            stop-after stay with the songs they belong to.
+        """
+        moving = set()
+        uniquepaths = []
+        for path in paths:
+            if path in self.playlist and path not in moving:
+                moving.add(path)
+                uniquepaths.append(path)
+        paths = uniquepaths
+        if not paths:
             return self
-        self.beginMoveRows(QtCore.QModelIndex(), oldidx, oldidx, QtCore.QModelIndex(), index)
-        repeat    = (oldidx == self.repeat)
-        stopafter = (oldidx == self.stopafter)
-        self._remove(path)
-        self._insert(index, path)
-        if stopafter:
-            self.stopafter = index
-        if repeat:
-            self.repeat = index
-        self.endMoveRows()
+
+        # The first song at or after the target that doesn't move marks where the moved ones go.
+        anchor = None
+        for row in xrange(index, len(self)):
+            if self.playlist[row] not in moving:
+                anchor = self.playlist[row]
+                break
+
+        rows = sorted([ self.playlist.index(path) for path in moving ])
+        if anchor is None:
+            unchanged = rows == range(len(self) - len(rows), len(self))
+        else:
+            anchorrow = self.playlist.index(anchor)
+            unchanged = rows == range(anchorrow - len(rows), anchorrow)
+        if unchanged and [ self.playlist[row] for row in rows ] == paths:
+            return self
+        self._log("move", index, paths)
+
+        def pathOrNone(row):
+            if row is None:
+                return None
+            return self.playlist[row]
+        current   = pathOrNone(self.current)
+        repeat    = pathOrNone(self.repeat)
+        stopafter = pathOrNone(self.stopafter)
+
+        self.emit(QtCore.SIGNAL("layoutAboutToBeChanged()"))
+        persistent = self.persistentIndexList()
+        persistent_paths = [ self.playlist[idx.row()] for idx in persistent ]
+
+        self.playlist_dirty = True
+        self.playlist.remove_many(paths)
+        if anchor is None:
+            self.playlist.insert_many(len(self), paths)
+        else:
+            self.playlist.insert_many(self.playlist.index(anchor), paths)
+
+        def rowOrNone(path):
+            if path is None:
+                return None
+            return self.playlist.index(path)
+        self.current   = rowOrNone(current)
+        self.repeat    = rowOrNone(repeat)
+        self.stopafter = rowOrNone(stopafter)
+
+        self.changePersistentIndexList(persistent, [
+            QtCore.QAbstractTableModel.index(self, self.playlist.index(path), idx.column(), QtCore.QModelIndex())
+            for idx, path in zip(persistent, persistent_paths) ])
+        self.emit(QtCore.SIGNAL("layoutChanged()"))
         return self
 
     def enqueue(self, path):
         """ Enqueue a file, automatically adding it to the playlist if necessary. """
         if path not in self.playlist:
-            self.playlist.append(path)
+            self.append(path)
         if path not in self.jmpqueue:
             self.jmpqueue_dirty = True
             self.jmpqueue.append(path)
+            self._log("enqueue", path)
             self.emit(Playlist.sig_enqueue, path)
-            self._emit_changed(path)
+            self._emit_changed(path, 1)
         return self
 
     def dequeue(self, path):
         """ Remove a file from the queue without changing its status in the playlist. """
-        if path in self.jmpqueue:
+        pos = self.jmpqueue.remove(path)
+        if pos is not None:
             self.jmpqueue_dirty = True
-            self.jmpqueue.remove(path)
+            self._log("dequeue", path)
             self.emit(Playlist.sig_dequeue, path)
-            self._emit_changed(path)
+            self._emit_changed(path, 1)
+            # the songs behind it moved up one position
+            for queued in islice(self.jmpqueue, pos, None):
+                self._emit_changed(queued, 1)
         return self
 
 
@@ -377,8 +828,9 @@ class Playlist(QtCore.QAbstractTableModel):
             oldidx = self.repeat
             self.repeat = idx
             if oldidx is not None:
-                self._emit_changed( self.playlist[oldidx] )
-        self._emit_changed(path)
+                self._emit_changed( self.playlist[oldidx], 1 )
+        self._log("repeat", None if self.repeat is None else path)
+        self._emit_changed(path, 1)
 
     def toggleStopAfter(self, path):
         idx = self.playlist.index(path)
@@ -388,8 +840,9 @@ class Playlist(QtCore.QAbstractTableModel):
             oldidx = self.stopafter
             self.stopafter = idx
             if oldidx is not None:
-                self._emit_changed( self.playlist[oldidx] )
-        self._emit_changed(path)
+                self._emit_changed( self.playlist[oldidx], 1 )
+        self._log("stopafter", None if self.stopafter is None else path)
+        self._emit_changed(path, 1)
 
     def headerData(self, section, orientation, role):
         if role != Qt.Qt.DisplayRole:
@@ -422,9 +875,58 @@ class Playlist(QtCore.QAbstractTableModel):
 
 
     # QAbstractTableModel methods
-    def _emit_changed(self, path):
-        idx = self.index(path, 1)
-        self.emit( self.sig_datachg, idx, idx )
+    def _emit_changed(self, path, column=None):
+        """ Schedule a dataChanged for the given column of the path's row, or the whole row if column is None. """
+        if column is None:
+            first, last = 0, self.columnCount(QtCore.QModelIndex()) - 1
+        else:
+            first, last = column, column
+        with self._changed_lock:
+            schedule = not self._changed
+            if path in self._changed:
+                oldfirst, oldlast = self._changed[path]
+                first, last = min(first, oldfirst), max(last, oldlast)
+            self._changed[path] = (first, last)
+        if schedule:
+            self.emit( Playlist.sig_flush )
+
+    def _flush_changed(self):
+        """ Emit dataChanged for the collected changes, one signal per contiguous block of rows. """
+        with self._changed_lock:
+            changed, self._changed = self._changed, {}
+        rows = sorted([ (self.playlist.index(path), columns) for path, columns in changed.items() if path in self.playlist ])
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end < len(rows) and rows[end][0] == rows[end - 1][0] + 1 and rows[end][1] == rows[start][1]:
+                continue
+            first, last = rows[start][1]
+            self.emit( self.sig_datachg, self.index(rows[start][0], first), self.index(rows[end - 1][0], last) )
+            start = end
+
+    def _metadata_updated(self, path):
+        path = unicode(path)
+        if path in self.playlist:
+            self._emit_changed(path, 0)
+
+    def _availability_changed(self, path):
+        path = unicode(path)
+        if path in self.playlist:
+            self._emit_changed(path)
+
+    def _tooltip(self, path):
+        if self.availability.is_dead(path):
+            return path + u"\n(not available)"
+        if self.metacache is None:
+            return path
+        info = self.metacache.get(path)
+        if info is None:
+            return path
+        tags  = dict([ (key.lower(), value) for key, value in info["metadata"].items() ])
+        lines = [ path ]
+        if "title" in tags:
+            lines.insert(0, u" — ".join([ tags[key] for key in ("artist", "album", "title") if key in tags ]))
+        lines.append( "%d:%02d, %s" % (info["duration"] // 60, info["duration"] % 60, info["codec"]) )
+        return "\n".join(lines)
 
     def __getitem__(self, index):
         """ Return the path of the title at <index>. Index may be an int or a QModelIndex. """
@@ -437,7 +939,7 @@ class Playlist(QtCore.QAbstractTableModel):
             return QtCore.QAbstractTableModel.index(self, path_or_index, column, parent)
 
         idx = self.playlist.index(path_or_index)
-        return QtCore.QAbstractTableModel.index(self, idx, 0, QtCore.QModelIndex())
+        return QtCore.QAbstractTableModel.index(self, idx, column, parent)
 
 
     def data(self, index, role):
@@ -447,17 +949,25 @@ class Playlist(QtCore.QAbstractTableModel):
             if index.row() == self.current and self.currentBg is not None:
                 return self.currentBg
 
+        elif role == Qt.Qt.ForegroundRole:
+            if self.availability.is_dead(path):
+                return Qt.QColor(Qt.Qt.gray)
+
         elif index.column() == 0:
             if role == Qt.Qt.DisplayRole:
                 return self._parse_title(path)
             elif role == Qt.Qt.UserRole:
                 return path
+            elif role == Qt.Qt.ToolTipRole:
+                return self._tooltip(path)
 
         elif index.column() == 1:
             if role == Qt.Qt.DisplayRole:
                 modifiers = []
-                if path in self.jmpqueue:
-                    modifiers.append( unicode(self.jmpqueue.index(path) + 1) )
+                # O(1), this runs for every row that gets painted
+                pos = self.jmpqueue.index(path)
+                if pos is not None:
+                    modifiers.append( unicode(pos + 1) )
                 if index.row() == self.repeat:
                     modifiers.append( u'♻' )
                 if index.row() == self.stopafter:
@@ -488,15 +998,10 @@ class Playlist(QtCore.QAbstractTableModel):
         if row == -1 and parent.isValid():
             row = parent.row()
         if data.hasUrls() and row != -1:
-            for url in data.urls():
-                url = unicode(url.path())
-                if url in self:
-                    self.move(row, url)
-                elif row < len(self):
-                    self.insert(row, url)
-                else:
-                    self.append(url)
-                row += 1
+            paths = [ unicode(url.path()) for url in data.urls() ]
+            # add the new ones at the drop position, then pull the ones we already had in between
+            self.insertMany(row, paths)
+            self.moveMany(row, paths)
             return True
         return False
 
@@ -514,65 +1019,185 @@ class Playlist(QtCore.QAbstractTableModel):
 
 
 
+class PlayerSnapshot(object):
+    """ What can be heard right now, for the UI to poll at its own pace.
+
+        The Player hands every chunk it has written to the output to update(),
+        which files it with the PlaybackClock. ``state`` then looks up the chunk
+        that is coming out of the speakers at the moment, which is a tuple of
+        (serial, source, pos, prev, prevpos, fac, srcdata, prevdata), where prev,
+        prevpos, fac and prevdata are None outside of transitions. pos and prevpos
+        are the positions in seconds the listener is at. The serial increases with
+        every chunk, so pollers can tell whether anything happened since they looked.
+
+        The audio data is only included while ``want_pcm`` is True. Set it while
+        something (like an analyzer) is actually showing it.
+    """
+    def __init__(self, clock):
+        self.clock    = clock
+        self.want_pcm = False
+        self.serial   = 0
+
+    def update(self, nbytes, started, source, srcdata, prev=None, fac=None, prevdata=None):
+        if not self.want_pcm:
+            srcdata = prevdata = None
+        self.serial += 1
+        prevpos = prev.pos if prev is not None else None
+        self.clock.wrote( nbytes, (self.serial, source, source.pos, prev, prevpos, fac, srcdata, prevdata), started )
+
+    @property
+    def state(self):
+        entry, remaining = self.clock.current()
+        if entry is None:
+            return (0, None, 0., None, None, None, None, None)
+        serial, source, pos, prev, prevpos, fac, srcdata, prevdata = entry
+        # the positions are where the chunk ends, and we're not quite there yet
+        if prevpos is not None:
+            prevpos = max(prevpos - remaining, 0)
+        return (serial, source, max(pos - remaining, 0), prev, prevpos, fac, srcdata, prevdata)
+
+
 class Player(QtCore.QObject, threading.Thread):
     sig_transition_start = QtCore.SIGNAL( 'transition_start(const PyQt_PyObject, const PyQt_PyObject)' )
     sig_transition_end   = QtCore.SIGNAL( 'transition_start(const PyQt_PyObject, const PyQt_PyObject)' )
 
-    sig_position_normal  = QtCore.SIGNAL( 'position_normal(const PyQt_PyObject, const QByteArray)' )
-    sig_position_trans   = QtCore.SIGNAL( 'position_trans(const PyQt_PyObject, const PyQt_PyObject, const float, const QString, const QByteArray)' )
-
     sig_started          = QtCore.SIGNAL( 'started(const PyQt_PyObject)' )
     sig_stopped          = QtCore.SIGNAL( 'stopped(const QString)' )
 
-    def __init__(self, pcm, playlist):
+    def __init__(self, pcm, playlist, curve=CURVE_LINEAR, buffer_high=2.0, buffer_low=1.0, metacache=None, loudness=None,
+                 latency=None, period=1024, verbose=False):
         threading.Thread.__init__(self)
         QtCore.QObject.__init__(self)
-        self.pcm      = ao.AudioDevice(pcm)
+        # pcm is an Output, or a spec for open_output
+        if isinstance(pcm, Output):
+            self.pcm  = pcm
+        else:
+            self.pcm  = open_output(pcm, period)
+        self.mixer    = Mixer(curve)
+        self.stats    = SourceStats()
+        if latency is None:
+            latency   = self.pcm.latency
+        self.clock    = PlaybackClock(latency=latency)
+        self.snapshot = PlayerSnapshot(self.clock)
+        self.buffer_high = buffer_high
+        self.buffer_low  = buffer_low
+        self.metacache   = metacache
+        self.loudness    = loudness
+        self.verbose     = verbose
         self.source   = None
         self.playlist = playlist
         self.shutdown = False
 
-        self.preloaded = False
+        self.preloaded = None # the path last sent to the preloader
+        self.preloaded_source  = None
+        self.preloader_lock    = threading.Lock()
         self.preloader_queue   = Queue()
 
         self.preloader_thread = threading.Thread(target=self.preloader)
         self.preloader_thread.daemon = True
         self.preloader_thread.start()
 
+    def _mksource(self, path, cached=False):
+        """ Open a Source for the path.
+
+            With ``cached``, the loudness is looked up in the MetaCache and the file's
+            info is stored there right away. That may have to wait for the disk and the
+            cache's lock, so only the preloader does it. Otherwise, only what the cache
+            already has in memory is used, and storing the info is left to its refresher.
+        """
+        loudness = None
+        if self.metacache is not None:
+            if cached:
+                loudness = self.metacache.get_loudness(path)
+            else:
+                loudness = self.metacache.known_loudness(path)
+        source = Source( path, self.buffer_high, self.buffer_low, self.stats, loudness, self.verbose )
+        if self.metacache is not None:
+            if cached:
+                self.metacache.remember(path, source.info)
+            else:
+                self.metacache.remember_later(path, source.info)
+        return source
+
     def preloader(self):
+        """ Open the next file and let its Source start decoding, so next() only needs to swap it in. """
         while True:
             path = self.preloader_queue.get()
-            if not exists(path):
+            with self.preloader_lock:
+                if self.preloaded_source is not None and self.preloaded_source.path == path:
+                    continue
+            if self.playlist.availability.is_dead(path):
                 continue
-            # This is fucking brutal but it works
-            with open(path, "rb") as fd:
-                fd.read(1024**2)
+            try:
+                source = self._mksource(path, cached=True)
+            except Exception:
+                # next() will run into the same error and deal with it
+                continue
+            with self.preloader_lock:
+                source, self.preloaded_source = self.preloaded_source, source
+            if source is not None:
+                source.stop()
 
     def preload(self):
-        if not self.preloaded:
-            self.preloaded = True
-            nextpath = self.playlist.peek_next()
-            if nextpath is not None:
-                self.preloader_queue.put( nextpath )
+        """ Have the preloader prepare the next song.
+
+            This is cheap enough to be called for every chunk: if the queue or playlist
+            has changed since the last call, the new next song gets preloaded instead.
+        """
+        nextpath = self.playlist.peek_next()
+        if nextpath is not None and nextpath != self.preloaded:
+            self.preloaded = nextpath
+            self.preloader_queue.put( nextpath )
 
     def next(self):
-        """ Create a source for the next item in the playlist. """
-        self.preloaded = False
-        return Source( self.playlist.next() )
+        """ Create a source for the next item in the playlist, or use the preloaded one if it fits.
+
+            Files that can't be opened are marked as dead, so the playlist skips them.
+        """
+        self.preloaded = None
+        path = self.playlist.next()
+        with self.preloader_lock:
+            source, self.preloaded_source = self.preloaded_source, None
+        if source is not None and source.path != path:
+            source.stop()
+            source = None
+        while source is None:
+            try:
+                source = self._mksource(path)
+            except FileError, err:
+                print "Could not open '%s': %s" % (path, err)
+                self.playlist.availability.mark_dead(path)
+                path = self.playlist.next()
+        if self.playlist.resume_position:
+            source.seek( self.playlist.resume_position )
+        if self.loudness is not None:
+            # measure the next song while this one plays, if it has no ReplayGain tags
+            nextpath = self.playlist.peek_next()
+            if nextpath is not None:
+                self.loudness.request(nextpath)
+        return source
 
     def stop(self):
         self.shutdown = True
 
+    def _play(self, data, srcdata, prev=None, fac=None, prevdata=None):
+        """ Write data to the output, and tell the clock which chunks it was made of. """
+        started = time()
+        self.pcm.play( data )
+        self.snapshot.update(len(data), started, self.source, srcdata, prev, fac, prevdata)
+
     def run(self):
         transtime  = 6.0 # crossfade of 6 seconds...
         transearly = 1.4 # that starts a bit early because many tracks have tons of silence at the end
         prev = None
+        lastfac = 1.
         end_of_playlist = False
 
         if self.source is None:
             try:
                 self.source = self.next()
             except StopIteration, e:
+                self.pcm.close()
                 self.emit(Player.sig_stopped, e.message)
                 return
 
@@ -602,8 +1227,10 @@ class Player(QtCore.QObject, threading.Thread):
                 break
 
             if prev is None:
-                self.pcm.play( srcdata )
-                self.emit(Player.sig_position_normal, self.source, srcdata)
+                if self.source.gain_fac == 1:
+                    self._play( srcdata, srcdata )
+                else:
+                    self._play( self.mixer.mix(((srcdata, 1., 1., self.source.gain_fac),)), srcdata )
 
                 if self.source.duration - self.source.pos - transearly <= transtime + 1 and not end_of_playlist:
                     # We'll enter transition in a second, preload the next file.
@@ -622,8 +1249,11 @@ class Player(QtCore.QObject, threading.Thread):
                         self.source.start()
                         self.emit(Player.sig_started, self.source)
                         self.emit(Player.sig_transition_start, prev, self.source)
+                        lastfac = min( max( (prev.duration - prev.pos - transearly), 0 ) / transtime, 1 )
 
             else:
+                # The mixer ramps the gain from where the last chunk ended (lastfac) to where this
+                # one ends (fac) sample by sample, and pads the shorter chunk with silence.
                 try:
                     prevdata = prev.next()
                 except StopIteration:
@@ -631,36 +1261,35 @@ class Player(QtCore.QObject, threading.Thread):
                     self.emit(Player.sig_transition_end, prev, self.source)
                     prev.stop()
                     prev = None
-                    self.pcm.play( srcdata )
-                    self.emit(Player.sig_position_normal, self.source, srcdata)
+                    self._play( self.mixer.mix(((srcdata, 1 - lastfac, 1., self.source.gain_fac),)), srcdata )
                 except Exception:
                     import traceback
                     traceback.print_exc()
                     # some other error happened, just play the other stream in its correct volume
                     fac = max( (prev.duration - prev.pos - transearly), 0 ) / transtime
-                    self.emit(Player.sig_position_trans, prev, self.source, fac, "", srcdata)
-                    self.pcm.play( audioop.mul( srcdata, 2, 1 - fac ) )
+                    self._play( self.mixer.mix(((srcdata, 1 - lastfac, 1 - fac, self.source.gain_fac),)), srcdata, prev, fac )
+                    lastfac = fac
                 else:
                     fac = max( (prev.duration - prev.pos - transearly), 0 ) / transtime
-                    self.emit(Player.sig_position_trans, prev, self.source, fac, prevdata, srcdata)
-                    if len(prevdata) != len(srcdata):
-                        # The last chunk may be too short, causing audioop some pain.
-                        print "Chunk size mismatch (prev=%d, src=%d)" % (len(prevdata), len(srcdata))
-                        if len(prevdata) < len(srcdata):
-                            # looks like this is the case, work around it.
-                            rest = srcdata[len(prevdata):]
-                            srcdata = srcdata[:len(prevdata)]
-                        else:
-                            # doesn't look that way. screw it, then.
-                            self.pcm.play( audioop.mul( srcdata, 2, 1 - fac ) )
-                    else:
-                        rest = None
-                    sample = audioop.add( audioop.mul( prevdata, 2, fac ), audioop.mul( srcdata, 2, 1 - fac ), 2 )
-                    self.pcm.play( sample )
-                    if rest is not None:
-                        self.pcm.play( audioop.mul( rest, 2, 1 - fac ) )
-
+                    self._play( self.mixer.mix((
+                        (prevdata, lastfac,     fac,     prev.gain_fac),
+                        (srcdata,  1 - lastfac, 1 - fac, self.source.gain_fac),
+                        )), srcdata, prev, fac, prevdata )
+                    lastfac = fac
+
+        if self.shutdown:
+            # We've been interrupted, remember where so we can resume there next time. That's
+            # where the listener is, which is a bit behind what has been written.
+            serial, source, pos = self.snapshot.state[:3]
+            if source is self.source:
+                self.playlist.position = pos
+            else:
+                self.playlist.position = max(self.source.pos - self.clock.latency_seconds, 0)
         self.source.stop()
+        with self.preloader_lock:
+            if self.preloaded_source is not None:
+                self.preloaded_source.stop()
+        self.pcm.close()
         self.emit(Player.sig_stopped, "end of playlist")
 
 
@@ -669,15 +1298,21 @@ if __name__ == '__main__':
     import signal
     from optparse import OptionParser
     from datetime import timedelta
+    from metacache import MetaCache
+    from loudness import LoudnessScanner
+    from journal import PlaylistJournal
 
     parser = OptionParser(usage="%prog [options] [<file> ...]\n")
     parser.add_option( "-o", "--out",
-        help="Audio output device. See http://xiph.org/ao/doc/ for supported drivers. Defaults to pulse.",
+        help="Audio output: a libao driver (see http://xiph.org/ao/doc/), alsa:<device>, wav:<file> or null. Defaults to pulse.",
         default="pulse"
         )
     parser.add_option( "-p", "--playlist", help="A file to initialize the playlist from.")
     parser.add_option( "-w", "--writepls", help="A file to write the playlist into. Can be the same as -p.")
     parser.add_option( "-q", "--enqueue",  help="Enqueue the tracks named on the command line.", action="store_true", default=False)
+    parser.add_option( "-r", "--uirate",   help="Status line updates per second. Defaults to 10.", type="float")
+    parser.add_option( "-v", "--verbose",  help="Print information about each file when it is opened.", action="store_true", default=None)
+    parser.add_option( "-l", "--latency",  help="Output latency in seconds. Measured if not given.", type="float")
     options, posargs = parser.parse_args()
 
     conf = ConfigParser()
@@ -695,13 +1330,23 @@ if __name__ == '__main__':
         return default
 
 
-    p = Playlist()
+    app = QtCore.QCoreApplication([])
+
+    metacache = MetaCache()
+    p = Playlist(metacache)
 
     playlistfile = getconf("playlist")
     if playlistfile:
         print "Loading playlist from", playlistfile
         p.loadpls(playlistfile)
 
+    # changes are journaled next to the file we're going to write, so they survive a crash
+    writefile = getconf("writepls")
+    journal   = None
+    if writefile:
+        journal = PlaylistJournal(p, writefile)
+        journal.start(replay=(playlistfile == writefile))
+
     enqueue = getconf("enqueue") in (True, "True")
     for filename in posargs:
         filename = filename.decode("utf-8")
@@ -713,11 +1358,16 @@ if __name__ == '__main__':
     if not playlistfile and posargs:
         p.toggleStopAfter(posargs[-1])
 
-    app = QtCore.QCoreApplication([])
-
-    player = Player(getconf("out", "pulse"), p)
+    latency = getconf("latency")
+    player = Player(getconf("out", "pulse"), p, metacache=metacache, loudness=LoudnessScanner(metacache),
+                    latency=(float(latency) if latency is not None else None), verbose=getconf("verbose") in (True, "True"))
 
     class ConPrinter(QtCore.QObject):
+        def __init__(self, snapshot):
+            QtCore.QObject.__init__(self)
+            self.snapshot = snapshot
+            self.serial   = 0
+
         class Colors:
             gray    = 30
             red     = 31
@@ -746,19 +1396,19 @@ if __name__ == '__main__':
             # \x1b[K = VT100 delete everything right of the cursor
             sys.stdout.write("\r\x1b[K")
 
-        def sourcetext(self, source):
-            return u"%s — %s (%s)" % (source.title, timedelta(seconds=int(source.pos)), timedelta(seconds=int(source.duration)))
+        def sourcetext(self, source, pos):
+            return u"%s — %s (%s)" % (source.title, timedelta(seconds=int(pos)), timedelta(seconds=int(source.duration)))
 
-        def showstatus_normal(self, src):
+        def showstatus_normal(self, src, pos):
             self.termclear()
-            self.colorprint(ConPrinter.Colors.blue, self.sourcetext(src))
+            self.colorprint(ConPrinter.Colors.blue, self.sourcetext(src, pos))
             sys.stdout.flush()
 
-        def showstatus_transition(self, prev, src):
+        def showstatus_transition(self, prev, prevpos, src, pos):
             self.termclear()
-            self.colorprint(ConPrinter.Colors.red,   self.sourcetext(prev))
+            self.colorprint(ConPrinter.Colors.red,   self.sourcetext(prev, prevpos))
             sys.stdout.write(u" → ")
-            self.colorprint(ConPrinter.Colors.green, self.sourcetext(src))
+            self.colorprint(ConPrinter.Colors.green, self.sourcetext(src, pos))
             sys.stdout.flush()
 
         def showstatus_started(self, src):
@@ -771,10 +1421,22 @@ if __name__ == '__main__':
             print "Exit:", msg
             sys.stdout.flush()
 
-    printer = ConPrinter()
+        def poll(self):
+            serial, src, pos, prev, prevpos, fac, srcdata, prevdata = self.snapshot.state
+            if serial == self.serial:
+                return
+            self.serial = serial
+            if prev is None:
+                self.showstatus_normal(src, pos)
+            else:
+                self.showstatus_transition(prev, prevpos, src, pos)
+
+    printer = ConPrinter(player.snapshot)
+
+    timer = QtCore.QTimer()
+    timer.connect( timer, QtCore.SIGNAL("timeout()"), printer.poll )
+    timer.start( int(1000 / float(getconf("uirate", 10))) )
 
-    player.connect( player, Player.sig_position_normal, printer.showstatus_normal     )
-    player.connect( player, Player.sig_position_trans,  printer.showstatus_transition )
     player.connect( player, Player.sig_started, printer.showstatus_started )
     player.connect( player, Player.sig_stopped, printer.showstatus_stop    )
     player.connect( player, Player.sig_stopped, app.quit )
@@ -789,7 +1451,6 @@ if __name__ == '__main__':
 
     app.exec_()
 
-    playlistfile = getconf("writepls")
-    if playlistfile:
-        print "Saving playlist to", playlistfile
-        p.writepls(playlistfile)
+    if journal is not None:
+        print "Saving playlist to", writefile
+        journal.close()
@@ -24,6 +24,9 @@ from ConfigParser import ConfigParser
 from PyQt4 import Qt, QtCore
 
 from failaudio import Playlist, Player
+from metacache import MetaCache
+from loudness import LoudnessScanner
+from journal import PlaylistJournal
 
 
 
@@ -35,13 +38,14 @@ if __name__ == '__main__':
 
     parser = OptionParser(usage="%prog [options] [<file> ...]\n")
     parser.add_option( "-o", "--out",
-        help="Audio output device. See http://xiph.org/ao/doc/ for supported drivers. Defaults to pulse.",
+        help="Audio output: a libao driver (see http://xiph.org/ao/doc/), alsa:<device>, wav:<file> or null. Defaults to pulse.",
         default="pulse"
         )
     parser.add_option( "-d", "--musicdir", help="Library directory", default=None)
     parser.add_option( "-p", "--playlist", help="A file to initialize the playlist from.")
     parser.add_option( "-w", "--writepls", help="A file to write the playlist into. Can be the same as -p.")
     parser.add_option( "-q", "--enqueue",  help="Enqueue the tracks named on the command line.", action="store_true", default=False)
+    parser.add_option( "-l", "--latency",  help="Output latency in seconds. Measured if not given.", type="float")
     options, posargs = parser.parse_args()
 
     conf = ConfigParser()
@@ -59,13 +63,23 @@ if __name__ == '__main__':
         return default
 
 
-    p = Playlist()
+    app = QtCore.QCoreApplication([])
+
+    metacache = MetaCache()
+    p = Playlist(metacache)
 
     playlistfile = getconf("playlist")
     if playlistfile:
         print "Loading playlist from", playlistfile
         p.loadpls(playlistfile)
 
+    # changes are journaled next to the file we're going to write, so they survive a crash
+    writefile = getconf("writepls")
+    journal   = None
+    if writefile:
+        journal = PlaylistJournal(p, writefile)
+        journal.start(replay=(playlistfile == writefile))
+
     enqueue = getconf("enqueue") in (True, "True")
     for filename in posargs:
         if enqueue:
@@ -73,8 +87,9 @@ if __name__ == '__main__':
         else:
             p.append(filename)
 
-    app = QtCore.QCoreApplication([])
-    player = Player(getconf("out", "pulse"), p)
+    latency = getconf("latency")
+    player = Player(getconf("out", "pulse"), p, metacache=metacache, loudness=LoudnessScanner(metacache),
+                    latency=(float(latency) if latency is not None else None))
 
     def main(stdscr):
         stdscr.nodelay(1)
@@ -111,10 +126,12 @@ if __name__ == '__main__':
                 stdscr.addstr(itemIdx - startIdx, 70,
                     p.data(p.index(itemIdx, 1), Qt.Qt.DisplayRole).encode("UTF-8"), clr)
 
-            stdscr.addstr(maxy + 1, 0,
-                (u"%s — %s (%s)" % (player.source.title,
-                    timedelta(seconds=int(player.source.pos)),
-                    timedelta(seconds=int(player.source.duration)))).encode("utf-8"))
+            serial, source, pos = player.snapshot.state[:3]
+            if source is not None:
+                stdscr.addstr(maxy + 1, 0,
+                    (u"%s — %s (%s)" % (source.title,
+                        timedelta(seconds=int(pos)),
+                        timedelta(seconds=int(source.duration)))).encode("utf-8"))
 
             stdscr.refresh()
 
@@ -146,8 +163,8 @@ if __name__ == '__main__':
         curses.wrapper(main)
     finally:
         player.stop()
+        player.join(5)
 
-        playlistfile = getconf("writepls")
-        if playlistfile:
-            print "Saving playlist to", playlistfile
-            p.writepls(playlistfile)
+        if journal is not None:
+            print "Saving playlist to", writefile
+            journal.close()
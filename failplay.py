@@ -29,6 +29,10 @@ from PyQt4 import QtCore
 from PyQt4 import QtGui
 
 from failaudio   import Playlist, Player
+from metacache   import MetaCache
+from loudness    import LoudnessScanner
+from journal     import PlaylistJournal
+from library     import LibraryIndex, LibraryModel
 from ui_failplay import Ui_MainWindow
 
 
@@ -46,30 +50,34 @@ def mkIcon():
 
 
 class FailPlay(Ui_MainWindow, QtGui.QMainWindow ):
-    def __init__(self, outdev, librarydir=os.environ["HOME"]):
+    def __init__(self, outdev, librarydir=os.environ["HOME"], uirate=15, latency=None):
         QtGui.QMainWindow.__init__(self)
         Ui_MainWindow.__init__(self)
 
-        self.playlist = Playlist()
-        self.player   = Player(outdev, self.playlist)
+        self.metacache = MetaCache()
+        self.loudness  = LoudnessScanner(self.metacache)
+        self.playlist = Playlist(self.metacache)
+        self.player   = Player(outdev, self.playlist, metacache=self.metacache, loudness=self.loudness, latency=latency)
 
         self.setupUi(self)
 
         self.connect( self.player, Player.sig_started, self.onPlayerStarted )
         self.connect( self.player, Player.sig_stopped, self.close )
 
-        self.connect( self.player, Player.sig_position_normal, self.onPlayerPositionNormal )
-        self.connect( self.player, Player.sig_position_trans,  self.onPlayerPositionTrans  )
+        # The player only records its state, we look at it uirate times per second.
+        self.snapshot_serial = 0
+        self.uitimer = QtCore.QTimer(self)
+        self.connect( self.uitimer, QtCore.SIGNAL("timeout()"), self.onUiTimer )
+        self.uitimer.start( int(1000 / float(uirate)) )
 
-        self.library = QtGui.QFileSystemModel()
-        self.library.setRootPath(librarydir)
+        self.libindex = LibraryIndex(librarydir, self.metacache)
+        self.library  = LibraryModel(self.libindex, self.metacache)
         self.lstLibrary.setModel(self.library)
-        self.lstLibrary.setRootIndex(self.library.index(librarydir))
-        self.library.setNameFilterDisables(False)
-        self.lstLibrary.hideColumn(2)
-        self.lstLibrary.hideColumn(3)
+        self.lstLibrary.setRootIsDecorated(False)
+        self.lstLibrary.setUniformRowHeights(True)
+        self.libindex.scan()
+        self.libindex.watch()
 
-        self.connect( self.playlist,        Playlist.sig_datachg,                        self.onPlaylistChanged       )
         self.connect( self.leLibraryFilter, QtCore.SIGNAL("textEdited(QString)"),        self.onFilterEdited          )
         self.connect( self.lstLibrary,      QtCore.SIGNAL("doubleClicked(QModelIndex)"), self.onLibraryDoubleClicked  )
         self.connect( self.lstPlaylist,     QtCore.SIGNAL("doubleClicked(QModelIndex)"), self.onPlaylistDoubleClicked )
@@ -170,16 +178,8 @@ class FailPlay(Ui_MainWindow, QtGui.QMainWindow ):
     def onEscPressed(self):
         self.lstPlaylist.clearSelection()
 
-    def onPlaylistChanged(self, topleft, btright):
-        self.lstPlaylist.reset()
-
     def onFilterEdited(self, text):
-        if text:
-            self.library.setNameFilters(["*" + text + "*"])
-            self.lstLibrary.expandAll()
-        else:
-            self.library.setNameFilters([])
-            self.lstLibrary.collapseAll()
+        self.library.setQuery(unicode(text))
 
     def onPlayerStarted(self):
         self.lstPlaylist.scrollTo( self.playlist.index( self.playlist.current ), QtGui.QAbstractItemView.PositionAtCenter )
@@ -211,9 +211,9 @@ class FailPlay(Ui_MainWindow, QtGui.QMainWindow ):
         self.player.stop()
         QtGui.QMainWindow.closeEvent(self, ev)
 
-    def _status_update(self, progressbar, source):
+    def _status_update(self, progressbar, source, pos):
         progressbar.setMaximum(source.duration)
-        progressbar.setValue(source.pos)
+        progressbar.setValue(pos)
         # see if the title is "asd - sdf (some stuff)", and if so, strip the parens
         match = self.titleregex.match(source.title)
         if match is None:
@@ -222,39 +222,52 @@ class FailPlay(Ui_MainWindow, QtGui.QMainWindow ):
             title = match.group("title")
         # Let's abuse setFormat() a little, shall we?
         progressbar.setFormat(
-            u"%s — %s (%s)" % (title, timedelta(seconds=int(source.pos)), timedelta(seconds=int(source.duration)))
+            u"%s — %s (%s)" % (title, timedelta(seconds=int(pos)), timedelta(seconds=int(source.duration)))
             )
 
-    def onPlayerPositionNormal(self, source, srcdata):
+    def onUiTimer(self):
+        snapshot = self.player.snapshot
+        # only have the player hand out audio data if someone's going to look at it
+        snapshot.want_pcm = not self.isMinimized() and (self.anzSong.isVisible() or self.anzPrev.isVisible())
+        serial, source, pos, prev, prevpos, fac, srcdata, prevdata = snapshot.state
+        if serial == self.snapshot_serial:
+            return
+        self.snapshot_serial = serial
+        if prev is None:
+            self.onPlayerPositionNormal(source, pos, srcdata)
+        else:
+            self.onPlayerPositionTrans(prev, prevpos, source, pos, fac, prevdata, srcdata)
+
+    def onPlayerPositionNormal(self, source, pos, srcdata):
         self.intransition  = False
         if not self.invstatusbars:
-            self._status_update(self.pgbSongProgress, source)
+            self._status_update(self.pgbSongProgress, source, pos)
             self.pgbSongProgressPrev.setFormat("Idle")
             self.pgbSongProgressPrev.setMaximum(100)
             self.pgbSongProgressPrev.setValue(0)
             self.sldCrossfade.setValue(0)
             self.anzSong(srcdata)
         else:
-            self._status_update(self.pgbSongProgressPrev, source)
+            self._status_update(self.pgbSongProgressPrev, source, pos)
             self.pgbSongProgress.setFormat("Idle")
             self.pgbSongProgress.setMaximum(100)
             self.pgbSongProgress.setValue(0)
             self.sldCrossfade.setValue(100)
             self.anzPrev(srcdata)
 
-    def onPlayerPositionTrans(self, prev, source, fac, prevdata, srcdata):
+    def onPlayerPositionTrans(self, prev, prevpos, source, pos, fac, prevdata, srcdata):
         if not self.intransition:
             self.intransition  = True
             self.invstatusbars = not self.invstatusbars
         if not self.invstatusbars:
-            self._status_update(self.pgbSongProgress, source)
-            self._status_update(self.pgbSongProgressPrev, prev)
+            self._status_update(self.pgbSongProgress, source, pos)
+            self._status_update(self.pgbSongProgressPrev, prev, prevpos)
             self.sldCrossfade.setValue(fac * 100)
             self.anzSong(srcdata)
             self.anzPrev(prevdata)
         else:
-            self._status_update(self.pgbSongProgressPrev, source)
-            self._status_update(self.pgbSongProgress, prev)
+            self._status_update(self.pgbSongProgressPrev, source, pos)
+            self._status_update(self.pgbSongProgress, prev, prevpos)
             self.sldCrossfade.setValue((1 - fac) * 100)
             self.anzPrev(srcdata)
             self.anzSong(prevdata)
@@ -264,12 +277,14 @@ class FailPlay(Ui_MainWindow, QtGui.QMainWindow ):
 if __name__ == '__main__':
     parser = OptionParser(usage="%prog [options] [<file> ...]\n")
     parser.add_option( "-o", "--out", default=None,
-        help="Audio output device. See http://xiph.org/ao/doc/ for supported drivers. Defaults to pulse."
+        help="Audio output: a libao driver (see http://xiph.org/ao/doc/), alsa:<device>, wav:<file> or null. Defaults to pulse."
         )
     parser.add_option( "-d", "--musicdir", help="Library directory", default=None)
     parser.add_option( "-q", "--enqueue",  help="Enqueue the tracks named on the command line.", action="store_true", default=None)
     parser.add_option( "-p", "--playlist", help="A file to initialize the playlist from.", default=None)
     parser.add_option( "-w", "--writepls", help="A file to write the playlist into. Can be the same as -p.", default=None)
+    parser.add_option( "-r", "--uirate",   help="Display updates per second. Defaults to 15.", type="float", default=None)
+    parser.add_option( "-l", "--latency",  help="Output latency in seconds. Measured if not given.", type="float", default=None)
     options, posargs = parser.parse_args()
 
     conf = ConfigParser()
@@ -287,13 +302,22 @@ if __name__ == '__main__':
         return default
 
     app = QtGui.QApplication( sys.argv )
-    ply = FailPlay(getconf("out", "pulse"), getconf("musicdir", os.environ["HOME"]))
+    latency = getconf("latency")
+    ply = FailPlay(getconf("out", "pulse"), getconf("musicdir", os.environ["HOME"]), float(getconf("uirate", 15)),
+                   float(latency) if latency is not None else None)
 
     playlistfile = getconf("playlist")
     if playlistfile:
         print "Loading playlist from", playlistfile
         ply.playlist.loadpls(playlistfile)
 
+    # changes are journaled next to the file we're going to write, so they survive a crash
+    writefile = getconf("writepls")
+    journal   = None
+    if writefile:
+        journal = PlaylistJournal(ply.playlist, writefile)
+        journal.start(replay=(playlistfile == writefile))
+
     enqueue = getconf("enqueue") in (True, "True")
     for filename in posargs:
         filename = filename.decode("utf-8")
@@ -306,8 +330,9 @@ if __name__ == '__main__':
     ply.start()
 
     app.exec_()
+    # wait for the player to record the position it stopped at
+    ply.player.join(5)
 
-    playlistfile = getconf("writepls")
-    if playlistfile:
-        print "Saving playlist to", playlistfile
-        ply.playlist.writepls(playlistfile)
+    if journal is not None:
+        print "Saving playlist to", writefile
+        journal.close()
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import sys
+
+from time import time
+from multiprocessing import Pool
+
+from metacache import MetaCache, probe, stat_key
+from library import is_audio
+import loudness
+from loudness import needs_analysis, analyze_file
+
+
+def find_files(paths):
+    """ Yield all audio files in or below the given paths. """
+    for path in paths:
+        if os.path.isdir(path):
+            # walk using byte strings, so names that aren't valid UTF-8 can't break the walk
+            for dirpath, dirnames, filenames in os.walk(path.encode("utf-8")):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if is_audio(name):
+                        try:
+                            yield os.path.join(dirpath, name).decode("utf-8")
+                        except UnicodeDecodeError:
+                            print >> sys.stderr, "Skipping '%s', its name is not valid UTF-8." % os.path.join(dirpath, name)
+        elif is_audio(path):
+            yield path
+
+
+def probe_file(task):
+    """ Probe a file in a worker process.
+
+        task is a tuple of the path and the (mtime, size) of its cache entry, or None.
+        Returns a tuple of (path, key, info, error), where info is None if the cache
+        entry is still current, or if probing failed.
+    """
+    path, cachedkey = task
+    key = stat_key(path)
+    if key is None:
+        return path, None, None, "file not found"
+    if key == cachedkey:
+        return path, key, None, None
+    try:
+        info = probe(path)
+    except Exception, err:
+        return path, key, None, str(err)
+    return path, key, info, None
+
+
+class ScanStats(object):
+    def __init__(self):
+        self.started = time()
+        self.total   = 0
+        self.probed  = 0
+        self.skipped = 0
+        self.failed  = 0
+
+    @property
+    def done(self):
+        return self.probed + self.skipped + self.failed
+
+    @property
+    def rate(self):
+        return self.done / max(time() - self.started, 1e-6)
+
+
+def scan(paths, metacache, processes=None, batchsize=200, progress=None):
+    """ Probe all files in or below paths that metacache doesn't know about yet, or
+        that have changed since, in a pool of processes.
+
+        Results are stored in batches of ``batchsize`` files. Since files with current
+        entries are skipped, an interrupted scan simply continues where it left off
+        when started again. ``progress`` is called with the ScanStats after every
+        file. Returns the ScanStats.
+    """
+    metacache.load_all()
+    tasks = []
+    for path in find_files(paths):
+        entry = metacache.entries.get(path)
+        tasks.append( (path, entry[:2] if entry is not None else None) )
+
+    stats = ScanStats()
+    stats.total = len(tasks)
+
+    pool  = Pool(processes)
+    batch = []
+    try:
+        for path, key, info, error in pool.imap_unordered(probe_file, tasks, chunksize=16):
+            if error is not None:
+                print >> sys.stderr, "\nCould not probe '%s': %s" % (path, error)
+                stats.failed += 1
+            elif info is None:
+                stats.skipped += 1
+            else:
+                batch.append( (path, info, key) )
+                stats.probed += 1
+                if len(batch) >= batchsize:
+                    metacache.put_many(batch)
+                    batch = []
+            if progress is not None:
+                progress(stats)
+    finally:
+        pool.terminate()
+        if batch:
+            metacache.put_many(batch)
+    return stats
+
+
+def scan_loudness(paths, metacache, processes=None, progress=None):
+    """ Measure the loudness of all files in or below paths that have no ReplayGain tags
+        and haven't been measured since they last changed, in a pool of processes.
+
+        Expects the files to be in the metacache already, so run scan() first.
+        probed counts the files measured, skipped those that didn't need it.
+        Returns the ScanStats.
+    """
+    metacache.load_all()
+    files = list(find_files(paths))
+    tasks = [ path for path in files if needs_analysis(metacache, path) ]
+
+    stats = ScanStats()
+    stats.total   = len(files)
+    stats.skipped = len(files) - len(tasks)
+
+    pool = Pool(processes)
+    try:
+        for path, key, loudness, peak, seconds, error in pool.imap_unordered(analyze_file, tasks):
+            if error is not None:
+                print >> sys.stderr, "\nCould not analyze '%s': %s" % (path, error)
+                stats.failed += 1
+            else:
+                metacache.put_loudness(path, loudness, peak, key)
+                stats.probed += 1
+            if progress is not None:
+                progress(stats)
+    finally:
+        pool.terminate()
+    return stats
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from ConfigParser import ConfigParser
+
+    parser = OptionParser(usage="%prog [options] [<directory or file> ...]\n")
+    parser.add_option( "-d", "--musicdir",  help="Library directory, scanned if no paths are given.", default=None)
+    parser.add_option( "-j", "--processes", help="Number of processes to probe files with. Defaults to the number of CPUs.", type="int", default=None)
+    parser.add_option( "-b", "--batch",     help="Number of files to store at once.", type="int", default=200)
+    parser.add_option( "-c", "--cache",     help="The metadata cache file. Defaults to ~/.failplay/metacache.db.", default=None)
+    parser.add_option( "-l", "--loudness",  help="Also measure the loudness of files without ReplayGain tags.", action="store_true", default=False)
+    options, posargs = parser.parse_args()
+
+    if options.loudness and loudness.numpy is None:
+        parser.error("measuring loudness needs numpy and scipy")
+
+    conf = ConfigParser()
+    conf.read(os.path.join(os.environ["HOME"], ".failplay", "failplay.conf"))
+
+    paths = [ path.decode("utf-8") for path in posargs ]
+    if not paths:
+        musicdir = options.musicdir
+        if musicdir is None and conf.has_option("options", "musicdir"):
+            musicdir = conf.get("options", "musicdir")
+        if musicdir is None:
+            parser.error("need a directory to scan")
+        paths = [ musicdir.decode("utf-8") ]
+
+    lastprint = [0]
+    def progress(stats):
+        if time() - lastprint[0] < 1 and stats.done != stats.total:
+            return
+        lastprint[0] = time()
+        sys.stdout.write("\r\x1b[K%d/%d files, %d probed, %d unchanged, %d failed, %.1f files/s" % (
+            stats.done, stats.total, stats.probed, stats.skipped, stats.failed, stats.rate))
+        sys.stdout.flush()
+
+    metacache = MetaCache(options.cache)
+    try:
+        stats = scan(paths, metacache, options.processes, options.batch, progress)
+        print
+        print "Done: %d files in %.1f seconds." % (stats.done, time() - stats.started)
+        if options.loudness:
+            print "Measuring loudness..."
+            stats = scan_loudness(paths, metacache, options.processes, progress)
+            print
+            print "Done: %d files in %.1f seconds." % (stats.done, time() - stats.started)
+    except KeyboardInterrupt:
+        print
+        print "Interrupted. Run again to continue where we stopped."
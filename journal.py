@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import json
+import threading
+
+from time import time
+
+from PyQt4 import Qt
+from PyQt4 import QtCore
+
+
+class PlaylistJournal(QtCore.QObject):
+    """ Saves every change to a Playlist right away, without rewriting the whole file.
+
+            PlaylistJournal(playlist, plspath, delay=2.0, compact_entries=1000, compact_interval=600)
+
+        The Playlist calls log() for every change it makes, with a list like
+        ["insert", row, paths] or ["current", path]. Entries are collected in
+        memory and appended to ``plspath`` + ".journal" as JSON lines ``delay``
+        seconds after the first one came in, so a burst of changes only costs
+        one write.
+
+        Every ``compact_interval`` seconds, or when ``compact_entries`` entries
+        have piled up in the journal, the playlist is written to ``plspath`` and
+        the journal is deleted. All of that happens in the GUI thread; log() may
+        be called from any thread.
+
+        Entries are written so that replaying one whose change is already part
+        of the playlist file doesn't change anything, so it doesn't matter if a
+        change made while compacting ends up in both.
+    """
+    sig_logged = QtCore.SIGNAL( 'logged()' )
+
+    def __init__(self, playlist, plspath, delay=2.0, compact_entries=1000, compact_interval=600):
+        QtCore.QObject.__init__(self)
+        self.playlist    = playlist
+        self.plspath     = plspath
+        self.journalpath = plspath + ".journal"
+        self.compact_entries = compact_entries
+
+        self.lock    = threading.Lock()
+        self.pending = []  # JSON lines that haven't been written yet
+        self.entries = 0   # lines in the journal file
+
+        self.flushtimer = QtCore.QTimer(self)
+        self.flushtimer.setSingleShot(True)
+        self.flushtimer.setInterval( int(delay * 1000) )
+        self.connect( self.flushtimer, QtCore.SIGNAL("timeout()"), self.flush )
+
+        self.compacttimer = QtCore.QTimer(self)
+        self.compacttimer.setInterval( int(compact_interval * 1000) )
+        self.connect( self.compacttimer, QtCore.SIGNAL("timeout()"), self.compact )
+
+        # log() may be called by the Player thread, but the timer lives in ours
+        self.connect( self, PlaylistJournal.sig_logged, self._restart_flushtimer, Qt.Qt.QueuedConnection )
+
+    def start(self, replay=True):
+        """ Replay the journal (or throw it away if replay is False), then start logging changes.
+
+            Only replay the journal if the playlist has been loaded from plspath.
+        """
+        if replay and os.path.exists(self.journalpath):
+            start = time()
+            count, complete = self.replay()
+            print "Replayed %d playlist changes in %.3f seconds." % (count, time() - start)
+            self.entries = count
+            self.playlist.journal = self
+            if not complete:
+                # don't append to a broken line, even if there was nothing before it to replay
+                self.compact(force=True)
+        else:
+            if os.path.exists(self.journalpath):
+                os.unlink(self.journalpath)
+            self.playlist.journal = self
+        self.compacttimer.start()
+
+    def replay(self):
+        """ Apply the changes in the journal to the playlist.
+
+            Returns a tuple of (entries replayed, whether the journal was complete).
+            The last line may be missing or cut off if we crashed while writing it.
+        """
+        playlist = self.playlist
+        count = 0
+        with open(self.journalpath, "rb") as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    return count, False
+                op, args = entry[0], entry[1:]
+                if op == "append":
+                    playlist.append(args[0])
+                elif op == "insert":
+                    playlist.insertMany(args[0], args[1])
+                elif op == "remove":
+                    playlist.removeMany(args[0])
+                elif op == "move":
+                    playlist.moveMany(args[0], args[1])
+                elif op == "enqueue":
+                    playlist.enqueue(args[0])
+                elif op == "dequeue":
+                    playlist.dequeue(args[0])
+                elif op in ("current", "repeat", "stopafter"):
+                    if args[0] is None or args[0] not in playlist:
+                        row = None
+                    else:
+                        row = playlist.indexOf(args[0])
+                    setattr(playlist, op, row)
+                    if op == "current":
+                        # the journal doesn't know how far we got into it
+                        playlist.position = None
+                count += 1
+        return count, True
+
+    def log(self, entry):
+        """ Remember a change to be written to the journal soon. """
+        with self.lock:
+            schedule = not self.pending
+            self.pending.append(json.dumps(entry) + "\n")
+        if schedule:
+            self.emit( PlaylistJournal.sig_logged )
+
+    def _restart_flushtimer(self):
+        self.flushtimer.start()
+
+    def flush(self):
+        """ Append the pending entries to the journal, and compact it if it got too long. """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with open(self.journalpath, "ab") as fd:
+            fd.writelines(pending)
+            fd.flush()
+            os.fsync(fd.fileno())
+        self.entries += len(pending)
+        if self.entries >= self.compact_entries:
+            self.compact()
+
+    def compact(self, force=False):
+        """ Write the playlist file and start over with an empty journal, if anything has changed. """
+        if not force and not self.playlist.dirty and not self.entries and not self.pending:
+            return
+        # Everything logged so far is part of the snapshot. Entries logged while it is
+        # being written stay pending: replaying them on top of the file does no harm.
+        with self.lock:
+            snapshot = self.playlist.snapshot()
+            taken    = len(self.pending)
+        self.playlist.writepls(self.plspath, snapshot)
+        with self.lock:
+            del self.pending[:taken]
+        if os.path.exists(self.journalpath):
+            os.unlink(self.journalpath)
+        self.entries = 0
+
+    def close(self):
+        """ Stop logging and save the playlist. """
+        self.flushtimer.stop()
+        self.compacttimer.stop()
+        self.playlist.journal = None
+        self.compact(force=True)
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import threading
+
+from time import sleep
+from bisect import bisect_right
+from Queue import Queue
+
+from PyQt4 import Qt
+from PyQt4 import QtCore
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+AUDIO_EXTENSIONS = ("mp3", "ogg", "oga", "opus", "flac", "wav", "m4a", "aac", "wma", "mpc", "ape", "wv")
+
+# tags that are searched along with the path
+SEARCH_TAGS = ("artist", "albumartist", "album", "title", "genre")
+
+
+def is_audio(path):
+    return path.rsplit(".", 1)[-1].lower() in AUDIO_EXTENSIONS
+
+
+class LibraryIndex(QtCore.QObject):
+    """ Knows all the audio files below the library directory.
+
+        The list of files is kept in ~/.failplay/library.idx, so it's available
+        right away on startup. scan() walks the directory tree in a number of
+        threads to bring it up to date, and if pyinotify is installed, watch()
+        keeps track of changes after that.
+
+        query() finds all files whose path or tags (taken from the MetaCache, if
+        given) contain every word of the query. What it searches is rebuilt by a
+        thread of its own, ``delay`` seconds after something has changed, so the
+        GUI thread never has to wait for that. sig_changed is emitted after a
+        rebuild if files have been added or removed.
+    """
+    sig_changed = QtCore.SIGNAL( 'changed()' )
+
+    def __init__(self, root, metacache=None, indexpath=None, workers=4, delay=1.0):
+        QtCore.QObject.__init__(self)
+        self.root      = os.path.join(unicode(root), "")
+        self.metacache = metacache
+        self.workers   = workers
+        if indexpath is None:
+            indexpath = os.path.join(os.environ["HOME"], ".failplay", "library.idx")
+        self.indexpath = indexpath
+
+        self.lock      = threading.Lock()
+        self.paths     = set()
+        self.notifier  = None
+        self.delay     = delay
+
+        # Rebuilt by _rebuild() in the rebuilder thread: all paths (sorted), the lowercase
+        # search text for each path, all texts joined by newlines, and where each text
+        # starts in there. Replaced as a whole, so query() always sees a consistent one.
+        self.search     = ([], [], u"", [])
+        self.tagsloaded = False
+        self.rebuild_wanted = threading.Event()
+        self.paths_changed  = False
+
+        self.load()
+
+        self.rebuilder = threading.Thread(target=self._rebuilder)
+        self.rebuilder.daemon = True
+        self.rebuilder.start()
+
+        if metacache is not None:
+            self.connect( metacache, metacache.sig_updated, self._metadata_updated )
+
+    def load(self):
+        """ Load the file list saved by the last scan, if it was for the same directory. """
+        if not os.path.exists(self.indexpath):
+            return
+        with open(self.indexpath, "rb") as fd:
+            lines = fd.read().decode("utf-8").split(u"\n")
+        if lines[0] != self.root:
+            return
+        with self.lock:
+            self.paths = set([ path for path in lines[1:] if path ])
+        self._changed()
+
+    def save(self):
+        """ Save the file list, so we don't need to wait for a scan to finish next time. """
+        with self.lock:
+            paths = sorted(self.paths)
+        if not os.path.exists(os.path.dirname(self.indexpath)):
+            os.makedirs(os.path.dirname(self.indexpath))
+        tmppath = self.indexpath + ".tmp"
+        with open(tmppath, "wb") as fd:
+            fd.write( u"\n".join([self.root] + paths).encode("utf-8") )
+        os.rename(tmppath, self.indexpath)
+
+    def _changed(self):
+        """ Have the search rebuilt because files have been added or removed. """
+        with self.lock:
+            self.paths_changed = True
+        self.rebuild_wanted.set()
+
+    def _metadata_updated(self, path):
+        # new tags only need to be searchable, there's nothing to show yet
+        if unicode(path) in self.paths:
+            self.rebuild_wanted.set()
+
+    def _rebuilder(self):
+        while True:
+            self.rebuild_wanted.wait()
+            # let a burst of changes (like a scan finding lots of files) settle first
+            sleep(self.delay)
+            self.rebuild_wanted.clear()
+            with self.lock:
+                notify, self.paths_changed = self.paths_changed, False
+            self._rebuild()
+            if notify:
+                self.emit(LibraryIndex.sig_changed)
+
+    def add(self, path):
+        if is_audio(path) and path not in self.paths:
+            with self.lock:
+                self.paths.add(path)
+            self._changed()
+
+    def remove(self, path):
+        if path in self.paths:
+            with self.lock:
+                self.paths.discard(path)
+            self._changed()
+
+    def remove_tree(self, dirpath):
+        prefix = os.path.join(dirpath, "")
+        with self.lock:
+            self.paths = set([ path for path in self.paths if not path.startswith(prefix) ])
+        self._changed()
+
+    def walk(self, dirpath):
+        """ Walk the directory tree in a pool of threads and return the set of audio files found. """
+        found = set()
+        dirs  = Queue()
+
+        def worker():
+            while True:
+                curdir = dirs.get()
+                if curdir is None:
+                    return
+                try:
+                    names = os.listdir(curdir)
+                except OSError:
+                    names = []
+                for name in names:
+                    if not isinstance(name, unicode):
+                        # not decodable in the file system encoding, we can't handle that anyway
+                        continue
+                    path = os.path.join(curdir, name)
+                    if os.path.isdir(path):
+                        dirs.put(path)
+                    elif is_audio(path):
+                        with self.lock:
+                            found.add(path)
+                            isnew = path not in self.paths
+                            self.paths.add(path)
+                        if isnew:
+                            self._changed()
+                dirs.task_done()
+
+        threads = [ threading.Thread(target=worker) for i in range(self.workers) ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        dirs.put(dirpath)
+        dirs.join()
+        for thread in threads:
+            dirs.put(None)
+        return found
+
+    def scan(self):
+        """ Bring the index up to date in the background. """
+        thread = threading.Thread(target=self._scan)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _scan(self):
+        found = self.walk(self.root)
+        with self.lock:
+            self.paths &= found
+        self._changed()
+        self.save()
+
+    def watch(self):
+        """ Watch the library directory for changes. Returns False if pyinotify isn't available. """
+        if pyinotify is None:
+            return False
+        index = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                path = event.pathname
+                if not isinstance(path, unicode):
+                    try:
+                        path = path.decode("utf-8")
+                    except UnicodeDecodeError:
+                        return
+                gone = event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM)
+                if event.dir:
+                    if gone:
+                        index.remove_tree(path)
+                    else:
+                        index.walk(path)
+                elif gone:
+                    index.remove(path)
+                else:
+                    index.add(path)
+
+        wm = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(wm, Handler())
+        self.notifier.daemon = True
+        self.notifier.start()
+        mask = pyinotify.IN_CREATE | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_DELETE | \
+               pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+        wm.add_watch(self.root.encode("utf-8"), mask, rec=True, auto_add=True)
+        return True
+
+    def _searchtext(self, path):
+        text = path[len(self.root):]
+        info = self.metacache.peek(path) if self.metacache is not None else None
+        if info is not None:
+            for key, value in info["metadata"].items():
+                if key.lower() in SEARCH_TAGS:
+                    if isinstance(value, str):
+                        value = value.decode("utf-8", "replace")
+                    text += u" " + value
+        return text.lower()
+
+    def _rebuild(self):
+        if self.metacache is not None and not self.tagsloaded:
+            self.metacache.load_all()
+            self.tagsloaded = True
+        with self.lock:
+            paths = sorted(self.paths)
+        texts   = [ self._searchtext(path).replace(u"\n", u" ") for path in paths ]
+        offsets = []
+        offset  = 0
+        for text in texts:
+            offsets.append(offset)
+            offset += len(text) + 1
+        self.search = (paths, texts, u"\n".join(texts), offsets)
+
+    def query(self, text):
+        """ Return the sorted paths whose search text contains every word in text.
+
+            This searches what the last rebuild found, it never waits for one.
+        """
+        paths, texts, blob, offsets = self.search
+        words = sorted(text.lower().split(), key=len, reverse=True)
+        if not words:
+            return list(paths)
+
+        # The longest word is most likely the rarest one. If it is rare, searching the
+        # blob for it (which is done in C) is a lot faster than looking at every entry.
+        # The other words are then only checked for the entries it matched in.
+        if blob.count(words[0]) * 20 < len(texts):
+            hits = []
+            pos  = blob.find(words[0])
+            while pos != -1:
+                idx = bisect_right(offsets, pos) - 1
+                hits.append(idx)
+                if idx + 1 == len(offsets):
+                    break
+                pos = blob.find(words[0], offsets[idx + 1])
+        else:
+            hits = [ idx for idx, text in enumerate(texts) if words[0] in text ]
+        for word in words[1:]:
+            hits = [ idx for idx in hits if word in texts[idx] ]
+        return [ paths[idx] for idx in hits ]
+
+
+class LibraryModel(QtCore.QAbstractTableModel):
+    """ Shows the result of a LibraryIndex query. """
+
+    def __init__(self, library, metacache=None):
+        QtCore.QAbstractTableModel.__init__(self)
+        self.library   = library
+        self.metacache = metacache
+        self.text      = u""
+        self.results   = []
+        self.rows      = {}
+
+        self.connect( library, LibraryIndex.sig_changed, self.refresh )
+        if metacache is not None:
+            self.connect( metacache, metacache.sig_updated, self._metadata_updated )
+        self.refresh()
+
+    def setQuery(self, text):
+        self.text = text
+        self.refresh()
+
+    def refresh(self):
+        self.beginResetModel()
+        self.results = self.library.query(self.text)
+        self.rows    = dict([ (path, row) for row, path in enumerate(self.results) ])
+        self.endResetModel()
+
+    def _metadata_updated(self, path):
+        row = self.rows.get(unicode(path))
+        if row is not None:
+            self.emit( QtCore.SIGNAL("dataChanged(const QModelIndex&, const QModelIndex&)"), self.index(row, 1), self.index(row, 1) )
+
+    def filePath(self, index):
+        return self.results[index.row()]
+
+    def rowCount(self, parent):
+        if parent.isValid():
+            return 0
+        return len(self.results)
+
+    def columnCount(self, parent):
+        return 2
+
+    def headerData(self, section, orientation, role):
+        if role != Qt.Qt.DisplayRole or orientation != Qt.Qt.Horizontal:
+            return None
+        if section == 0:
+            return "Name"
+        elif section == 1:
+            return "Length"
+
+    def data(self, index, role):
+        path = self.results[index.row()]
+        if role == Qt.Qt.UserRole or role == Qt.Qt.ToolTipRole:
+            return path
+        if role != Qt.Qt.DisplayRole:
+            return None
+        if index.column() == 0:
+            return path[len(self.library.root):]
+        elif index.column() == 1 and self.metacache is not None:
+            # only the rows that are actually shown get probed
+            info = self.metacache.get(path)
+            if info is not None:
+                return "%d:%02d" % (info["duration"] // 60, info["duration"] % 60)
+
+    def flags(self, index):
+        return Qt.Qt.ItemIsEnabled | Qt.Qt.ItemIsSelectable | Qt.Qt.ItemIsDragEnabled
+
+    def mimeTypes(self):
+        return ["text/uri-list"]
+
+    def mimeData(self, indexes):
+        rows = sorted(set([ index.row() for index in indexes ]))
+        data = QtCore.QMimeData()
+        data.setUrls([ QtCore.QUrl.fromLocalFile(self.results[row]) for row in rows ])
+        return data
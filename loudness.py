@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+from __future__ import division
+
+import os
+import threading
+
+from math import pi, tan, log10
+from Queue import Queue
+from multiprocessing import Pool
+
+from PyQt4 import QtCore
+
+try:
+    import numpy
+    from scipy.signal import lfilter
+except ImportError:
+    numpy = None
+
+from myffmpeg.ffmpeg import Decoder, AV_SAMPLE_FMT_FLT
+from metacache import stat_key
+
+
+# ReplayGain 2.0 normalizes to -18 LUFS.
+REFERENCE_LOUDNESS = -18.
+
+# BS.1770 gating: 400ms blocks every 100ms, -70 LUFS absolute and -10 LU relative gate.
+BLOCK_STEPS   = 4
+ABSOLUTE_GATE = -70.
+RELATIVE_GATE = -10.
+
+# Taps of the filter that interpolates four samples per input sample for the true peak.
+OVERSAMPLING  = 4
+TRUEPEAK_TAPS = 48
+
+
+def replaygain_from_tags(metadata):
+    """ Return the (gain in dB, peak) the ReplayGain tags specify, with None for missing ones. """
+    tags = dict([ (key.lower(), value) for key, value in metadata.items() ])
+    gain = peak = None
+    try:
+        if "replaygain_track_gain" in tags:
+            gain = float( tags["replaygain_track_gain"].split()[0] )
+        if "replaygain_track_peak" in tags:
+            peak = float( tags["replaygain_track_peak"].split()[0] )
+    except (ValueError, IndexError):
+        pass
+    return gain, peak
+
+
+def needs_analysis(metacache, path):
+    """ Check if the file has neither ReplayGain tags nor a current loudness measurement.
+
+        The tags are looked up (and the file probed, if the MetaCache doesn't know
+        it yet), so call this from a background thread.
+    """
+    try:
+        info = metacache.lookup(path)
+    except Exception, err:
+        # if it can't be probed, it can't be analyzed either
+        print "Could not probe '%s': %s" % (path, err)
+        return False
+    if replaygain_from_tags(info["metadata"])[0] is not None:
+        return False
+    return metacache.get_loudness(path) is None
+
+
+def gain_factor(gain_db, peak=None):
+    """ Turn a gain in dB into a factor, reduced as far as necessary for the peak not to clip. """
+    if gain_db is None:
+        return 1.
+    fac = 10 ** (gain_db / 20.)
+    if peak:
+        fac = min(fac, 1. / peak)
+    return fac
+
+
+def k_weighting(samplerate):
+    """ Return (b, a) of the BS.1770 K-weighting filter (a high shelf followed by a high pass).
+
+        The coefficients are calculated for the given sample rate, the same way libebur128 does.
+    """
+    # stage 1: high shelf, models the acoustic effect of the head
+    f0 = 1681.974450955533
+    G  = 3.999843853973347
+    Q  = 0.7071752369554196
+    K  = tan(pi * f0 / samplerate)
+    Vh = 10 ** (G / 20.)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1. + K / Q + K * K
+    b1 = [ (Vh + Vb * K / Q + K * K) / a0, 2. * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0 ]
+    a1 = [ 1., 2. * (K * K - 1.) / a0, (1. - K / Q + K * K) / a0 ]
+
+    # stage 2: RLB high pass
+    f0 = 38.13547087602444
+    Q  = 0.5003270373238773
+    K  = tan(pi * f0 / samplerate)
+    a0 = 1. + K / Q + K * K
+    b2 = [ 1., -2., 1. ]
+    a2 = [ 1., 2. * (K * K - 1.) / a0, (1. - K / Q + K * K) / a0 ]
+
+    return numpy.polymul(b1, b2), numpy.polymul(a1, a2)
+
+
+def truepeak_phases():
+    """ Return the polyphase components of a windowed sinc filter for OVERSAMPLING x interpolation. """
+    t = (numpy.arange(TRUEPEAK_TAPS) - (TRUEPEAK_TAPS - 1) / 2.) / OVERSAMPLING
+    taps = numpy.sinc(t) * numpy.hamming(TRUEPEAK_TAPS)
+    return [ taps[phase::OVERSAMPLING] for phase in range(OVERSAMPLING) ]
+
+
+class LoudnessMeter(object):
+    """ Measures the integrated loudness (EBU R128 / ITU BS.1770) and true peak of a stream.
+
+            LoudnessMeter(samplerate=44100, channels=2)
+
+        Feed it float samples in blocks of any size as (frames, channels) arrays.
+        Every block is filtered in one go, with the filter states carried over
+        to the next one, so the result doesn't depend on how the stream was cut
+        into blocks. Of the filtered signal, only the energy of every 100ms step
+        is kept; the gating needs nothing else.
+    """
+    def __init__(self, samplerate=44100, channels=2):
+        self.samplerate = samplerate
+        self.channels   = channels
+        self.frames     = 0
+        self.peak       = 0.
+
+        self.step    = samplerate // 10
+        self.kb, self.ka = k_weighting(samplerate)
+        self.kstate  = numpy.zeros((len(self.ka) - 1, channels))
+        self.phases  = truepeak_phases()
+        self.pstates = [ numpy.zeros((len(phase) - 1, channels)) for phase in self.phases ]
+
+        self.energies = []               # arrays of the energy of each complete step
+        self.partial  = numpy.zeros(0)   # per-frame energy of the step that isn't complete yet
+
+    def feed(self, samples):
+        if not len(samples):
+            return
+        self.frames += len(samples)
+
+        peak = numpy.abs(samples).max()
+        for idx, phase in enumerate(self.phases):
+            interpolated, self.pstates[idx] = lfilter(phase, [1.], samples, axis=0, zi=self.pstates[idx])
+            peak = max(peak, numpy.abs(interpolated).max())
+        self.peak = max(self.peak, float(peak))
+
+        weighted, self.kstate = lfilter(self.kb, self.ka, samples, axis=0, zi=self.kstate)
+        # all channel weights are 1 for mono and stereo, so the channels can just be summed up
+        energy = numpy.concatenate((self.partial, (weighted ** 2).sum(axis=1)))
+        nsteps = len(energy) // self.step
+        self.energies.append( energy[:nsteps * self.step].reshape(nsteps, self.step).sum(axis=1) )
+        self.partial = energy[nsteps * self.step:]
+
+    @property
+    def loudness(self):
+        """ The integrated loudness in LUFS, or None if the stream was too short or silent. """
+        steps = numpy.concatenate(self.energies) if self.energies else numpy.zeros(0)
+        if len(steps) < BLOCK_STEPS:
+            return None
+        power = numpy.convolve(steps, numpy.ones(BLOCK_STEPS), "valid") / (BLOCK_STEPS * self.step)
+
+        with numpy.errstate(divide="ignore"):
+            blocks = -0.691 + 10 * numpy.log10(power)
+        power = power[blocks > ABSOLUTE_GATE]
+        if not len(power):
+            return None
+        gate  = -0.691 + 10 * log10(power.mean()) + RELATIVE_GATE
+        power = power[-0.691 + 10 * numpy.log10(power) > gate]
+        return -0.691 + 10 * log10(power.mean())
+
+
+def analyze(path, blocksize=65536):
+    """ Decode the file and return (loudness, peak, seconds analyzed).
+
+        Loudness is in LUFS (None for silence), the peak is the true peak as a
+        factor of full scale. ``blocksize`` is the number of frames per block.
+    """
+    decoder = Decoder(path, want_samplefmt=AV_SAMPLE_FMT_FLT, chunksize=blocksize * 8)
+    meter   = LoudnessMeter(44100, 2)
+    for chunk in decoder.read():
+        meter.feed( numpy.frombuffer(chunk[0], numpy.float32).reshape(-1, 2) )
+    return meter.loudness, meter.peak, meter.frames / 44100.
+
+
+def analyze_file(path):
+    """ Analyze a file in a worker process.
+
+        Returns a tuple of (path, key, loudness, peak, seconds, error), where key
+        is the (mtime, size) the file had before analyzing it.
+    """
+    key = stat_key(path)
+    if key is None:
+        return path, None, None, None, 0, "file not found"
+    try:
+        loudness, peak, seconds = analyze(path)
+    except Exception, err:
+        return path, key, None, None, 0, str(err)
+    return path, key, loudness, peak, seconds, None
+
+
+def _init_worker():
+    # analyzing is never urgent, don't take the CPU from the player
+    os.nice(10)
+
+
+class LoudnessScanner(QtCore.QObject):
+    """ Measures the loudness of files that have no ReplayGain tags, in a pool of processes.
+
+            LoudnessScanner(metacache, processes=1)
+
+        request() queues a file for analysis unless it has tags or its current
+        measurement is already stored in the MetaCache. Checking that needs the
+        disk and the MetaCache's lock, so request() leaves it to a thread of the
+        scanner's own and returns right away. Results are stored in the
+        MetaCache as soon as they come in, and sig_analyzed is emitted with the
+        path.
+
+        Without numpy and scipy, nothing gets analyzed and request() returns False.
+    """
+    sig_analyzed = QtCore.SIGNAL( 'analyzed(const QString)' )
+
+    def __init__(self, metacache, processes=1):
+        QtCore.QObject.__init__(self)
+        self.metacache = metacache
+        self.lock      = threading.Lock()
+        self.pending   = set()
+        self.failed    = set()
+        self.queue     = Queue()
+        if numpy is not None:
+            self.pool = Pool(processes, _init_worker)
+            self.thread = threading.Thread(target=self._checker)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.pool = None
+
+    def request(self, path):
+        """ Have the file analyzed in the background if necessary. """
+        if self.pool is None:
+            return False
+        with self.lock:
+            if path in self.pending or path in self.failed:
+                return True
+            self.pending.add(path)
+        self.queue.put(path)
+        return True
+
+    def _checker(self):
+        while True:
+            path = self.queue.get()
+            if needs_analysis(self.metacache, path):
+                self.pool.apply_async(analyze_file, (path,), callback=self._analyzed)
+            else:
+                with self.lock:
+                    self.pending.discard(path)
+
+    def _analyzed(self, result):
+        # called in the pool's result handler thread
+        path, key, loudness, peak, seconds, error = result
+        with self.lock:
+            self.pending.discard(path)
+            if error is not None:
+                self.failed.add(path)
+        if error is not None:
+            print "Could not analyze '%s': %s" % (path, error)
+            return
+        self.metacache.put_loudness(path, loudness, peak, key)
+        self.emit(LoudnessScanner.sig_analyzed, path)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Measure how many seconds of audio the loudness analysis gets through per second.
+#
+# Usage: python loudness_benchmark.py [-s 600] [-j 4] [<file> ...]
+#
+# Without files, only the LoudnessMeter itself is timed, on generated noise. Files
+# are decoded and analyzed in 1..j processes, the way failscan -l does it.
+
+from __future__ import division
+
+import numpy
+
+from time import time
+from multiprocessing import Pool
+from optparse import OptionParser
+
+from loudness import LoudnessMeter, analyze_file
+
+
+def run_meter(seconds, blocksize):
+    noise = (numpy.random.randn(blocksize, 2) * 0.1).astype(numpy.float32)
+    meter = LoudnessMeter(44100, 2)
+    start = time()
+    for i in range(int(seconds * 44100 // blocksize)):
+        meter.feed(noise)
+    meter.loudness
+    return meter.frames / 44100., time() - start
+
+
+def run_files(files, processes):
+    pool  = Pool(processes)
+    audio = 0
+    start = time()
+    for path, key, loudness, peak, seconds, error in pool.imap_unordered(analyze_file, files):
+        if error is not None:
+            print "Could not analyze '%s': %s" % (path, error)
+        audio += seconds
+    wall = time() - start
+    pool.terminate()
+    return audio, wall
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] [<file> ...]\n")
+    parser.add_option( "-s", "--seconds",   help="Seconds of noise to feed the meter.", type="int", default=600 )
+    parser.add_option( "-b", "--blocksize", help="Frames per block fed to the meter.", type="int", default=65536 )
+    parser.add_option( "-j", "--processes", help="Maximum number of processes to analyze files in.", type="int", default=4 )
+    options, posargs = parser.parse_args()
+
+    audio, wall = run_meter(options.seconds, options.blocksize)
+    print "Meter only: %.1f s of audio in %.3f s = %.1f s/s" % (audio, wall, audio / wall)
+
+    if posargs:
+        files = [ path.decode("utf-8") for path in posargs ]
+        print "Processes  Audio (s)  Wall (s)  Audio s/s"
+        for processes in range(1, options.processes + 1):
+            audio, wall = run_files(files, processes)
+            print "%9d  %9.1f  %8.3f  %9.1f" % (processes, audio, wall, audio / wall)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+
+from Queue import Queue
+
+from PyQt4 import QtCore
+
+from myffmpeg import ffmpeg
+
+
+FIELDS = ("duration", "codec", "bitrate", "samplerate", "channels", "metadata")
+
+
+def probe(path):
+    """ Read the file's header and return a dict of the FIELDS. """
+    info = ffmpeg.probe(path)
+    return dict([ (field, info[field]) for field in FIELDS ])
+
+
+def info_from_decoder(decoder):
+    """ Get the FIELDS from an already opened myffmpeg.ffmpeg.Decoder. """
+    return {
+        "duration":   decoder.duration,
+        "codec":      decoder.codec,
+        "bitrate":    decoder.bitrate,
+        "samplerate": decoder.samplerate,
+        "channels":   decoder.channels,
+        "metadata":   decoder.metadata,
+        }
+
+
+def dump_metadata(metadata):
+    try:
+        return json.dumps(metadata)
+    except UnicodeDecodeError:
+        # tags that aren't UTF-8 are most likely latin-1
+        return json.dumps(metadata, encoding="latin-1")
+
+
+def stat_key(path):
+    """ Return the (mtime, size) an entry for this path needs to match, or None if it doesn't exist. """
+    if isinstance(path, unicode):
+        # same as the decoder does
+        path = path.encode("utf-8")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+class MetaCache(QtCore.QObject):
+    """ Caches what probing a file tells us, so we don't need to open it again.
+
+        Entries are stored in an SQLite database (~/.failplay/metacache.db by
+        default), along with the mtime and size the file had when it was probed.
+
+        get() is cheap enough to be called when painting: it answers from memory
+        or the database and never touches the file. The first time a path is
+        asked for, a background thread checks whether the entry is still up to
+        date, probes the file again if it isn't, and emits sig_updated with the
+        path once the new entry is stored.
+
+        lookup() is for when the answer has to be correct right now. It checks
+        the file and probes it in the calling thread if needed.
+
+        remember_later() and known_loudness() never wait for the disk or the
+        database, so they can be used in the Player thread.
+    """
+    sig_updated = QtCore.SIGNAL( 'updated(const QString)' )
+
+    def __init__(self, dbpath=None):
+        QtCore.QObject.__init__(self)
+        if dbpath is None:
+            dbpath = os.path.join(os.environ["HOME"], ".failplay", "metacache.db")
+        if dbpath != ":memory:" and not os.path.exists(os.path.dirname(dbpath)):
+            os.makedirs(os.path.dirname(dbpath))
+
+        # the connection is shared between threads, so all access goes through the lock.
+        self.db   = sqlite3.connect(dbpath, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                path       TEXT PRIMARY KEY,
+                mtime      REAL,
+                size       INTEGER,
+                duration   REAL,
+                codec      TEXT,
+                bitrate    INTEGER,
+                samplerate INTEGER,
+                channels   INTEGER,
+                metadata   TEXT
+                )""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS loudness (
+                path       TEXT PRIMARY KEY,
+                mtime      REAL,
+                size       INTEGER,
+                loudness   REAL,
+                peak       REAL
+                )""")
+            self.db.commit()
+
+        self.entries = {}     # path -> (mtime, size, info) of everything we've loaded so far
+        self.checked = set()  # paths that have been validated (or queued for it) in this session
+        self.loudness_entries = {}  # path -> (loudness, peak) of the measurements we've seen so far
+
+        self.refresh_queue  = Queue()
+        self.refresh_thread = threading.Thread(target=self._refresher)
+        self.refresh_thread.daemon = True
+        self.refresh_thread.start()
+
+    def _load(self, path):
+        if path in self.entries:
+            return self.entries[path]
+        with self.lock:
+            row = self.db.execute("SELECT mtime, size, duration, codec, bitrate, samplerate, channels, metadata "
+                                  "FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        info = dict(zip(FIELDS, row[2:]))
+        info["metadata"] = json.loads(info["metadata"])
+        entry = self.entries[path] = (row[0], row[1], info)
+        return entry
+
+    def put(self, path, info, key=None):
+        """ Store the info for the given path. key is its (mtime, size), which gets looked up if omitted. """
+        self.put_many([ (path, info, key) ])
+
+    def put_many(self, items):
+        """ Store a list of (path, info, key) tuples in one transaction. """
+        rows = []
+        for path, info, key in items:
+            if key is None:
+                key = stat_key(path)
+                if key is None:
+                    continue
+            self.entries[path] = (key[0], key[1], info)
+            rows.append( (path, key[0], key[1]) + tuple([ info[field] for field in FIELDS[:-1] ]) +
+                         (dump_metadata(info["metadata"]),) )
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def get(self, path):
+        """ Return the cached info for the path (possibly outdated) or None, and have it checked in the background. """
+        if path not in self.checked:
+            self.checked.add(path)
+            self.refresh_queue.put( (path, None) )
+        entry = self._load(path)
+        if entry is None:
+            return None
+        return entry[2]
+
+    def peek(self, path):
+        """ Return the cached info for the path or None, without ever checking the file. """
+        entry = self._load(path)
+        if entry is None:
+            return None
+        return entry[2]
+
+    def load_all(self):
+        """ Load all entries from the database into memory in one go, for when we're going to need most of them. """
+        with self.lock:
+            rows = self.db.execute("SELECT path, mtime, size, duration, codec, bitrate, samplerate, channels, metadata "
+                                   "FROM files").fetchall()
+        for row in rows:
+            if row[0] not in self.entries:
+                info = dict(zip(FIELDS, row[3:]))
+                info["metadata"] = json.loads(info["metadata"])
+                self.entries[row[0]] = (row[1], row[2], info)
+
+    def remember(self, path, info):
+        """ Store info (taken from an opened Decoder) for the path, unless our entry is up to date. """
+        key   = stat_key(path)
+        entry = self._load(path)
+        self.checked.add(path)
+        if key is None or entry is not None and entry[:2] == key:
+            return
+        self.put(path, info, key)
+        self.emit(MetaCache.sig_updated, path)
+
+    def remember_later(self, path, info):
+        """ Like remember(), but leave it to the background thread. """
+        self.checked.add(path)
+        self.refresh_queue.put( (path, info) )
+
+    def lookup(self, path):
+        """ Return up-to-date info for the path, probing it if necessary. """
+        key   = stat_key(path)
+        entry = self._load(path)
+        self.checked.add(path)
+        if entry is not None and key is not None and entry[:2] == key:
+            return entry[2]
+        info = probe(path)
+        self.put(path, info, key)
+        return info
+
+    def get_loudness(self, path):
+        """ Return the (loudness, peak) measured for the file, or None if it hasn't been measured since it last changed. """
+        with self.lock:
+            row = self.db.execute("SELECT mtime, size, loudness, peak FROM loudness WHERE path = ?", (path,)).fetchone()
+        if row is None or tuple(row[:2]) != stat_key(path):
+            return None
+        self.loudness_entries[path] = (row[2], row[3])
+        return row[2], row[3]
+
+    def known_loudness(self, path):
+        """ Return the (loudness, peak) get_loudness() or put_loudness() have seen for the file, or None.
+
+            This doesn't check whether the file has changed since it was measured.
+        """
+        return self.loudness_entries.get(path)
+
+    def put_loudness(self, path, loudness, peak, key=None):
+        """ Store the loudness measured for the file. key is its (mtime, size) when it was measured. """
+        if key is None:
+            key = stat_key(path)
+            if key is None:
+                return
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?)", (path, key[0], key[1], loudness, peak))
+            self.db.commit()
+        self.loudness_entries[path] = (loudness, peak)
+
+    def _refresher(self):
+        while True:
+            path, info = self.refresh_queue.get()
+            key  = stat_key(path)
+            if key is None:
+                continue
+            entry = self._load(path)
+            if entry is not None and entry[:2] == key:
+                continue
+            try:
+                if info is None:
+                    info = probe(path)
+                self.put(path, info, key)
+            except Exception, err:
+                print "Could not probe '%s': %s" % (path, err)
+                continue
+            self.emit(MetaCache.sig_updated, path)
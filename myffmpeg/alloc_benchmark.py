@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Count how many bytes get allocated per second of audio while reading a file in
+# 4096 byte chunks, once the old way (one string per frame, concatenated and sliced
+# into chunks) and once using the Decoder's zero-copy read().
+#
+# Usage: python alloc_benchmark.py [-b chunksize] /path/to/some/file.ogg
+#
+# Only the data buffers are counted, Python object headers are not. The old way is
+# emulated on top of the low level read(), which still returns a string per frame.
+#
+# Afterwards, the C module's allocation counters show how many of the buffers handed
+# out by read_many() and resample() had to be malloc()ed, and how many were recycled.
+
+from __future__ import division
+
+import ffmpeg
+
+from optparse import OptionParser
+
+
+def read_strings(fpath, bytes):
+    """ The way Decoder.read() used to do it. """
+    dec = ffmpeg.LowLevelDecoder(fpath)
+    allocated = 0
+    buf = ""
+    while True:
+        try:
+            data = dec.read()[0]
+        except StopIteration:
+            break
+        except ffmpeg.DecodeError:
+            continue
+        allocated += len(data)      # the string created by the C module
+        buf += data
+        allocated += len(buf)       # the concatenated buffer
+        while len(buf) >= bytes:
+            chunk = buf[:bytes]
+            buf   = buf[bytes:]
+            allocated += len(chunk) + len(buf)
+    return allocated, dec.get_duration()
+
+
+class CountingDecoder(object):
+    """ Wraps the low level decoder and counts the bytes it hands out. """
+    def __init__(self, decoder):
+        self.decoder   = decoder
+        self.allocated = 0
+
+    def __getattr__(self, name):
+        return getattr(self.decoder, name)
+
+    def read_many(self, samples):
+        data = self.decoder.read_many(samples)
+        self.allocated += sum([ len(plane) for plane in data ])
+        return data
+
+
+def read_buffers(fpath, bytes):
+    """ The way Decoder.read() does it now. """
+    dec = ffmpeg.Decoder(fpath.decode("utf-8"))
+    dec._decoder = counter = CountingDecoder(dec._decoder)
+    if dec.resampler is not None:
+        print "Note: this file gets resampled, that's not going to be a fair comparison."
+    allocated = 0
+    for chunk in dec.read(bytes):
+        if isinstance(chunk[0], bytearray):
+            # chunks spanning two decoded blocks need to be copied
+            allocated += sum([ len(plane) for plane in chunk ])
+    return allocated + counter.allocated, dec.duration
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] <file>\n")
+    parser.add_option( "-b", "--bytes", help="Chunk size in bytes.", type="int", default=4096 )
+    options, posargs = parser.parse_args()
+
+    if not posargs:
+        parser.error("need a file to decode")
+
+    for name, func in (("strings", read_strings), ("buffers", read_buffers)):
+        ffmpeg.reset_alloc_stats()
+        allocated, duration = func(posargs[-1], options.bytes)
+        print "%-8s %12d bytes allocated, %10.1f KiB per second of audio" % (
+            name, allocated, allocated / duration / 1024)
+
+    stats = ffmpeg.get_alloc_stats()
+    print
+    print "Allocator counters for the buffers run (per second of audio):"
+    for key in ("mallocs", "reallocs", "frees", "recycled", "frames"):
+        print "%-8s %8d  %8.2f/s" % (key, stats[key], stats[key] / duration)
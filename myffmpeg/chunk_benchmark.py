@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Compare the Chunker against the string concatenation it replaced.
+#
+# Usage: python chunk_benchmark.py [-b 1024,4096,16384] file.mp3 file.flac file.ogg file.wav
+#
+# Every file is decoded once up front, so only the cost of cutting the decoded
+# blocks into chunks gets measured. Codecs with large frames (FLAC) used to hurt the
+# string version the most, because every chunk copied the whole rest of the buffer.
+
+from __future__ import division
+
+import ffmpeg
+
+from time import time
+from optparse import OptionParser
+
+
+def decode(fpath):
+    dec = ffmpeg.LowLevelDecoder(fpath)
+    blocks = []
+    while True:
+        try:
+            blocks.append(dec.read_many(1))
+        except StopIteration:
+            break
+        except ffmpeg.DecodeError:
+            pass
+    return dec, blocks
+
+
+def chunk_strings(blocks, bytes):
+    nchunks = 0
+    buf = [""] * len(blocks[0])
+    for block in blocks:
+        for idx, plane in enumerate(block):
+            buf[idx] += str(plane)
+        while len(buf[0]) >= bytes:
+            for idx, plane in enumerate(buf):
+                buf[idx] = plane[bytes:]
+            nchunks += 1
+    return nchunks
+
+
+def chunk_chunker(blocks, bytes):
+    nchunks = 0
+    chunker = ffmpeg.Chunker(len(blocks[0]), bytes)
+    for block in blocks:
+        chunker.feed(block)
+        while len(chunker) >= bytes:
+            chunker.take()
+            nchunks += 1
+    return nchunks
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] <file> [<file> ...]\n")
+    parser.add_option( "-b", "--bytes", help="Comma-separated list of chunk sizes to try.", default="1024,4096,16384" )
+    options, posargs = parser.parse_args()
+
+    if not posargs:
+        parser.error("need files to decode")
+
+    sizes = [ int(size) for size in options.bytes.split(",") ]
+
+    print "%-8s %-6s %6s %7s %12s %12s %8s" % ("Codec", "Layout", "Frame", "Chunk", "strings us", "chunker us", "Speedup")
+    for fpath in posargs:
+        dec, blocks = decode(fpath)
+        if not blocks:
+            print "%s: nothing decoded, skipping" % fpath
+            continue
+        layout = "planar" if len(blocks[0]) > 1 else "packed"
+        frame  = len(blocks[0][0])
+        for bytes in sizes:
+            times = []
+            for func in (chunk_strings, chunk_chunker):
+                start = time()
+                nchunks = func(blocks, bytes)
+                times.append((time() - start) / max(nchunks, 1) * 1e6)
+            print "%-8s %-6s %6d %7d %12.2f %12.2f %7.1fx" % (
+                dec.get_codec(), layout, frame, bytes, times[0], times[1], times[0] / times[1])
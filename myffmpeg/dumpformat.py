@@ -4,5 +4,10 @@
 import sys
 import ffmpeg
 
-rdr = ffmpeg.Decoder(sys.argv[-1])
-rdr.dump_format()
+info = ffmpeg.probe(sys.argv[-1].decode("utf-8"))
+for key in sorted(info):
+    if key != "metadata":
+        print "%-16s %s" % (key, info[key])
+print "Tags:"
+for key in sorted(info["metadata"]):
+    print "    %-12s %s" % (key, info["metadata"][key])
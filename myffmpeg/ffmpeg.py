@@ -16,9 +16,13 @@
  *  GNU General Public License for more details.
 """
 
-from _ffmpeg import Decoder as LowLevelDecoder, Resampler, \
+from collections import deque
+
+from _ffmpeg import Decoder as LowLevelDecoder, Resampler, Buffer, Mixer, \
                     DecodeError, FileError, ResampleError, \
                     get_bytes_per_sample, get_sample_fmt_name, \
+                    get_alloc_stats, reset_alloc_stats, \
+                    probe as low_level_probe, \
                     AV_SAMPLE_FMT_NONE, \
                     AV_SAMPLE_FMT_U8,  \
                     AV_SAMPLE_FMT_S16, \
@@ -31,19 +35,112 @@ from _ffmpeg import Decoder as LowLevelDecoder, Resampler, \
                     AV_SAMPLE_FMT_FLTP, \
                     AV_SAMPLE_FMT_DBLP, \
                     AV_SAMPLE_FMT_NB,   \
+                    AV_CH_LAYOUT_MONO,     \
                     AV_CH_LAYOUT_STEREO,   \
                     AV_CH_LAYOUT_2POINT1,  \
                     AV_CH_LAYOUT_2_1,      \
                     AV_CH_LAYOUT_SURROUND, \
                     AV_CH_LAYOUT_2_2,      \
                     AV_CH_LAYOUT_QUAD,     \
-                    AV_CH_LAYOUT_STEREO_DOWNMIX
+                    AV_CH_LAYOUT_STEREO_DOWNMIX, \
+                    CURVE_LINEAR, CURVE_EQUAL_POWER, CURVE_LOG
+
+
+PLANAR_SAMPLE_FMTS = (AV_SAMPLE_FMT_U8P, AV_SAMPLE_FMT_S16P, AV_SAMPLE_FMT_S32P, AV_SAMPLE_FMT_FLTP, AV_SAMPLE_FMT_DBLP)
+
+
+def probe(fpath, probesize=65536, analyzeduration=500000):
+    """ Return a dict of information about the file's audio stream, without opening the codec.
+
+        The dict contains duration, codec, bitrate, samplerate, channels,
+        channel_layout, samplefmt and the tags as metadata. To be quick about it,
+        only the first ``probesize`` bytes or ``analyzeduration`` microseconds of
+        the file are looked at, which is plenty for audio files. Pass 0 to use
+        libavformat's defaults instead.
+    """
+    return low_level_probe(fpath.encode("utf-8"), probesize=probesize, analyzeduration=analyzeduration)
+
+
+class Chunker(object):
+    """ Cuts decoded blocks of audio data into chunks of a fixed size.
+
+            Chunker(planes=1, chunksize=4096)
+
+        Blocks are tuples containing one buffer per plane (so that's a 1-tuple
+        for interleaved data, and one element per channel for planar data). They
+        are queued up as they are, and chunks are handed out as buffer() views
+        into them, so the cost per chunk does not depend on how much data is
+        buffered. Only chunks that span two blocks need to be copied, and those
+        are copied into a bytearray of exactly ``chunksize`` bytes.
+
+        Handed out chunks stay valid for as long as you keep them around, since
+        the blocks they point into are never modified.
+    """
+
+    def __init__(self, planes=1, chunksize=4096):
+        self.planes    = planes
+        self.chunksize = chunksize
+        self.clear()
+
+    def clear(self):
+        """ Throw away everything that is currently buffered. """
+        self._blocks   = deque() # tuples of decoded buffers, one per plane
+        self._offset   = 0       # how much of self._blocks[0] has already been handed out
+        self._buffered = 0       # how many bytes (per plane) are waiting in self._blocks
+
+    def __len__(self):
+        """ The number of bytes per plane that are currently buffered. """
+        return self._buffered
+
+    def feed(self, block):
+        """ Append a block of data. """
+        if len(block) != self.planes:
+            raise ValueError("expected %d planes, got %d" % (self.planes, len(block)))
+        if len(block[0]):
+            self._blocks.append(block)
+            self._buffered += len(block[0])
+
+    def take(self, bytes=None):
+        """ Remove a chunk of up to ``bytes`` (default: chunksize) bytes per plane
+            from the buffer and return it as a tuple of planes.
+        """
+        if bytes is None:
+            bytes = self.chunksize
+        bytes = min(bytes, self._buffered)
+        if not bytes:
+            return tuple([ "" ] * self.planes)
+
+        block = self._blocks[0]
+        if len(block[0]) - self._offset >= bytes:
+            ret = tuple([ buffer(plane, self._offset, bytes) for plane in block ])
+            self._offset += bytes
+        else:
+            # The chunk spans multiple blocks, so we need to glue it together.
+            ret = tuple([ bytearray(bytes) for plane in block ])
+            done = 0
+            while done < bytes:
+                block = self._blocks[0]
+                length = min(len(block[0]) - self._offset, bytes - done)
+                for idx, plane in enumerate(block):
+                    ret[idx][done:done + length] = buffer(plane, self._offset, length)
+                done += length
+                self._offset += length
+                if self._offset == len(block[0]):
+                    self._blocks.popleft()
+                    self._offset = 0
+
+        if self._blocks and self._offset == len(self._blocks[0][0]):
+            self._blocks.popleft()
+            self._offset = 0
+        self._buffered -= bytes
+        return ret
 
 
 class Decoder(object):
     """ Python wrapper around the low level C module decoder.
 
-            Decoder(fpath)
+            Decoder(fpath, want_samplerate=44100, want_samplefmt=AV_SAMPLE_FMT_S16,
+                    chunksize=4096, readahead=8)
 
         It is used the same way as the C module:
         >>> import ao
@@ -53,25 +150,50 @@ class Decoder(object):
         ...     pcm.play( chunk )
 
         In contrast to the low level Decoder, this class's read() method makes
-        sure to always return the requested number of bytes (except at EOF),
-        even if that requires multiple low level read() calls.
+        sure to always return chunks of ``chunksize`` bytes (except at EOF),
+        even if that requires multiple low level read() calls. To keep the
+        number of calls into the C module down, it decodes ``readahead`` chunks
+        at once using the low level read_many() method.
+
+        The chunks are not copied out of the decoded data, but handed out as
+        buffer() objects pointing into it (see Chunker). Those can be passed
+        to ao, audioop and friends just like strings; use str() if you really
+        need one.
 
         In addition to the properties that retrive information from the Decoder,
         the `position' property calculates the player's position in the file from
-        the amount of bytes already retrieved using the read() method.
+        the timestamps of the decoded frames, minus whatever has been decoded but
+        not yet retrieved using the read() method.
     """
 
-    def __init__(self, fpath, want_samplerate=44100, want_samplefmt=AV_SAMPLE_FMT_S16):
+    def __init__(self, fpath, want_samplerate=44100, want_samplefmt=AV_SAMPLE_FMT_S16, chunksize=4096, readahead=8):
         self._decoder = LowLevelDecoder(fpath.encode("utf-8"))
-        self._buffer  = [""] * (self.channels if self.is_planar else 1)
         self._readbytes = 0
+        self.readahead  = readahead
+        self.want_samplefmt = want_samplefmt
 
-        if self.samplerate != want_samplerate or self.samplefmt != want_samplefmt:
+        if self.samplerate != want_samplerate or self.samplefmt != want_samplefmt or self.channels != 2:
+            # The resampler also takes care of converting mono (or whatever) to stereo.
+            in_layout = self.channel_layout or (AV_CH_LAYOUT_MONO if self.channels == 1 else AV_CH_LAYOUT_STEREO)
             self.resampler = Resampler( output_rate=want_samplerate, input_rate=self.samplerate,
+                input_channel_layout=in_layout,
                 output_sample_format=want_samplefmt, input_sample_format=self.samplefmt )
         else:
             self.resampler = None
 
+        # We always output stereo, so we get either one interleaved plane or two planar ones.
+        if want_samplefmt in PLANAR_SAMPLE_FMTS:
+            self._chunker = Chunker(2, chunksize)
+            self._samplesize = get_bytes_per_sample(want_samplefmt)
+        else:
+            self._chunker = Chunker(1, chunksize)
+            self._samplesize = get_bytes_per_sample(want_samplefmt) * 2
+
+        # Precalculate the factors needed to turn timestamps and buffered bytes into seconds.
+        tb_num, tb_den = self._decoder.get_time_base()
+        self._pts_factor      = tb_num / float(tb_den)
+        self._buffered_factor = 1. / (want_samplerate * self._samplesize)
+
     channels   = property( lambda self: self._decoder.get_channels(),   doc="The number of channels in the input stream." )
     channel_layout = property( lambda self: self._decoder.get_channel_layout(), doc="The channel layout of the input stream." )
     bitrate    = property( lambda self: self._decoder.get_bitrate(),    doc="The bitrate of the input channels." )
@@ -84,30 +206,36 @@ class Decoder(object):
 
     @property
     def is_planar(self):
-        return self.samplefmt in (AV_SAMPLE_FMT_U8P, AV_SAMPLE_FMT_S16P, AV_SAMPLE_FMT_S32P, AV_SAMPLE_FMT_FLTP, AV_SAMPLE_FMT_DBLP)
+        return self.samplefmt in PLANAR_SAMPLE_FMTS
+
+    def _get_chunksize(self):
+        return self._chunker.chunksize
+
+    def _set_chunksize(self, chunksize):
+        self._chunker.chunksize = chunksize
+
+    chunksize = property( _get_chunksize, _set_chunksize, doc="The size of the chunks returned by read() in bytes (per plane)." )
 
     @property
     def position(self):
         """ The player's position in the file in seconds. """
-        # the  "* 2" should be "* self.channels", but since we always return mono
-        # copied to stereo, mono bytes get counted twice, so it evens out.
-        # this mono stuff sucks horribly...
-        return self._readbytes / float(self.samplerate * 2 * get_bytes_per_sample(self.samplefmt))
+        return max( self._decoder.get_pts() * self._pts_factor - len(self._chunker) * self._buffered_factor, 0 )
 
-    def read(self, bytes=4096):
-        """ Get chunks of exactly ``bytes`` length. """
+    def read(self, bytes=None):
+        """ Get chunks of exactly ``bytes`` (default: chunksize) length. """
+        if bytes is not None:
+            self.chunksize = bytes
+        chunker = self._chunker
         while True:
-            while len(self._buffer[0]) < bytes:
+            while len(chunker) < chunker.chunksize:
+                samples = max(chunker.chunksize * self.readahead // self._samplesize, 1)
                 try:
-                    data = self._decoder.read()
-                    if self.channels == 1:
-                        # TODO: hartes Gepfusche
-                        data = (data[0], data[0])
+                    data = self._decoder.read_many(samples)
                     if self.resampler is not None:
                         data = self.resampler.resample(data)
                 except StopIteration:
-                    if self._buffer:
-                        yield tuple(self._buffer)
+                    if len(chunker):
+                        yield chunker.take(len(chunker))
                     raise StopIteration
                 except DecodeError, err:
                     # Ignore DecodeErrors at the very beginning of the file
@@ -116,16 +244,22 @@ class Decoder(object):
                     else:
                         print "Ignoring DecodeError %s in file %s" % (err.message, self.path)
                 else:
-                    for idx, channeldata in enumerate(data):
-                        self._buffer[idx] += channeldata
-                        self._readbytes += len(channeldata)
+                    chunker.feed(data)
+                    self._readbytes += len(data[0]) * len(data)
+
+            yield chunker.take()
 
-            ret = []
-            for idx, channeldata in enumerate(self._buffer):
-                ret.append(channeldata[:bytes])
-                self._buffer[idx] = channeldata[bytes:]
+    def seek(self, seconds):
+        """ Seek to the given position (in seconds) in the file.
 
-            yield tuple(ret)
+            Anything that has been decoded but not yet returned by read() is
+            discarded, so the next chunk read() returns starts at (roughly) the
+            new position.
+        """
+        self._decoder.seek(seconds)
+        if self.resampler is not None:
+            self.resampler.reset()
+        self._chunker.clear()
 
     def dump_format(self):
         """ Dump input file format information to stdout. """
@@ -19,6 +19,9 @@
 
 #include <Python.h>
 #include "structmember.h"
+#include "pythread.h"
+
+#include <math.h>
 
 #include <libavcodec/avcodec.h>
 #include <libavformat/avformat.h>
@@ -53,6 +56,16 @@
 	"             linear=0, cutoff=1 \n"\
 	"   )\n"\
 	""
+#define MIXER_DOCSTRING ""\
+	"This class mixes S16 audio streams, applying a gain envelope to each one.\n"\
+	"\n"\
+	"   Mixer(curve=CURVE_LINEAR, channels=2)\n"\
+	"\n"\
+	"Usage:\n"\
+	">>> mixer = ffmpeg.Mixer(ffmpeg.CURVE_EQUAL_POWER)\n"\
+	">>> # fade out a, fade in b\n"\
+	">>> pcm.play( mixer.mix(((a, 1.0, 0.9), (b, 0.0, 0.1))) )\n"\
+	""
 
 
 static PyObject *FfmpegDecodeError;
@@ -73,6 +86,177 @@ static PyObject *FfmpegFileError;
 
 #define av_sample_format_is_planar(fmt) ((fmt) >= AV_SAMPLE_FMT_U8P && (fmt) <= AV_SAMPLE_FMT_DBLP)
 
+/**
+ * LOCKING
+ *
+ * The heavy lifting (demuxing, decoding, resampling) runs with the GIL released, so
+ * that the Player, the preloader and the GUI don't have to take turns. Every object
+ * carries its own lock so a single Decoder or Resampler can't be entered twice.
+ */
+
+#define ACQUIRE_LOCK(obj) do { \
+	if( !PyThread_acquire_lock((obj)->lock, 0) ){ \
+		Py_BEGIN_ALLOW_THREADS \
+		PyThread_acquire_lock((obj)->lock, 1); \
+		Py_END_ALLOW_THREADS \
+	} } while(0)
+
+#define RELEASE_LOCK(obj) PyThread_release_lock((obj)->lock)
+
+/**
+ * BUFFER
+ *
+ * Decoded audio is handed to Python in these instead of strings. A Buffer simply takes
+ * ownership of the memory the data was decoded into and exposes it through the buffer
+ * protocol, so it can be passed to buffer(), memoryview(), audioop or ao without being
+ * copied.
+ *
+ * When a Buffer dies, its memory is put into a small pool instead of being freed, and
+ * the next Buffer (be it from a Decoder or a Resampler) recycles it. Once playback
+ * has settled, audio data is thereby no longer malloc()ed and free()d at all. The
+ * alloc_stats counters keep track of how well that works, see get_alloc_stats().
+ */
+
+#define BUFFER_POOL_SIZE 32
+
+static struct {
+	uint8_t *data;
+	Py_ssize_t capacity;
+} buffer_pool[BUFFER_POOL_SIZE];
+
+static int buffer_pool_len = 0;
+
+static struct {
+	unsigned long mallocs;  // data blocks allocated from the heap
+	unsigned long reallocs; // data blocks that had to be grown while decoding
+	unsigned long frees;    // data blocks returned to the heap
+	unsigned long recycled; // data blocks taken from the pool
+	unsigned long frames;   // AVFrames allocated
+} alloc_stats;
+
+// Get a block of at least `size' bytes, preferably from the pool. Must be called with the GIL held.
+static uint8_t* ffmpeg_buffer_get( Py_ssize_t size, Py_ssize_t *capacity ){
+	uint8_t *data;
+	int i;
+	
+	// Decoders and Resamplers use differently sized blocks, so look for one that fits.
+	for( i = buffer_pool_len - 1; i >= 0; i-- ){
+		if( buffer_pool[i].capacity >= size ){
+			data      = buffer_pool[i].data;
+			*capacity = buffer_pool[i].capacity;
+			buffer_pool[i] = buffer_pool[--buffer_pool_len];
+			alloc_stats.recycled++;
+			return data;
+		}
+	}
+	
+	if( buffer_pool_len > 0 ){
+		// Nothing fits, so replace one of the small blocks with a larger one.
+		av_free(buffer_pool[--buffer_pool_len].data);
+		alloc_stats.frees++;
+	}
+	
+	alloc_stats.mallocs++;
+	*capacity = size;
+	return av_malloc(size);
+}
+
+// Return a block to the pool, or free it if the pool is full. Must be called with the GIL held.
+static void ffmpeg_buffer_put( uint8_t *data, Py_ssize_t capacity ){
+	if( data == NULL )
+		return;
+	
+	if( buffer_pool_len < BUFFER_POOL_SIZE ){
+		buffer_pool[buffer_pool_len].data     = data;
+		buffer_pool[buffer_pool_len].capacity = capacity;
+		buffer_pool_len++;
+	}
+	else{
+		av_free(data);
+		alloc_stats.frees++;
+	}
+}
+
+typedef struct {
+	PyObject_HEAD
+	uint8_t *data;
+	Py_ssize_t size;
+	Py_ssize_t capacity;
+} ffmpegBufferObject;
+
+static PyTypeObject ffmpegBuffer;
+
+// Wrap `data' (which must have been allocated using ffmpeg_buffer_get or av_malloc) in a
+// Buffer object. The Buffer takes ownership of the data, even if creating it fails.
+static PyObject* ffmpeg_buffer_wrap( uint8_t *data, Py_ssize_t size, Py_ssize_t capacity ){
+	ffmpegBufferObject* self;
+	
+	if( (self = PyObject_New(ffmpegBufferObject, &ffmpegBuffer)) == NULL ){
+		ffmpeg_buffer_put(data, capacity);
+		return NULL;
+	}
+	self->data     = data;
+	self->size     = size;
+	self->capacity = capacity;
+	return (PyObject *)self;
+}
+
+static void ffmpeg_buffer_dealloc( ffmpegBufferObject* self ){
+	ffmpeg_buffer_put(self->data, self->capacity);
+	PyObject_Del(self);
+}
+
+static Py_ssize_t ffmpeg_buffer_length( ffmpegBufferObject* self ){
+	return self->size;
+}
+
+static PyObject* ffmpeg_buffer_str( ffmpegBufferObject* self ){
+	return PyString_FromStringAndSize( (const char*)self->data, self->size );
+}
+
+static Py_ssize_t ffmpeg_buffer_getreadbuf( ffmpegBufferObject* self, Py_ssize_t segment, void **ptr ){
+	if( segment != 0 ){
+		PyErr_SetString(PyExc_SystemError, "accessing non-existent buffer segment");
+		return -1;
+	}
+	*ptr = self->data;
+	return self->size;
+}
+
+static Py_ssize_t ffmpeg_buffer_getsegcount( ffmpegBufferObject* self, Py_ssize_t *lenp ){
+	if( lenp != NULL )
+		*lenp = self->size;
+	return 1;
+}
+
+static int ffmpeg_buffer_getbuffer( ffmpegBufferObject* self, Py_buffer *view, int flags ){
+	return PyBuffer_FillInfo(view, (PyObject *)self, self->data, self->size, 1, flags);
+}
+
+static PySequenceMethods ffmpegBuffer_SequenceMethods = {
+	.sq_length = (lenfunc)ffmpeg_buffer_length,
+};
+
+static PyBufferProcs ffmpegBuffer_BufferProcs = {
+	.bf_getreadbuffer = (readbufferproc)ffmpeg_buffer_getreadbuf,
+	.bf_getsegcount   = (segcountproc)ffmpeg_buffer_getsegcount,
+	.bf_getcharbuffer = (charbufferproc)ffmpeg_buffer_getreadbuf,
+	.bf_getbuffer     = (getbufferproc)ffmpeg_buffer_getbuffer,
+};
+
+static PyTypeObject ffmpegBuffer = {
+	PyObject_HEAD_INIT(NULL)
+	.tp_name      = "ffmpeg.Buffer",
+	.tp_basicsize = sizeof( ffmpegBufferObject ),
+	.tp_dealloc   = (destructor)ffmpeg_buffer_dealloc,
+	.tp_str       = (reprfunc)ffmpeg_buffer_str,
+	.tp_as_sequence = &ffmpegBuffer_SequenceMethods,
+	.tp_as_buffer = &ffmpegBuffer_BufferProcs,
+	.tp_flags     = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER,
+	.tp_doc       = "Read-only chunk of decoded audio data that supports the buffer protocol.",
+};
+
+
 /**
  * DECODER
  */
@@ -83,6 +267,10 @@ typedef struct {
 	AVFormatContext *pFormatCtx;
 	AVCodecContext *pCodecCtx;
 	AVStream *pStream;
+	AVFrame *pFrame;
+	PyThread_type_lock lock;
+	int pending_error;
+	int64_t next_pts;
 } ffmpegDecoderObject;
 
 static PyObject* ffmpeg_decoder_new( PyTypeObject* type, PyObject* args ){
@@ -90,6 +278,7 @@ static PyObject* ffmpeg_decoder_new( PyTypeObject* type, PyObject* args ){
 	AVCodec *codec;
 	int streamIdx;
 	int err = 0;
+	int res;
 	
 	self = (ffmpegDecoderObject *) type->tp_alloc( type, 0 );
 	
@@ -98,19 +287,39 @@ static PyObject* ffmpeg_decoder_new( PyTypeObject* type, PyObject* args ){
 	
 	self->pFormatCtx = NULL;
 	self->pCodecCtx  = NULL;
+	self->pFrame     = NULL;
+	self->pending_error = 0;
+	self->next_pts   = 0;
+	
+	if( (self->lock = PyThread_allocate_lock()) == NULL ){
+		PyErr_SetString(PyExc_MemoryError, "unable to allocate lock");
+		type->tp_free( self );
+		return NULL;
+	}
 	
 	if( !PyArg_ParseTuple( args, "s", &self->infile ) ){
 		err = 1;
 	}
 	
-	if( !err && avformat_open_input(&self->pFormatCtx, self->infile, NULL, NULL) < 0){
-		PyErr_SetString(FfmpegFileError, "could not open infile");
-		err = 2;
+	if( !err ){
+		// Opening the file hits the disk (or the network), don't block everyone else meanwhile.
+		Py_BEGIN_ALLOW_THREADS
+		res = avformat_open_input(&self->pFormatCtx, self->infile, NULL, NULL);
+		Py_END_ALLOW_THREADS
+		if( res < 0 ){
+			PyErr_SetString(FfmpegFileError, "could not open infile");
+			err = 2;
+		}
 	}
 	
-	if( !err && avformat_find_stream_info(self->pFormatCtx, NULL) < 0) {
-		PyErr_SetString(FfmpegDecodeError, "could not find stream information");
-		err = 3;
+	if( !err ){
+		Py_BEGIN_ALLOW_THREADS
+		res = avformat_find_stream_info(self->pFormatCtx, NULL);
+		Py_END_ALLOW_THREADS
+		if( res < 0 ){
+			PyErr_SetString(FfmpegDecodeError, "could not find stream information");
+			err = 3;
+		}
 	}
 	
 	if( !err ){
@@ -131,11 +340,22 @@ static PyObject* ffmpeg_decoder_new( PyTypeObject* type, PyObject* args ){
 		}
 	}
 	
+	if( !err ){
+		// One frame to decode into for the whole lifetime of the decoder.
+		if( (self->pFrame = av_frame_alloc()) == NULL ){
+			PyErr_SetString(FfmpegDecodeError, "out of memory");
+			avcodec_close(self->pCodecCtx);
+			err = 6;
+		}
+		alloc_stats.frames++;
+	}
+	
 	if( err > 2 ){
 		avformat_close_input(&self->pFormatCtx);
 	}
 	
 	if( err > 0 ){
+		PyThread_free_lock(self->lock);
 		type->tp_free( self );
 		self = NULL;
 	}
@@ -143,13 +363,31 @@ static PyObject* ffmpeg_decoder_new( PyTypeObject* type, PyObject* args ){
 	return (PyObject *)self;
 }
 
+// Keep track of the timestamp of the sample following the last decoded one, relative to
+// the start of the stream. Packets carry a timestamp, which applies to the first frame
+// they contain; other frames just continue where the previous one ended.
+// This doesn't touch any Python objects, so it can be called without holding the GIL.
+static void ffmpeg_decoder_advance_pts( ffmpegDecoderObject* self, AVPacket *pkt, int first_in_packet, int nb_samples ){
+	if( first_in_packet && pkt->pts != AV_NOPTS_VALUE ){
+		self->next_pts = pkt->pts;
+		if( self->pStream->start_time != AV_NOPTS_VALUE )
+			self->next_pts -= self->pStream->start_time;
+	}
+	self->next_pts += av_rescale_q( nb_samples, (AVRational){ 1, self->pCodecCtx->sample_rate }, self->pStream->time_base );
+}
+
 static void ffmpeg_decoder_dealloc( ffmpegDecoderObject* self ){
+	av_frame_free(&self->pFrame);
 	avcodec_close(self->pCodecCtx);
 	avformat_close_input(&self->pFormatCtx);
+	PyThread_free_lock(self->lock);
+	Py_TYPE(self)->tp_free( (PyObject *)self );
 }
 
 static PyObject* ffmpeg_decoder_dump_format( ffmpegDecoderObject* self ){
+	ACQUIRE_LOCK(self);
 	av_dump_format(self->pFormatCtx, 0, self->infile, 0);
+	RELEASE_LOCK(self);
 	Py_RETURN_NONE;
 }
 
@@ -181,20 +419,31 @@ static PyObject* ffmpeg_decoder_get_duration( ffmpegDecoderObject* self ){
 	return PyFloat_FromDouble( self->pFormatCtx->duration / (double)AV_TIME_BASE );
 }
 
+static PyObject* ffmpeg_decoder_get_pts( ffmpegDecoderObject* self ){
+	return PyLong_FromLongLong( self->next_pts );
+}
+
+static PyObject* ffmpeg_decoder_get_time_base( ffmpegDecoderObject* self ){
+	return Py_BuildValue( "(ii)", self->pStream->time_base.num, self->pStream->time_base.den );
+}
+
 static PyObject* ffmpeg_decoder_get_path( ffmpegDecoderObject* self ){
 	return PyString_FromString( self->infile );
 }
 
-static PyObject* ffmpeg_decoder_get_metadata( ffmpegDecoderObject* self ){
+// Collect the container's and the stream's tags in one dict, the stream's taking precedence.
+static PyObject* ffmpeg_metadata_dict( AVFormatContext *pFormatCtx, AVStream *pStream ){
 	PyObject* metadict = PyDict_New();
 	AVDictionaryEntry *metaent = NULL;
-	while( (metaent = av_dict_get(self->pFormatCtx->metadata, "", metaent, AV_DICT_IGNORE_SUFFIX)) != NULL ){
+	if( metadict == NULL )
+		return NULL;
+	while( (metaent = av_dict_get(pFormatCtx->metadata, "", metaent, AV_DICT_IGNORE_SUFFIX)) != NULL ){
 		PyObject* str = PyString_FromString(metaent->value);
 		PyDict_SetItemString(metadict, metaent->key, str);
 		Py_DECREF(str);
 	}
 	metaent = NULL;
-	while( (metaent = av_dict_get(self->pStream->metadata, "", metaent, AV_DICT_IGNORE_SUFFIX)) != NULL ){
+	while( (metaent = av_dict_get(pStream->metadata, "", metaent, AV_DICT_IGNORE_SUFFIX)) != NULL ){
 		PyObject* str = PyString_FromString(metaent->value);
 		PyDict_SetItemString(metadict, metaent->key, str);
 		Py_DECREF(str);
@@ -202,28 +451,38 @@ static PyObject* ffmpeg_decoder_get_metadata( ffmpegDecoderObject* self ){
 	return metadict;
 }
 
+static PyObject* ffmpeg_decoder_get_metadata( ffmpegDecoderObject* self ){
+	return ffmpeg_metadata_dict( self->pFormatCtx, self->pStream );
+}
+
 
 static PyObject* ffmpeg_decoder_read( ffmpegDecoderObject* self ){
 	AVPacket avpkt;
-	AVFrame *avfrm;
+	AVFrame *avfrm = self->pFrame;
 	int got_frame;
 	int data_size;
+	int res;
 	int i;
 	PyObject* ret = NULL;
 	
-	if( av_read_frame(self->pFormatCtx, &avpkt) < 0 ){
-		PyErr_SetString(PyExc_StopIteration, "no more frames to read");
-		return NULL;
-	}
+	ACQUIRE_LOCK(self);
 	
-	if( (avfrm = av_frame_alloc()) == NULL ){
-		PyErr_SetString(FfmpegDecodeError, "out of memory");
+	got_frame = 0;
+	Py_BEGIN_ALLOW_THREADS
+	res = av_read_frame(self->pFormatCtx, &avpkt);
+	if( res >= 0 ){
+		if( avcodec_decode_audio4(self->pCodecCtx, avfrm, &got_frame, &avpkt) < 0 )
+			got_frame = 0;
+		if( got_frame )
+			ffmpeg_decoder_advance_pts( self, &avpkt, 1, avfrm->nb_samples );
 		av_packet_unref(&avpkt);
-		return NULL;
 	}
+	Py_END_ALLOW_THREADS
 	
-	got_frame = 0;
-	if( avcodec_decode_audio4(self->pCodecCtx, avfrm, &got_frame, &avpkt) < 0 || !got_frame ){
+	if( res < 0 ){
+		PyErr_SetString(PyExc_StopIteration, "no more frames to read");
+	}
+	else if( !got_frame ){
 		PyErr_SetString(FfmpegDecodeError, "decoding failed");
 	}
 	else{
@@ -243,15 +502,210 @@ static PyObject* ffmpeg_decoder_read( ffmpegDecoderObject* self ){
 		}
 	}
 	
-	av_packet_unref(&avpkt);
-	av_free(avfrm);
+	RELEASE_LOCK(self);
 	
 	return ret;
 }
 
 
+static PyObject* ffmpeg_decoder_read_many( ffmpegDecoderObject* self, PyObject* args ){
+	AVPacket avpkt;
+	AVPacket curpkt;
+	AVFrame *avfrm = self->pFrame;
+	uint8_t *planes[AV_NUM_DATA_POINTERS];
+	uint8_t *newplane;
+	int min_samples;
+	int nb_planes;
+	int sample_size;
+	int frame_size;
+	Py_ssize_t capacity;
+	Py_ssize_t plane_capacity;
+	int reallocs = 0;
+	int length = 0;
+	int got_frame;
+	int first_in_packet;
+	int used;
+	int eof = 0;
+	int err = 0;
+	int i;
+	PyObject* ret = NULL;
+	
+	if( !PyArg_ParseTuple( args, "i", &min_samples ) )
+		return NULL;
+	
+	if( self->pending_error ){
+		// The last call ran into an error after it had already decoded something.
+		self->pending_error = 0;
+		PyErr_SetString(FfmpegDecodeError, "decoding failed");
+		return NULL;
+	}
+	
+	if( av_sample_format_is_planar(self->pCodecCtx->sample_fmt) ){
+		nb_planes   = self->pCodecCtx->channels;
+		sample_size = av_get_bytes_per_sample(self->pCodecCtx->sample_fmt);
+	}
+	else{
+		nb_planes   = 1;
+		sample_size = av_get_bytes_per_sample(self->pCodecCtx->sample_fmt) * self->pCodecCtx->channels;
+	}
+	
+	if( nb_planes > AV_NUM_DATA_POINTERS ){
+		PyErr_SetString(FfmpegDecodeError, "too many channels");
+		return NULL;
+	}
+	
+	// Get the memory while we're still holding the GIL. Make room for one extra frame, so
+	// that usually no reallocation is needed when the last frame overshoots min_samples.
+	capacity = (Py_ssize_t)(min_samples + FFMAX(self->pCodecCtx->frame_size, 4096)) * sample_size;
+	for( i = 0; i < nb_planes; i++ ){
+		if( (planes[i] = ffmpeg_buffer_get(capacity, &plane_capacity)) == NULL ){
+			for( i--; i >= 0; i-- )
+				ffmpeg_buffer_put(planes[i], capacity);
+			PyErr_SetString(FfmpegDecodeError, "out of memory");
+			return NULL;
+		}
+		// all planes are treated as if they had the smallest capacity among them.
+		capacity = FFMIN(capacity, plane_capacity);
+	}
+	
+	ACQUIRE_LOCK(self);
+	
+	Py_BEGIN_ALLOW_THREADS
+	while( length < min_samples * sample_size && !eof && !err ){
+		if( av_read_frame(self->pFormatCtx, &avpkt) < 0 ){
+			eof = 1;
+			break;
+		}
+		if( avpkt.stream_index != self->pStream->index ){
+			// cover art and the like.
+			av_packet_unref(&avpkt);
+			continue;
+		}
+		// A packet may contain more than one frame, so keep going until it's used up.
+		curpkt = avpkt;
+		first_in_packet = 1;
+		while( curpkt.size > 0 ){
+			got_frame = 0;
+			if( (used = avcodec_decode_audio4(self->pCodecCtx, avfrm, &got_frame, &curpkt)) < 0 ){
+				err = 1;
+				break;
+			}
+			curpkt.data += used;
+			curpkt.size -= used;
+			if( !got_frame ){
+				if( used == 0 )
+					break;
+				continue;
+			}
+			ffmpeg_decoder_advance_pts( self, &avpkt, first_in_packet, avfrm->nb_samples );
+			first_in_packet = 0;
+			frame_size = avfrm->nb_samples * sample_size;
+			if( length + frame_size > capacity ){
+				capacity = FFMAX( 2 * capacity, length + frame_size );
+				for( i = 0; i < nb_planes; i++ ){
+					if( (newplane = av_realloc(planes[i], capacity)) == NULL ){
+						err = 2;
+						break;
+					}
+					planes[i] = newplane;
+				}
+				reallocs++;
+				if( err )
+					break;
+			}
+			for( i = 0; i < nb_planes; i++ ){
+				memcpy( planes[i] + length, avfrm->extended_data[i], frame_size );
+			}
+			length += frame_size;
+		}
+		av_packet_unref(&avpkt);
+	}
+	Py_END_ALLOW_THREADS
+	
+	RELEASE_LOCK(self);
+	
+	alloc_stats.reallocs += reallocs;
+	
+	if( err == 2 ){
+		PyErr_SetString(FfmpegDecodeError, "out of memory");
+	}
+	else if( length == 0 && err ){
+		PyErr_SetString(FfmpegDecodeError, "decoding failed");
+	}
+	else if( length == 0 ){
+		PyErr_SetString(PyExc_StopIteration, "no more frames to read");
+	}
+	else{
+		// Hand out what we've got, and report the error on the next call.
+		// The Buffers take over the planes, so there's no need to copy them.
+		self->pending_error = err;
+		ret = PyTuple_New(nb_planes);
+		for( i = 0; i < nb_planes; i++ ){
+			PyTuple_SetItem(ret, i, ffmpeg_buffer_wrap( planes[i], length, capacity ));
+			planes[i] = NULL;
+		}
+	}
+	
+	for( i = 0; i < nb_planes; i++ ){
+		if( err == 2 ){
+			// we don't know which planes made it to the new capacity, so don't recycle them.
+			av_free(planes[i]);
+			alloc_stats.frees++;
+		}
+		else{
+			ffmpeg_buffer_put(planes[i], capacity);
+		}
+	}
+	
+	return ret;
+}
+
+
+static PyObject* ffmpeg_decoder_seek( ffmpegDecoderObject* self, PyObject* args ){
+	double seconds;
+	int64_t timestamp;
+	int res;
+	
+	if( !PyArg_ParseTuple( args, "d", &seconds ) )
+		return NULL;
+	
+	timestamp = (int64_t)(seconds / av_q2d(self->pStream->time_base));
+	if( self->pStream->start_time != AV_NOPTS_VALUE )
+		timestamp += self->pStream->start_time;
+	
+	ACQUIRE_LOCK(self);
+	
+	Py_BEGIN_ALLOW_THREADS
+	res = av_seek_frame(self->pFormatCtx, self->pStream->index, timestamp, AVSEEK_FLAG_BACKWARD);
+	if( res >= 0 ){
+		// throw away whatever the codec still had buffered from before the seek.
+		avcodec_flush_buffers(self->pCodecCtx);
+	}
+	Py_END_ALLOW_THREADS
+	
+	if( res >= 0 ){
+		self->pending_error = 0;
+		// this is where we wanted to go. The next packet tells us where we actually are.
+		self->next_pts = timestamp;
+		if( self->pStream->start_time != AV_NOPTS_VALUE )
+			self->next_pts -= self->pStream->start_time;
+	}
+	
+	RELEASE_LOCK(self);
+	
+	if( res < 0 ){
+		PyErr_SetString(FfmpegDecodeError, "seeking failed");
+		return NULL;
+	}
+	
+	Py_RETURN_NONE;
+}
+
+
 static PyMethodDef ffmpegDecoderObject_Methods[] = {
 	{ "read",           (PyCFunction)ffmpeg_decoder_read,           METH_NOARGS, "read()\nRead the next frame and return its data." },
+	{ "read_many",      (PyCFunction)ffmpeg_decoder_read_many,      METH_VARARGS, "read_many(min_samples)\nDecode frames until at least min_samples samples per channel have been read, and return their data in one go as a tuple of Buffers." },
+	{ "seek",           (PyCFunction)ffmpeg_decoder_seek,           METH_VARARGS, "seek(seconds)\nSeek to the given position in the file and flush the codec." },
 	{ "dump_format",    (PyCFunction)ffmpeg_decoder_dump_format,    METH_NOARGS, "dump_format()\nDump a bit of info about the file to stdout." },
 	{ "get_path",       (PyCFunction)ffmpeg_decoder_get_path,       METH_NOARGS, "get_path()\nReturn the path to the input file." },
 	{ "get_bitrate",    (PyCFunction)ffmpeg_decoder_get_bitrate,    METH_NOARGS, "get_bitrate()\nReturn the bit rate of the decoded file." },
@@ -260,6 +714,8 @@ static PyMethodDef ffmpegDecoderObject_Methods[] = {
 	{ "get_channels",   (PyCFunction)ffmpeg_decoder_get_channels,   METH_NOARGS, "get_channels()\nReturn the number of channels in the decoded file." },
 	{ "get_channel_layout", (PyCFunction)ffmpeg_decoder_get_channel_layout, METH_NOARGS, "get_channel_layout()\nReturn the channel layout." },
 	{ "get_duration",   (PyCFunction)ffmpeg_decoder_get_duration,   METH_NOARGS, "get_duration()\nReturn the duration of the decoded file in seconds." },
+	{ "get_pts",        (PyCFunction)ffmpeg_decoder_get_pts,        METH_NOARGS, "get_pts()\nReturn the timestamp following the last decoded sample in time_base units, relative to the start of the stream." },
+	{ "get_time_base",  (PyCFunction)ffmpeg_decoder_get_time_base,  METH_NOARGS, "get_time_base()\nReturn the stream's time base as a (numerator, denominator) tuple." },
 	{ "get_metadata",   (PyCFunction)ffmpeg_decoder_get_metadata,   METH_NOARGS, "get_metadata()\nReturn a dict containing the file's meta data." },
 	{ "get_codec",      (PyCFunction)ffmpeg_decoder_get_codec,      METH_NOARGS, "get_codec()\nReturn the name of the codec being used." },
 	{ NULL, NULL, 0, NULL }
@@ -295,6 +751,7 @@ typedef struct {
 	int input_channel_layout;
 	enum AVSampleFormat output_sample_format;
 	enum AVSampleFormat input_sample_format;
+	PyThread_type_lock lock;
 } ffmpegResamplerObject;
 
 static PyObject* ffmpeg_resampler_new( PyTypeObject* type, PyObject* args, PyObject* kw ){
@@ -326,10 +783,17 @@ static PyObject* ffmpeg_resampler_new( PyTypeObject* type, PyObject* args, PyObj
 		return NULL;
 	}
 	
+	if( (self->lock = PyThread_allocate_lock()) == NULL ){
+		PyErr_SetString(PyExc_MemoryError, "unable to allocate lock");
+		type->tp_free( self );
+		return NULL;
+	}
+	
 	self->pResampleCtx = avresample_alloc_context();
 	
 	if( self->pResampleCtx == NULL ){
 		PyErr_SetString(FfmpegResampleError, "could not initialize resampler");
+		PyThread_free_lock(self->lock);
 		type->tp_free( self );
 		return NULL;
 	}
@@ -341,6 +805,19 @@ static PyObject* ffmpeg_resampler_new( PyTypeObject* type, PyObject* args, PyObj
 	av_opt_set_int(self->pResampleCtx, "in_sample_fmt",      self->input_sample_format,   0);
 	av_opt_set_int(self->pResampleCtx, "out_sample_fmt",     self->output_sample_format,  0);
 	
+	if( self->input_channel_layout == AV_CH_LAYOUT_MONO && self->output_channel_layout == AV_CH_LAYOUT_STEREO ){
+		// Play mono on both channels at full volume. libavresample's default
+		// matrix would mix it in at M_SQRT1_2, making it 3dB quieter.
+		static const double mono_to_stereo[2] = { 1.0, 1.0 };
+		if( avresample_set_matrix(self->pResampleCtx, mono_to_stereo, 1) < 0 ){
+			PyErr_SetString(FfmpegResampleError, "could not set the channel mixing matrix");
+			avresample_free(&self->pResampleCtx);
+			PyThread_free_lock(self->lock);
+			type->tp_free( self );
+			return NULL;
+		}
+	}
+	
 	avresample_open(self->pResampleCtx);
 	
 	return (PyObject *)self;
@@ -348,96 +825,127 @@ static PyObject* ffmpeg_resampler_new( PyTypeObject* type, PyObject* args, PyObj
 
 static void ffmpeg_resampler_dealloc( ffmpegResamplerObject* self ){
 	avresample_free(&self->pResampleCtx);
-}
-
-
-// For some reason, Debian insists on packaging a version that doesn't have this, so the following is
-// shamelessly stolen from samplefmt.c.
-// see http://www.ffmpeg.org/doxygen/trunk/samplefmt_8c_source.html
-int av_samples_alloc_array_and_samples(uint8_t ***audio_data, int *linesize, int nb_channels,
-					int nb_samples, enum AVSampleFormat sample_fmt, int align)
-{
-	int ret, nb_planes = av_sample_fmt_is_planar(sample_fmt) ? nb_channels : 1;
-
-	*audio_data = av_mallocz(nb_planes * sizeof(**audio_data));
-	if (!*audio_data)
-		return AVERROR(ENOMEM);
-	ret = av_samples_alloc(*audio_data, linesize, nb_channels,
-				nb_samples, sample_fmt, align);
-	if (ret < 0)
-		av_freep(audio_data);
-	return ret;
+	PyThread_free_lock(self->lock);
+	Py_TYPE(self)->tp_free( (PyObject *)self );
 }
 
 
 static PyObject* ffmpeg_resampler_resample( ffmpegResamplerObject* self, PyObject* args ){
-	const char** indata = NULL;
+	uint8_t *indata[AVRESAMPLE_MAX_CHANNELS];
+	uint8_t *outbuf[AVRESAMPLE_MAX_CHANNELS];
+	Py_ssize_t capacity;
+	Py_ssize_t plane_capacity;
+	const void *plane;
+	Py_ssize_t planelen;
 	int i;
 	int innb;
-	int inlen;
+	int inlen = 0;
 	int inplanes;
-	uint8_t **outbuf;
+	int insamplesize;
 	int outnb;
-	int outlen;
-	int outplanes = 0;
+	int outchannels;
+	int outplanes;
+	int outsamplesize;
+	int res = AVERROR(ENOMEM);
 	PyObject* in  = NULL;
 	PyObject* ret = NULL;
 	
 	if( !PyArg_ParseTuple( args, "O!", &PyTuple_Type, &in ) )
 		return NULL;
 	
-	inplanes = PyTuple_Size(in);
-	
-	indata = malloc( sizeof(const char*) * inplanes );
-	if( indata == NULL ){
-		PyErr_SetString(FfmpegResampleError, "out of memory");
+	if( (inplanes = PyTuple_Size(in)) < 1 || inplanes > AVRESAMPLE_MAX_CHANNELS ){
+		PyErr_SetString(PyExc_ValueError, "invalid number of planes to resample");
 		return NULL;
 	}
+	
+	// Accept anything that speaks the buffer protocol (Buffers, strings, bytearrays...).
+	// The input objects are kept alive by the args tuple, so the pointers stay valid.
 	for( i = 0; i < inplanes; i++ ){
-		indata[i] = PyString_AsString(PyTuple_GetItem(in, i));
+		if( PyObject_AsReadBuffer(PyTuple_GetItem(in, i), &plane, &planelen) < 0 )
+			return NULL;
+		indata[i] = (uint8_t *)plane;
+		if( i == 0 )
+			inlen = planelen;
 	}
 	
-	inlen = PyString_Size(PyTuple_GetItem(in, 0));
-	innb  = inlen / av_get_bytes_per_sample(self->input_sample_format);
+	insamplesize = av_get_bytes_per_sample(self->input_sample_format);
+	if( !av_sample_fmt_is_planar(self->input_sample_format) )
+		insamplesize *= av_get_channel_layout_nb_channels(self->input_channel_layout);
+	innb = inlen / insamplesize;
+	
+	outchannels   = av_get_channel_layout_nb_channels(self->output_channel_layout);
+	outsamplesize = av_get_bytes_per_sample(self->output_sample_format);
+	outplanes     = 1;
+	if( av_sample_fmt_is_planar(self->output_sample_format) )
+		outplanes = outchannels;
+	else
+		outsamplesize *= outchannels;
+	
+	ACQUIRE_LOCK(self);
 	
 	outnb  = av_rescale_rnd(innb + avresample_get_delay(self->pResampleCtx),
 				self->output_rate, self->input_rate, AV_ROUND_UP);
 	
-	outlen = av_samples_get_buffer_size(
-		NULL, av_get_channel_layout_nb_channels(self->output_channel_layout),
-		outnb, self->output_sample_format, 1
-	);
+	// Every output plane gets its own (recycled) memory block, so they can be handed out as Buffers.
+	capacity = (Py_ssize_t)FFMAX(outnb, 1) * outsamplesize;
+	for( i = 0; i < outplanes; i++ ){
+		if( (outbuf[i] = ffmpeg_buffer_get(capacity, &plane_capacity)) == NULL )
+			break;
+		capacity = FFMIN(capacity, plane_capacity);
+	}
+	if( i == outplanes ){
+		Py_BEGIN_ALLOW_THREADS
+		res = avresample_convert(self->pResampleCtx, outbuf, 0, outnb, indata, 0, innb);
+		Py_END_ALLOW_THREADS
+	}
+	else{
+		outplanes = i;
+	}
+	
+	RELEASE_LOCK(self);
 	
-	if( av_samples_alloc_array_and_samples(&outbuf, NULL,
-			av_get_channel_layout_nb_channels(self->output_channel_layout),
-			outnb, self->output_sample_format, 0) < 0 ){
+	if( res == AVERROR(ENOMEM) ){
 		PyErr_SetString(FfmpegResampleError, "out of memory");
 	}
-	else if( avresample_convert(self->pResampleCtx, outbuf, 0, outnb, (uint8_t **)indata, 0, innb) < 0 ){
+	else if( res < 0 ){
 		PyErr_SetString(FfmpegResampleError, "resampling failed");
 	}
 	else{
-		outplanes = 1;
-		if(av_sample_fmt_is_planar(self->output_sample_format))
-			outplanes = av_get_channel_layout_nb_channels(self->output_channel_layout);
 		ret = PyTuple_New(outplanes);
-		for( i = 0; i < outplanes; i++ )
-			PyTuple_SetItem(ret, i, PyString_FromStringAndSize( (const char*)outbuf[i], outlen ));
+		for( i = 0; i < outplanes; i++ ){
+			PyTuple_SetItem(ret, i, ffmpeg_buffer_wrap( outbuf[i], res * outsamplesize, capacity ));
+			outbuf[i] = NULL;
+		}
 	}
 	
-	free(indata);
-	
 	for( i = 0; i < outplanes; i++ ){
-		free(outbuf[i]);
+		ffmpeg_buffer_put(outbuf[i], capacity);
 	}
 	
-	free(outbuf);
-	
 	return ret;
 }
 
+static PyObject* ffmpeg_resampler_reset( ffmpegResamplerObject* self ){
+	int res;
+	
+	ACQUIRE_LOCK(self);
+	// Closing and reopening the context drops the samples it has been holding back,
+	// but keeps all the options.
+	avresample_close(self->pResampleCtx);
+	res = avresample_open(self->pResampleCtx);
+	RELEASE_LOCK(self);
+	
+	if( res < 0 ){
+		PyErr_SetString(FfmpegResampleError, "could not reopen resampler");
+		return NULL;
+	}
+	
+	Py_RETURN_NONE;
+}
+
 static PyMethodDef ffmpegResamplerObject_Methods[] = {
 	{ "resample", (PyCFunction)ffmpeg_resampler_resample, METH_VARARGS, "resample(input)\nResample the input stream data." },
+	{ "reset",    (PyCFunction)ffmpeg_resampler_reset,    METH_NOARGS,  "reset()\nDrop any buffered samples, e.g. after seeking the input." },
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -458,6 +966,174 @@ static PyTypeObject ffmpegResampler = {
 };
 
 
+/**
+ * MIXER
+ *
+ * Every source passed to mix() comes with a fade position at the start and at the end
+ * of the period, and the gain is ramped between the two for every single sample (so
+ * there's no zipper noise from stepping the gain once per chunk). The curve decides how
+ * a fade position in [0, 1] translates into an actual gain.
+ */
+
+#define MIXER_MAX_SOURCES 8
+
+#define CURVE_LINEAR      0
+#define CURVE_EQUAL_POWER 1
+#define CURVE_LOG         2
+
+typedef struct {
+	PyObject_HEAD
+	int curve;
+	int channels;
+} ffmpegMixerObject;
+
+static PyObject* ffmpeg_mixer_new( PyTypeObject* type, PyObject* args, PyObject* kw ){
+	ffmpegMixerObject* self;
+	
+	static char *kwlist[] = { "curve", "channels", NULL };
+	
+	self = (ffmpegMixerObject *) type->tp_alloc( type, 0 );
+	
+	if( self == NULL )
+		return NULL;
+	
+	self->curve    = CURVE_LINEAR;
+	self->channels = 2;
+	
+	if( !PyArg_ParseTupleAndKeywords( args, kw, "|ii", kwlist, &self->curve, &self->channels ) ){
+		type->tp_free( self );
+		return NULL;
+	}
+	
+	if( self->curve < CURVE_LINEAR || self->curve > CURVE_LOG || self->channels < 1 || self->channels > 8 ){
+		PyErr_SetString(PyExc_ValueError, "invalid curve or channel count");
+		type->tp_free( self );
+		return NULL;
+	}
+	
+	return (PyObject *)self;
+}
+
+static void ffmpeg_mixer_dealloc( ffmpegMixerObject* self ){
+	Py_TYPE(self)->tp_free( (PyObject *)self );
+}
+
+static double ffmpeg_mixer_curve( int curve, double pos ){
+	if( pos <= 0 )
+		return 0;
+	if( pos >= 1 )
+		return 1;
+	switch( curve ){
+		case CURVE_EQUAL_POWER:
+			return sin( pos * Py_MATH_PI / 2 );
+		case CURVE_LOG:
+			// 60dB range, so that the end of the fade is actually silent.
+			return pow( 10, (pos - 1) * 3 );
+		default:
+			return pos;
+	}
+}
+
+static PyObject* ffmpeg_mixer_mix( ffmpegMixerObject* self, PyObject* args ){
+	const int16_t *data[MIXER_MAX_SOURCES];
+	Py_ssize_t frames[MIXER_MAX_SOURCES];
+	double start[MIXER_MAX_SOURCES];
+	double end[MIXER_MAX_SOURCES];
+	double scale[MIXER_MAX_SOURCES];
+	double acc[8];
+	double gain;
+	double t;
+	const void *buf;
+	Py_ssize_t buflen;
+	Py_ssize_t nsources;
+	Py_ssize_t maxframes = 0;
+	Py_ssize_t capacity;
+	Py_ssize_t i, f;
+	int16_t *out;
+	int c;
+	PyObject *sources;
+	PyObject *seq;
+	PyObject *item;
+	
+	if( !PyArg_ParseTuple( args, "O", &sources ) )
+		return NULL;
+	
+	if( (seq = PySequence_Fast(sources, "sources must be a sequence")) == NULL )
+		return NULL;
+	
+	if( (nsources = PySequence_Fast_GET_SIZE(seq)) > MIXER_MAX_SOURCES ){
+		PyErr_SetString(PyExc_ValueError, "too many sources");
+		Py_DECREF(seq);
+		return NULL;
+	}
+	
+	for( i = 0; i < nsources; i++ ){
+		scale[i] = 1.0;
+		if( !PyArg_ParseTuple( PySequence_Fast_GET_ITEM(seq, i), "Odd|d", &item, &start[i], &end[i], &scale[i] ) ||
+		    PyObject_AsReadBuffer(item, &buf, &buflen) < 0 ){
+			Py_DECREF(seq);
+			return NULL;
+		}
+		data[i]   = (const int16_t *)buf;
+		frames[i] = buflen / (sizeof(int16_t) * self->channels);
+		maxframes = FFMAX(maxframes, frames[i]);
+	}
+	
+	if( (out = (int16_t *)ffmpeg_buffer_get( FFMAX(maxframes, 1) * self->channels * sizeof(int16_t), &capacity )) == NULL ){
+		Py_DECREF(seq);
+		return PyErr_NoMemory();
+	}
+	
+	// The input buffers are kept alive by seq, so we can do the actual work without the GIL.
+	Py_BEGIN_ALLOW_THREADS
+	for( f = 0; f < maxframes; f++ ){
+		t = (double)f / maxframes;
+		for( c = 0; c < self->channels; c++ )
+			acc[c] = 0;
+		for( i = 0; i < nsources; i++ ){
+			// shorter sources are padded with silence.
+			if( f >= frames[i] )
+				continue;
+			gain = ffmpeg_mixer_curve( self->curve, start[i] + (end[i] - start[i]) * t ) * scale[i];
+			for( c = 0; c < self->channels; c++ )
+				acc[c] += data[i][f * self->channels + c] * gain;
+		}
+		for( c = 0; c < self->channels; c++ )
+			out[f * self->channels + c] = (int16_t)av_clip( lrint(acc[c]), INT16_MIN, INT16_MAX );
+	}
+	Py_END_ALLOW_THREADS
+	
+	Py_DECREF(seq);
+	
+	return ffmpeg_buffer_wrap( (uint8_t *)out, maxframes * self->channels * sizeof(int16_t), capacity );
+}
+
+static PyMethodDef ffmpegMixerObject_Methods[] = {
+	{ "mix", (PyCFunction)ffmpeg_mixer_mix, METH_VARARGS, "mix(sources)\n"
+		"Mix a sequence of (data, fade_start, fade_end[, scale]) tuples into a single Buffer.\n"
+		"The fade positions are mapped to gains using the mixer's curve, and multiplied by scale." },
+	{ NULL, NULL, 0, NULL }
+};
+
+static PyMemberDef ffmpegMixerObject_Members[] = {
+	{ "curve",    T_INT, offsetof(ffmpegMixerObject, curve),    0, "The fade curve (CURVE_LINEAR, CURVE_EQUAL_POWER or CURVE_LOG)." },
+	{ "channels", T_INT, offsetof(ffmpegMixerObject, channels), READONLY, "The number of interleaved channels." },
+	{ NULL }
+};
+
+static PyTypeObject ffmpegMixer = {
+	PyObject_HEAD_INIT(NULL)
+	.tp_name      = "ffmpeg.Mixer",
+	.tp_basicsize = sizeof( ffmpegMixerObject ),
+	.tp_dealloc   = (destructor)ffmpeg_mixer_dealloc,
+	.tp_flags     = Py_TPFLAGS_DEFAULT,
+	.tp_doc       = MIXER_DOCSTRING,
+	.tp_methods   = ffmpegMixerObject_Methods,
+	.tp_members   = ffmpegMixerObject_Members,
+	.tp_new       = (newfunc)ffmpeg_mixer_new,
+};
+
+
 /**
  *  Module initialization.
  */
@@ -490,9 +1166,107 @@ static PyObject* ffmpeg_get_bytes_per_sample( PyObject* module, PyObject* args )
 	return NULL;
 }
 
+// Read the stream information from a file's header, without opening the codec or
+// allocating anything needed for decoding. The GIL is released while waiting for the disk.
+// probesize (bytes) and analyzeduration (microseconds) limit how much of the file gets
+// read to find the stream parameters; 0 means libavformat's default.
+static PyObject* ffmpeg_probe( PyObject* module, PyObject* args, PyObject* kw ){
+	const char *infile;
+	int probesize = 0;
+	int analyzeduration = 0;
+	char optval[32];
+	AVDictionary *opts = NULL;
+	AVFormatContext *pFormatCtx = NULL;
+	AVCodecContext *pCodecCtx;
+	AVStream *pStream;
+	PyObject *metadict;
+	PyObject *ret = NULL;
+	int streamIdx;
+	int err = 0;
+	int res;
+	
+	static char *kwlist[] = {"path", "probesize", "analyzeduration", NULL};
+	
+	if( !PyArg_ParseTupleAndKeywords( args, kw, "s|ii", kwlist, &infile, &probesize, &analyzeduration ) )
+		return NULL;
+	
+	if( probesize > 0 ){
+		snprintf( optval, sizeof(optval), "%d", probesize );
+		av_dict_set( &opts, "probesize", optval, 0 );
+	}
+	if( analyzeduration > 0 ){
+		snprintf( optval, sizeof(optval), "%d", analyzeduration );
+		av_dict_set( &opts, "analyzeduration", optval, 0 );
+	}
+	
+	Py_BEGIN_ALLOW_THREADS
+	res = avformat_open_input(&pFormatCtx, infile, NULL, &opts);
+	Py_END_ALLOW_THREADS
+	av_dict_free(&opts);
+	if( res < 0 ){
+		PyErr_SetString(FfmpegFileError, "could not open infile");
+		return NULL;
+	}
+	
+	Py_BEGIN_ALLOW_THREADS
+	res = avformat_find_stream_info(pFormatCtx, NULL);
+	Py_END_ALLOW_THREADS
+	if( res < 0 ){
+		PyErr_SetString(FfmpegDecodeError, "could not find stream information");
+		err = 1;
+	}
+	
+	if( !err ){
+		if( (streamIdx = av_find_best_stream(pFormatCtx, AVMEDIA_TYPE_AUDIO, -1, -1, NULL, 0)) < 0 ){
+			PyErr_SetString(FfmpegDecodeError, "could not find an audio stream");
+			err = 2;
+		}
+	}
+	
+	if( !err ){
+		pStream   = pFormatCtx->streams[streamIdx];
+		pCodecCtx = pStream->codec;
+		
+		if( (metadict = ffmpeg_metadata_dict( pFormatCtx, pStream )) != NULL ){
+			ret = Py_BuildValue( "{s:d,s:s,s:L,s:i,s:i,s:K,s:i,s:N}",
+				"duration",       pFormatCtx->duration / (double)AV_TIME_BASE,
+				"codec",          avcodec_get_name(pCodecCtx->codec_id),
+				"bitrate",        (PY_LONG_LONG)pCodecCtx->bit_rate,
+				"samplerate",     pCodecCtx->sample_rate,
+				"channels",       pCodecCtx->channels,
+				"channel_layout", (unsigned PY_LONG_LONG)pCodecCtx->channel_layout,
+				"samplefmt",      pCodecCtx->sample_fmt,
+				"metadata",       metadict
+				);
+		}
+	}
+	
+	avformat_close_input(&pFormatCtx);
+	return ret;
+}
+
+static PyObject* ffmpeg_get_alloc_stats( PyObject* module ){
+	return Py_BuildValue( "{s:k,s:k,s:k,s:k,s:k,s:i}",
+		"mallocs",  alloc_stats.mallocs,
+		"reallocs", alloc_stats.reallocs,
+		"frees",    alloc_stats.frees,
+		"recycled", alloc_stats.recycled,
+		"frames",   alloc_stats.frames,
+		"pooled",   buffer_pool_len
+		);
+}
+
+static PyObject* ffmpeg_reset_alloc_stats( PyObject* module ){
+	memset( &alloc_stats, 0, sizeof(alloc_stats) );
+	Py_RETURN_NONE;
+}
+
 static PyMethodDef ffmpegmodule_Methods[] = {
 	{ "get_sample_fmt_name", (PyCFunction)ffmpeg_get_sample_fmt_name, METH_VARARGS, "get_sample_fmt_name(format)\nReturn the given sample format's name."},
 	{ "get_bytes_per_sample", (PyCFunction)ffmpeg_get_bytes_per_sample, METH_VARARGS, "get_sample_fmt_name(format)\nReturn the size of one sample in bytes."},
+	{ "probe", (PyCFunction)ffmpeg_probe, METH_VARARGS|METH_KEYWORDS, "probe(path, probesize=0, analyzeduration=0)\nReturn a dict of information about the file's audio stream and its tags, without opening the codec."},
+	{ "get_alloc_stats", (PyCFunction)ffmpeg_get_alloc_stats, METH_NOARGS, "get_alloc_stats()\nReturn a dict of counters telling how often audio buffers and frames have been allocated, recycled and freed."},
+	{ "reset_alloc_stats", (PyCFunction)ffmpeg_reset_alloc_stats, METH_NOARGS, "reset_alloc_stats()\nReset the allocation counters to zero."},
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -510,6 +1284,14 @@ PyMODINIT_FUNC init_ffmpeg(void){
 		return;
 	}
 	
+	if( PyType_Ready( &ffmpegBuffer ) < 0 ){
+		return;
+	}
+	
+	if( PyType_Ready( &ffmpegMixer ) < 0 ){
+		return;
+	}
+	
 	module = Py_InitModule3( "_ffmpeg", ffmpegmodule_Methods, MODULE_DOCSTRING );
 	
 	Py_INCREF( &ffmpegDecoder );
@@ -518,6 +1300,12 @@ PyMODINIT_FUNC init_ffmpeg(void){
 	Py_INCREF( &ffmpegResampler );
 	PyModule_AddObject( module, "Resampler", (PyObject *)&ffmpegResampler );
 	
+	Py_INCREF( &ffmpegBuffer );
+	PyModule_AddObject( module, "Buffer", (PyObject *)&ffmpegBuffer );
+	
+	Py_INCREF( &ffmpegMixer );
+	PyModule_AddObject( module, "Mixer", (PyObject *)&ffmpegMixer );
+	
 	FfmpegDecodeError = PyErr_NewException("ffmpeg.DecodeError", NULL, NULL);
 	Py_INCREF(FfmpegDecodeError);
 	PyModule_AddObject( module, "DecodeError", FfmpegDecodeError );
@@ -543,6 +1331,7 @@ PyMODINIT_FUNC init_ffmpeg(void){
 	PyModule_AddIntMacro( module, AV_SAMPLE_FMT_DBLP );
 	PyModule_AddIntMacro( module, AV_SAMPLE_FMT_NB   );
 
+	PyModule_AddIntMacro( module, AV_CH_LAYOUT_MONO           );
 	PyModule_AddIntMacro( module, AV_CH_LAYOUT_STEREO         );
 	PyModule_AddIntMacro( module, AV_CH_LAYOUT_2POINT1        );
 	PyModule_AddIntMacro( module, AV_CH_LAYOUT_2_1            );
@@ -551,6 +1340,10 @@ PyMODINIT_FUNC init_ffmpeg(void){
 	PyModule_AddIntMacro( module, AV_CH_LAYOUT_QUAD           );
 	PyModule_AddIntMacro( module, AV_CH_LAYOUT_STEREO_DOWNMIX );
 	
+	PyModule_AddIntMacro( module, CURVE_LINEAR      );
+	PyModule_AddIntMacro( module, CURVE_EQUAL_POWER );
+	PyModule_AddIntMacro( module, CURVE_LOG         );
+	
 	avcodec_register_all();
 	av_register_all();
 	avformat_network_init();
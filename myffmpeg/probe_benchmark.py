@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Compare how fast the files in a directory can be probed with probe() versus
+# opening a full Decoder for each of them.
+#
+# Usage: python probe_benchmark.py [-n maxfiles] /path/to/music
+#
+# Run it twice: the first run mostly measures your disk. The Decoder run goes
+# first, so the page cache is equally warm for both.
+
+from __future__ import division
+
+import os
+import ffmpeg
+
+from time import time
+from optparse import OptionParser
+
+
+EXTENSIONS = ("mp3", "ogg", "oga", "opus", "flac", "wav", "m4a", "aac", "wma", "mpc", "ape", "wv")
+
+
+def find_files(root, maxfiles):
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.rsplit(".", 1)[-1].lower() in EXTENSIONS:
+                found.append(os.path.join(dirpath, name))
+                if len(found) >= maxfiles:
+                    return found
+    return found
+
+
+def with_decoder(fpath):
+    dec = ffmpeg.LowLevelDecoder(fpath)
+    return dec.get_duration(), dec.get_metadata()
+
+def with_probe(fpath):
+    info = ffmpeg.low_level_probe(fpath, probesize=65536, analyzeduration=500000)
+    return info["duration"], info["metadata"]
+
+def with_default_probe(fpath):
+    info = ffmpeg.low_level_probe(fpath)
+    return info["duration"], info["metadata"]
+
+
+def run(func, files):
+    failed = 0
+    start  = time()
+    for fpath in files:
+        try:
+            func(fpath)
+        except (ffmpeg.FileError, ffmpeg.DecodeError):
+            failed += 1
+    return time() - start, failed
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] <directory>\n")
+    parser.add_option( "-n", "--files", help="Maximum number of files to probe.", type="int", default=1000 )
+    options, posargs = parser.parse_args()
+
+    if not posargs:
+        parser.error("need a directory to scan")
+
+    files = find_files(posargs[-1], options.files)
+    if not files:
+        parser.error("no audio files found")
+
+    print "%-22s %10s %10s %8s" % ("Method", "Wall (s)", "Files/s", "Failed")
+    for name, func in (("Decoder", with_decoder), ("probe (defaults)", with_default_probe), ("probe (reduced)", with_probe)):
+        wall, failed = run(func, files)
+        print "%-22s %10.3f %10.1f %8d" % (name, wall, len(files) / wall, failed)
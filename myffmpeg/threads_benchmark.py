@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Decode a file in 1..N threads at the same time and see how throughput scales.
+#
+# Usage: python threads_benchmark.py [-t maxthreads] /path/to/some/file.ogg
+#
+# Since the C module releases the GIL while demuxing and decoding, the total amount
+# of audio decoded per second of wall time should grow (almost) linearly with the
+# number of threads, until you run out of CPU cores.
+
+from __future__ import division
+
+import sys
+import threading
+import ffmpeg
+
+from time import time
+from optparse import OptionParser
+
+
+def decode(fpath, results, idx):
+    dec = ffmpeg.LowLevelDecoder(fpath)
+    while True:
+        try:
+            dec.read()
+        except StopIteration:
+            break
+        except ffmpeg.DecodeError:
+            pass
+    results[idx] = dec.get_duration()
+
+
+def run(fpath, nthreads):
+    results = [0] * nthreads
+    threads = [ threading.Thread(target=decode, args=(fpath, results, idx)) for idx in range(nthreads) ]
+    start = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(results), time() - start
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] <file>\n")
+    parser.add_option( "-t", "--threads", help="Maximum number of threads to run.", type="int", default=4 )
+    options, posargs = parser.parse_args()
+
+    if not posargs:
+        parser.error("need a file to decode")
+
+    fpath = posargs[-1]
+    base  = None
+
+    print "Threads  Audio (s)  Wall (s)  Audio s/s  Speedup"
+    for nthreads in range(1, options.threads + 1):
+        audio, wall = run(fpath, nthreads)
+        rate = audio / wall
+        if base is None:
+            base = rate
+        print "%7d  %9.1f  %8.2f  %9.1f  %6.2fx" % (nthreads, audio, wall, rate, rate / base)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import wave
+import threading
+
+from Queue import Queue
+
+try:
+    import ao
+except ImportError:
+    ao = None
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+class Output(object):
+    """ Base class for the places audio can be sent to. The audio is 44.1kHz S16 stereo.
+
+        play() takes chunks of any size, and hands them on to _write() in
+        multiples of ``period`` frames. Whatever is left over waits for the next
+        chunk, so the device never gets the odd little fragment (like the ones
+        the Mixer produces at the end of a crossfade).
+
+        ``latency`` is how many seconds of audio the output buffers, if it knows.
+        If it is None, the PlaybackClock measures it.
+    """
+    latency = None
+
+    def __init__(self, period=1024, framesize=4):
+        self.period       = period
+        self.periodbytes  = period * framesize
+        self.pending      = bytearray()
+
+    def play(self, data):
+        # Chunks come as strings, buffer() views or bytearrays (see ffmpeg.Chunker),
+        # and a bytearray takes all of them.
+        pending = self.pending
+        pending += data
+        if len(pending) < self.periodbytes:
+            return
+        whole = len(pending) - len(pending) % self.periodbytes
+        data  = str(pending[:whole])
+        del pending[:whole]
+        self._write(data)
+
+    def flush(self):
+        """ Write what's left over, even though it's less than a period. """
+        if self.pending:
+            data = str(self.pending)
+            del self.pending[:]
+            self._write(data)
+
+    def close(self):
+        self.flush()
+
+    def _write(self, data):
+        raise NotImplementedError("_write")
+
+
+class AoOutput(Output):
+    """ Play through libao. See http://xiph.org/ao/doc/ for the drivers it supports. """
+    def __init__(self, driver="pulse", period=1024):
+        Output.__init__(self, period)
+        if ao is None:
+            raise ImportError("The libao output needs python-pyao")
+        self.device = ao.AudioDevice(driver)
+
+    def _write(self, data):
+        self.device.play(data)
+
+    def close(self):
+        Output.close(self)
+        # pyao closes the device when it's deleted
+        self.device = None
+
+
+class AlsaOutput(Output):
+    """ Play through ALSA (which may well hand it on to PulseAudio) using pyalsaaudio.
+
+        Periods are written to the device by a thread of their own, with up to
+        ``periods`` of them waiting in a queue. That way, the Player only has
+        to wait when the queue is full, not for every write to the device.
+    """
+    def __init__(self, device="default", period=1024, periods=4):
+        Output.__init__(self, period)
+        if alsaaudio is None:
+            raise ImportError("The alsa output needs pyalsaaudio")
+        self.pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, alsaaudio.PCM_NORMAL, card=device)
+        self.pcm.setchannels(2)
+        self.pcm.setrate(44100)
+        self.pcm.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+        self.pcm.setperiodsize(period)
+        self.queue  = Queue(maxsize=periods)
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write(self, data):
+        for offset in range(0, len(data), self.periodbytes):
+            self.queue.put( data[offset:offset + self.periodbytes] )
+
+    def _writer(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if len(data) < self.periodbytes:
+                # ALSA wants whole periods, so fill the last one up with silence
+                data += "\0" * (self.periodbytes - len(data))
+            self.pcm.write(data)
+
+    def close(self):
+        Output.close(self)
+        self.queue.put(None)
+        self.thread.join()
+        self.pcm.close()
+
+
+class NullOutput(Output):
+    """ Throw the audio away, as fast as it comes. For running the Player without a sound card. """
+    latency = 0
+
+    def __init__(self, period=1024):
+        Output.__init__(self, period)
+        self.written = 0
+
+    def _write(self, data):
+        self.written += len(data)
+
+
+class WavOutput(Output):
+    """ Write the audio to a .wav file, as fast as it comes. """
+    latency = 0
+
+    def __init__(self, path, period=1024):
+        Output.__init__(self, period)
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(2)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(44100)
+
+    def _write(self, data):
+        self.wav.writeframesraw(data)
+
+    def close(self):
+        Output.close(self)
+        # fixes up the header with the number of frames actually written
+        self.wav.close()
+
+
+def open_output(spec, period=1024):
+    """ Open an output described by spec, which is one of:
+
+        * ``null``: throw everything away
+        * ``wav:<path>``: write a .wav file
+        * ``alsa:<device>``: ALSA through pyalsaaudio, ``alsa:`` for the default device
+        * ``ao:<driver>`` or just ``<driver>``: a libao driver, like pulse or alsa
+
+        Plain ``alsa`` still means libao's alsa driver, as it always has.
+    """
+    kind, sep, arg = spec.partition(":")
+    if kind == "null":
+        return NullOutput(period)
+    if kind == "wav":
+        if not arg:
+            raise ValueError("The wav output needs a file name, like wav:/tmp/out.wav")
+        return WavOutput(arg, period)
+    if kind == "alsa" and sep:
+        return AlsaOutput(arg or "default", period)
+    if kind == "ao":
+        return AoOutput(arg or "pulse", period)
+    return AoOutput(spec, period)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from time import time
+from collections import deque
+
+
+class PlaybackClock(object):
+    """ Knows which of the samples written to the audio device is being heard right now.
+
+            PlaybackClock(rate=44100, framesize=4, latency=None)
+
+        Call wrote() after every write to the device, with whatever you want to
+        get back from current() while that chunk is being played.
+
+        What's audible lags behind what has been written by the amount of data
+        buffered in the output (libao, PulseAudio, the sound card). Since ao
+        can't tell us how much that is, it is measured: writes return right away
+        until the output's buffer is full, and the first write that has to wait
+        for space tells us how much fits in there, by comparing how much has been
+        written to how much time has passed since we started. This is repeated
+        whenever the output has run dry. If ``latency`` (in seconds) is given,
+        that is used instead.
+
+        Between writes, the device keeps playing what's buffered, so the time
+        since the last write is added to the position.
+    """
+    def __init__(self, rate=44100, framesize=4, latency=None):
+        self.rate      = rate
+        self.framesize = framesize
+        self.fixed     = latency is not None
+        self.latency   = int((latency or 0) * rate)   # in frames
+        self.lock      = threading.Lock()
+        self.written   = 0      # frames written so far
+        self.lastwrite = None   # when the last write returned
+        self.anchor    = None   # (time, frames written before) of the first write after the output ran dry
+        self.entries   = deque() # (frames written after the chunk, what wrote() was given)
+
+    @property
+    def latency_seconds(self):
+        return self.latency / float(self.rate)
+
+    def wrote(self, nbytes, entry, started=None):
+        """ Record that nbytes have been written, which belong to entry.
+
+            ``started`` is when the write was started (for measuring latency).
+        """
+        now    = time()
+        frames = nbytes // self.framesize
+        if started is None:
+            started = now
+        with self.lock:
+            if self.lastwrite is None or self.latency and started - self.lastwrite > self.latency_seconds:
+                # the output has played everything we gave it, so it starts over with this chunk
+                self.anchor = (started, self.written)
+            elif not self.fixed and self.anchor is not None and now - started >= 0.5 * frames / float(self.rate):
+                # The output made us wait for space, so it's full now. Everything written since the
+                # anchor that hasn't been played in the meantime must be in there.
+                buffered = self.written + frames - self.anchor[1] - int((now - self.anchor[0]) * self.rate)
+                if buffered > 0:
+                    self.latency = buffered
+                self.anchor  = None
+            self.written  += frames
+            self.lastwrite = now
+            self.entries.append( (self.written, entry) )
+            self._expire()
+
+    def _expire(self):
+        # drop the chunks that have been heard completely, except for the last one
+        played  = self._played()
+        entries = self.entries
+        while len(entries) > 1 and entries[0][0] <= played:
+            entries.popleft()
+
+    def played(self):
+        """ The number of frames that have been heard so far. """
+        with self.lock:
+            return self._played()
+
+    def _played(self):
+        if self.lastwrite is None:
+            return 0
+        drained = int((time() - self.lastwrite) * self.rate)
+        return self.written - self.latency + min(drained, self.latency)
+
+    def current(self):
+        """ Return a tuple of (entry, seconds) for the chunk being heard right now.
+
+            seconds is how much of that chunk is still to be heard. The entry is
+            None if nothing has been written yet.
+        """
+        with self.lock:
+            played = self._played()
+            self._expire()
+            if not self.entries:
+                return None, 0.
+            frames, entry = self.entries[0]
+            return entry, max(frames - played, 0) / float(self.rate)
+
+    def reset(self):
+        """ Forget everything that's been written, e.g. after the output has been reopened. """
+        with self.lock:
+            self.written   = 0
+            self.lastwrite = None
+            self.anchor    = None
+            self.entries.clear()
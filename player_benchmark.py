@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Run the whole Player pipeline (decoding, ReplayGain, crossfades) on the given files
+# without a sound card, and measure how many seconds of audio it gets through per second.
+#
+# Usage: python player_benchmark.py [-o null] [-p 1024] <file> ...
+#
+# The output defaults to null, which throws the audio away as fast as it comes. Use
+# -o wav:<path> to listen to the result afterwards.
+
+from __future__ import division
+
+from time import time
+from optparse import OptionParser
+
+from output import open_output
+from failaudio import Playlist, Player
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] <file> ...\n")
+    parser.add_option( "-o", "--out",    help="Audio output, see failaudio --help. Defaults to null.", default="null" )
+    parser.add_option( "-p", "--period", help="Frames per write to the output.", type="int", default=1024 )
+    options, posargs = parser.parse_args()
+
+    if not posargs:
+        parser.error("Need some files to play.")
+
+    playlist = Playlist()
+    for path in posargs:
+        playlist.append(path.decode("utf-8"))
+    # play the list once, like failaudio does
+    playlist.toggleStopAfter(posargs[-1].decode("utf-8"))
+
+    out    = open_output(options.out, options.period)
+    player = Player(out, playlist)
+    start  = time()
+    # no need for a thread of its own
+    player.run()
+    wall   = time() - start
+
+    audio  = player.clock.written / 44100.
+    print "%.1f s of audio in %.3f s = %.1f s/s" % (audio, wall, audio / wall)
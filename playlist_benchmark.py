@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+# Time the Playlist operations that used to scan the whole list on big playlists,
+# and loading and saving playlist files.
+#
+# Usage: python playlist_benchmark.py [-n 100000] [-d 1000]
+#
+# The playlist is filled with fake paths, nothing gets read from disk except for
+# the playlist file, which is written to a temporary directory. The old behaviour is
+# emulated on a plain list and with ConfigParser, the way Playlist did it before it
+# had an IndexedList and the playlistfile module.
+
+from __future__ import division
+
+import os
+import random
+import shutil
+import tempfile
+
+from time import time
+from optparse import OptionParser
+from ConfigParser import ConfigParser
+
+from failaudio import Playlist
+
+
+def timed(func, *args):
+    start = time()
+    func(*args)
+    return time() - start
+
+
+def old_append(paths):
+    playlist = []
+    for path in paths:
+        if path not in playlist:
+            playlist.append(path)
+    return playlist
+
+def new_append(paths):
+    playlist = Playlist()
+    for path in paths:
+        playlist.append(path)
+    return playlist
+
+
+def old_lookup(playlist, paths):
+    for path in paths:
+        playlist.index(path)
+
+def new_lookup(playlist, paths):
+    for path in paths:
+        playlist.indexOf(path)
+
+
+def old_drop(playlist, row, paths):
+    # one move or insert per dropped URL
+    for path in paths:
+        if path in playlist:
+            oldidx = playlist.index(path)
+            playlist.remove(path)
+            playlist.insert(row if oldidx >= row else row - 1, path)
+        else:
+            playlist.insert(row, path)
+        row += 1
+
+def new_drop(playlist, row, paths):
+    playlist.insertMany(row, paths)
+    playlist.moveMany(row, paths)
+
+
+def old_load(fpath):
+    pls = ConfigParser()
+    pls.read(fpath)
+    files = [opt for opt in pls.options("playlist") if opt.startswith("file")]
+    files.sort( cmp=lambda a, b: cmp(int(a[4:]), int(b[4:])) )
+    playlist = []
+    for fileopt in files:
+        path = pls.get("playlist", fileopt).decode("utf-8")
+        os.path.exists(path)
+        playlist.append(path)
+    return playlist
+
+def new_load(fpath):
+    return Playlist().loadpls(fpath)
+
+
+def old_save(playlist, fpath):
+    if os.path.exists( fpath ):
+        shutil.copyfile( fpath, fpath+'~' )
+    fd = open(fpath, "wb")
+    try:
+        fd.write("[playlist]\n")
+        for i, path in enumerate(playlist):
+            i += 1
+            fd.write( ("File%d=%s\n" % (i, path)).encode("utf-8") )
+            fd.write( ("Title%d=%s\n" % (i, path.rsplit( '/', 1 )[1].rsplit('.', 1)[0])).encode("utf-8") )
+            fd.write( "\n" )
+        fd.write("NumberOfEntries=%d\n" % len(playlist))
+        fd.write("Version=2\n")
+    finally:
+        fd.close()
+
+def new_save(playlist, fpath):
+    playlist.writepls(fpath)
+
+
+def old_remove(playlist, paths):
+    for path in paths:
+        playlist.remove(path)
+
+def new_remove(playlist, paths):
+    playlist.removeMany(paths)
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options]\n")
+    parser.add_option( "-n", "--entries", help="Number of songs in the playlist.", type="int", default=100000 )
+    parser.add_option( "-d", "--drop",    help="Number of songs dragged around at once.", type="int", default=1000 )
+    options, posargs = parser.parse_args()
+
+    paths   = [ u"/music/artist %d/album %d/track %d.ogg" % (i // 1000, i // 10, i) for i in range(options.entries) ]
+    dropped = random.sample(paths, options.drop // 2) + [ u"/music/new/%d.ogg" % i for i in range(options.drop // 2) ]
+    row     = options.entries // 2
+
+    # the old append is quadratic, don't wait for that forever
+    nold = min(options.entries, 20000)
+    print "%-28s %12s %12s" % ("Operation", "old (s)", "new (s)")
+    print "%-28s %12.3f %12.3f" % ("append %d" % nold,
+        timed(old_append, paths[:nold]), timed(new_append, paths[:nold]))
+
+    oldpls = list(paths)
+    newpls = new_append(paths)
+    lookups = random.sample(paths, options.drop)
+    print "%-28s %12.3f %12.3f" % ("lookup %d" % len(lookups),
+        timed(old_lookup, oldpls, lookups), timed(new_lookup, newpls, lookups))
+    print "%-28s %12.3f %12.3f" % ("drop %d at row %d" % (len(dropped), row),
+        timed(old_drop, oldpls, row, dropped), timed(new_drop, newpls, row, dropped))
+    print "%-28s %12.3f %12.3f" % ("remove %d" % len(dropped),
+        timed(old_remove, oldpls, dropped), timed(new_remove, newpls, dropped))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        oldfile = os.path.join(tmpdir, "old.pls")
+        newfile = os.path.join(tmpdir, "new.pls")
+        print "%-28s %12.3f %12.3f" % ("save %d" % len(newpls),
+            timed(old_save, oldpls, oldfile), timed(new_save, newpls, newfile))
+        # save again, now that there's a file to back up or replace
+        print "%-28s %12.3f %12.3f" % ("save over %d" % len(newpls),
+            timed(old_save, oldpls, oldfile), timed(new_save, newpls, newfile))
+        print "%-28s %12.3f %12.3f" % ("load %d" % len(newpls),
+            timed(old_load, oldfile), timed(new_load, newfile))
+    finally:
+        shutil.rmtree(tmpdir)
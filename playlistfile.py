@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright (C) 2012, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  This code is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+
+from operator import itemgetter
+
+
+# Where FailPlay's own settings (current song, queue etc) go in .m3u files.
+M3U_OPTION_PREFIX = "#FAILPLAY:"
+
+
+def is_m3u(fpath):
+    return fpath.rsplit(".", 1)[-1].lower() in ("m3u", "m3u8")
+
+
+def read_pls(fd):
+    """ Read a .pls file line by line.
+
+        Returns a tuple of (paths, options): the paths ordered by their FileN
+        number, and a dict of the (lowercase) options in the [failplay] section.
+    """
+    entries = []
+    options = {}
+    section = None
+    for line in fd:
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line[0] == "[":
+            section = line[1:-1].strip().lower()
+            continue
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        key   = key.strip().lower()
+        value = value.strip()
+        if section == "playlist":
+            if key.startswith("file"):
+                try:
+                    entries.append( (int(key[4:]), value.decode("utf-8")) )
+                except ValueError:
+                    pass
+        elif section == "failplay":
+            options[key] = value
+    # files are written in order, so this usually only confirms they are
+    entries.sort(key=itemgetter(0))
+    return [ path for number, path in entries ], options
+
+
+def read_m3u(fd, basedir):
+    """ Read an .m3u file line by line. Relative paths are taken to be relative to basedir.
+
+        Returns a tuple of (paths, options) like read_pls.
+    """
+    if isinstance(basedir, str):
+        # the entries are decoded as UTF-8, so the directory has to be unicode as well
+        basedir = basedir.decode("utf-8")
+    paths   = []
+    options = {}
+    for line in fd:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(M3U_OPTION_PREFIX):
+            key, sep, value = line[len(M3U_OPTION_PREFIX):].partition("=")
+            options[key.strip().lower()] = value.strip()
+        elif line[0] != "#":
+            paths.append( os.path.join(basedir, line.decode("utf-8")) )
+    return paths, options
+
+
+def read_playlist(fpath):
+    """ Read a .pls or .m3u file, depending on its extension. See read_pls. """
+    with open(fpath, "rb") as fd:
+        if is_m3u(fpath):
+            return read_m3u(fd, os.path.dirname(os.path.abspath(fpath)))
+        return read_pls(fd)
+
+
+def _pls_lines(paths, title, options):
+    yield "[playlist]\n"
+    for i, path in enumerate(paths):
+        i += 1
+        yield ("File%d=%s\nTitle%d=%s\n\n" % (i, path, i, title(path))).encode("utf-8")
+    yield "NumberOfEntries=%d\n" % len(paths)
+    yield "Version=2\n"
+    yield "\n"
+    yield "[failplay]\n"
+    for key, value in options:
+        yield "%s=%s\n" % (key, value)
+
+
+def _m3u_lines(paths, title, options):
+    yield "#EXTM3U\n"
+    for key, value in options:
+        yield "%s%s=%s\n" % (M3U_OPTION_PREFIX, key, value)
+    for path in paths:
+        yield ("#EXTINF:-1,%s\n%s\n" % (title(path), path)).encode("utf-8")
+
+
+def write_playlist(fpath, paths, title, options):
+    """ Write the paths to a .pls or .m3u file, depending on its extension.
+
+        ``title`` is called for every path to get the title to write along with
+        it, ``options`` is a list of (key, value) tuples for FailPlay's settings.
+        The file is written to a temporary file first, which is then renamed, so
+        a crash can't leave a half-written playlist behind.
+    """
+    if is_m3u(fpath):
+        lines = _m3u_lines(paths, title, options)
+    else:
+        lines = _pls_lines(paths, title, options)
+    tmppath = fpath + ".tmp"
+    with open(tmppath, "wb") as fd:
+        fd.writelines(lines)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.rename(tmppath, fpath)
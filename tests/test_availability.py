@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from time import time, sleep
+
+from availability import AvailabilityTracker
+
+
+class AvailabilityTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir  = tempfile.mkdtemp()
+        self.path    = os.path.join(self.tmpdir, "song.mp3").decode("utf-8")
+        self.tracker = AvailabilityTracker(ttl=0.2)
+        open(self.path, "wb").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def wait_for(self, path, value, timeout=5):
+        deadline = time() + timeout
+        while self.tracker.status.get(path, (None,))[0] != value:
+            if time() > deadline:
+                self.fail("%s never became %r" % (path, value))
+            sleep(0.01)
+
+    def test_unknown_is_not_dead(self):
+        missing = os.path.join(self.tmpdir, "missing.mp3").decode("utf-8")
+        self.assertEqual(self.tracker.available(missing), None)
+        self.assertFalse(self.tracker.is_dead(missing))
+        self.wait_for(missing, False)
+        self.assertTrue(self.tracker.is_dead(missing))
+
+    def test_result_is_kept_for_ttl(self):
+        self.tracker.check(self.path)
+        self.wait_for(self.path, True)
+        os.unlink(self.path)
+        # still within the ttl, so nobody looks again
+        self.assertEqual(self.tracker.available(self.path), True)
+        sleep(0.1)
+        self.assertEqual(self.tracker.status[self.path][0], True)
+
+    def test_stale_result_is_rechecked(self):
+        self.tracker.check(self.path)
+        self.wait_for(self.path, True)
+        os.unlink(self.path)
+        sleep(0.3)
+        # the old result is returned right away, and the file checked again
+        self.assertEqual(self.tracker.available(self.path), True)
+        self.wait_for(self.path, False)
+        self.assertTrue(self.tracker.is_dead(self.path))
+
+    def test_mark_dead(self):
+        self.tracker.check(self.path)
+        self.wait_for(self.path, True)
+        self.tracker.mark_dead(self.path)
+        self.assertTrue(self.tracker.is_dead(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
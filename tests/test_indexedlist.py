@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import unittest
+
+from failaudio import IndexedList
+
+
+class IndexedListTest(unittest.TestCase):
+    def assertConsistent(self, lst):
+        for row, path in enumerate(lst):
+            self.assertEqual(lst.index(path), row)
+
+    def test_append(self):
+        lst = IndexedList(["a", "b"])
+        lst.append("c")
+        self.assertEqual(list(lst), ["a", "b", "c"])
+        self.assertTrue("c" in lst)
+        self.assertConsistent(lst)
+
+    def test_insert_shifts_rows(self):
+        lst = IndexedList(["a", "b", "c"])
+        lst.insert_many(1, ["x", "y"])
+        self.assertEqual(list(lst), ["a", "x", "y", "b", "c"])
+        self.assertConsistent(lst)
+        lst.insert(100, "z")
+        self.assertEqual(lst[-1], "z")
+        self.assertConsistent(lst)
+
+    def test_remove(self):
+        lst = IndexedList(["a", "b", "c", "d", "e"])
+        lst.remove("b")
+        self.assertConsistent(lst)
+        lst.remove_many(["a", "d"])
+        self.assertEqual(list(lst), ["c", "e"])
+        self.assertTrue("a" not in lst)
+        self.assertConsistent(lst)
+
+    def test_pop(self):
+        lst = IndexedList(["a", "b", "c"])
+        self.assertEqual(lst.pop(0), "a")
+        self.assertEqual(lst.pop(), "c")
+        self.assertEqual(list(lst), ["b"])
+        self.assertConsistent(lst)
+
+    def test_alternating_changes_and_lookups(self):
+        lst = IndexedList([ "song%d" % i for i in range(100) ])
+        for i in range(50):
+            lst.insert(0, "new%d" % i)
+            self.assertEqual(lst.index("song99"), 100)
+            lst.remove("song%d" % i)
+            self.assertEqual(lst.index("song99"), 99)
+        self.assertConsistent(lst)
+
+
+if __name__ == '__main__':
+    unittest.main()
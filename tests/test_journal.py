@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PyQt4 import QtCore
+
+from failaudio import Playlist
+from journal import PlaylistJournal
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def state(playlist):
+    return list(playlist.playlist), list(playlist.jmpqueue), playlist.current, playlist.repeat, playlist.stopafter
+
+
+class PlaylistJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir  = tempfile.mkdtemp()
+        self.plspath = os.path.join(self.tmpdir, "failplay.pls")
+        # songs that don't exist would be skipped
+        for name in [ "%d.mp3" % i for i in range(10) ] + ["new1.mp3", "new2.mp3", "late.mp3"]:
+            open(self.song(name), "wb").close()
+        self.playlist = Playlist()
+        for i in range(10):
+            self.playlist.append(self.song("%d.mp3" % i))
+        self.journal = PlaylistJournal(self.playlist, self.plspath)
+        self.journal.start(replay=False)
+        self.journal.compact(force=True)
+
+    def song(self, name):
+        return os.path.join(self.tmpdir, name).decode("utf-8")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def change(self, playlist):
+        playlist.next()
+        playlist.enqueue(self.song("7.mp3"))
+        playlist.enqueue(self.song("3.mp3"))
+        playlist.insertMany(2, [self.song("new1.mp3"), self.song("new2.mp3")])
+        playlist.removeMany([self.song("5.mp3"), self.song("0.mp3")])
+        playlist.moveMany(0, [self.song("9.mp3")])
+        playlist.next()
+        playlist.toggleRepeat(self.song("1.mp3"))
+        playlist.toggleStopAfter(self.song("2.mp3"))
+
+    def reload(self):
+        playlist = Playlist()
+        playlist.loadpls(self.plspath)
+        journal = PlaylistJournal(playlist, self.plspath)
+        return playlist, journal
+
+    def test_replay(self):
+        self.change(self.playlist)
+        self.journal.flush()
+        self.assertTrue(os.path.exists(self.plspath + ".journal"))
+
+        playlist, journal = self.reload()
+        count, complete = journal.replay()
+        self.assertTrue(complete)
+        self.assertEqual(count, self.journal.entries)
+        self.assertEqual(state(playlist), state(self.playlist))
+
+    def test_replay_twice_is_harmless(self):
+        self.change(self.playlist)
+        self.journal.flush()
+        playlist, journal = self.reload()
+        journal.replay()
+        journal.replay()
+        self.assertEqual(state(playlist), state(self.playlist))
+
+    def test_compact(self):
+        self.change(self.playlist)
+        self.journal.flush()
+        self.journal.compact()
+        self.assertFalse(os.path.exists(self.plspath + ".journal"))
+        self.assertEqual(self.journal.entries, 0)
+
+        playlist, journal = self.reload()
+        # loading the file doesn't know where the current song was, but everything else is there
+        self.assertEqual(state(playlist), state(self.playlist))
+
+    def test_broken_last_line(self):
+        self.playlist.enqueue(self.song("4.mp3"))
+        self.journal.flush()
+        with open(self.plspath + ".journal", "ab") as fd:
+            fd.write('["enqueue", "/mu')
+
+        playlist, journal = self.reload()
+        count, complete = journal.replay()
+        self.assertEqual(count, 1)
+        self.assertFalse(complete)
+        self.assertEqual(list(playlist.jmpqueue), [self.song("4.mp3")])
+
+    def test_broken_first_line_is_dropped(self):
+        with open(self.plspath + ".journal", "wb") as fd:
+            fd.write('["enq')
+        playlist, journal = self.reload()
+        journal.start(replay=True)
+        self.assertFalse(os.path.exists(self.plspath + ".journal"))
+
+    def test_changes_during_compaction_stay_pending(self):
+        playlist = self.playlist
+        writepls = playlist.writepls
+
+        def slow_writepls(fpath, snapshot=None):
+            # the Player moves on while the file is being written
+            playlist.next()
+            return writepls(fpath, snapshot)
+
+        playlist.writepls = slow_writepls
+        playlist.append(self.song("late.mp3"))
+        self.journal.compact()
+        self.assertEqual(self.journal.pending, ['["current", "%s"]\n' % self.song("0.mp3")])
+
+        self.journal.flush()
+        playlist, journal = self.reload()
+        self.assertEqual(playlist.current, None)
+        journal.replay()
+        self.assertEqual(state(playlist), state(self.playlist))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import unittest
+import threading
+
+from failaudio import JumpQueue
+
+
+class JumpQueueTest(unittest.TestCase):
+    def assertConsistent(self, queue):
+        for pos, path in enumerate(list(queue)):
+            self.assertEqual(queue.index(path), pos)
+
+    def test_positions(self):
+        queue = JumpQueue(["a", "b", "c", "b"])
+        self.assertEqual(list(queue), ["a", "b", "c"])
+        self.assertEqual(queue.index("c"), 2)
+        self.assertEqual(queue.index("x"), None)
+
+    def test_popleft(self):
+        queue = JumpQueue(["a", "b", "c"])
+        self.assertEqual(queue.popleft(), "a")
+        self.assertEqual(queue.index("b"), 0)
+        self.assertTrue("a" not in queue)
+        queue.append("d")
+        self.assertConsistent(queue)
+        self.assertEqual(queue.popleft(), "b")
+        self.assertEqual(queue.popleft(), "c")
+        self.assertEqual(queue.popleft(), "d")
+        self.assertEqual(queue.popleft(), None)
+
+    def test_remove(self):
+        queue = JumpQueue(["a", "b", "c", "d"])
+        self.assertEqual(queue.remove("b"), 1)
+        self.assertEqual(list(queue), ["a", "c", "d"])
+        self.assertConsistent(queue)
+        self.assertEqual(queue.remove("a"), 0)
+        self.assertConsistent(queue)
+        self.assertEqual(queue.remove("a"), None)
+
+    def test_remove_while_popping(self):
+        # the Player pops the head while the GUI removes songs from the middle
+        paths = [ "song%d" % i for i in range(20000) ]
+        queue = JumpQueue(paths)
+        popped = []
+
+        def pop():
+            while True:
+                path = queue.popleft()
+                if path is None:
+                    return
+                popped.append(path)
+
+        thread = threading.Thread(target=pop)
+        thread.start()
+        removed = [ path for path in paths[1::2] if queue.remove(path) is not None ]
+        thread.join()
+        self.assertEqual(sorted(popped + removed), sorted(paths))
+        self.assertEqual(len(queue), 0)
+
+    def test_consistent_after_concurrent_changes(self):
+        queue = JumpQueue([ "song%d" % i for i in range(5000) ])
+        stop  = threading.Event()
+
+        def pop():
+            while not stop.is_set() and queue.popleft() is not None:
+                pass
+
+        thread = threading.Thread(target=pop)
+        thread.start()
+        for i in range(5000, 1000, -3):
+            queue.remove("song%d" % i)
+        stop.set()
+        thread.join()
+        self.assertConsistent(queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import unittest
+
+from loudness import replaygain_from_tags, gain_factor
+
+
+class ReplayGainTagsTest(unittest.TestCase):
+    def test_track_gain(self):
+        self.assertEqual(replaygain_from_tags({"replaygain_track_gain": "-6.5 dB", "replaygain_track_peak": "0.98"}),
+                         (-6.5, 0.98))
+
+    def test_tag_names_ignore_case(self):
+        self.assertEqual(replaygain_from_tags({"REPLAYGAIN_TRACK_GAIN": "+2.00 dB"}), (2.0, None))
+
+    def test_missing(self):
+        self.assertEqual(replaygain_from_tags({"title": "x"}), (None, None))
+
+    def test_garbage(self):
+        self.assertEqual(replaygain_from_tags({"replaygain_track_gain": "loud", "replaygain_track_peak": ""}),
+                         (None, None))
+
+
+class GainFactorTest(unittest.TestCase):
+    def test_no_gain(self):
+        self.assertEqual(gain_factor(None), 1.)
+        self.assertEqual(gain_factor(None, 2.), 1.)
+
+    def test_db(self):
+        self.assertAlmostEqual(gain_factor(0.), 1.)
+        self.assertAlmostEqual(gain_factor(-20.), 0.1)
+        self.assertAlmostEqual(gain_factor(6.0206), 2., 4)
+
+    def test_peak_limits_gain(self):
+        # +6dB would clip a peak of 0.8, so it is reduced to 1 / 0.8
+        self.assertAlmostEqual(gain_factor(6.0206, 0.8), 1.25)
+        # a cut is never limited
+        self.assertAlmostEqual(gain_factor(-20., 0.8), 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import os
+import wave
+import shutil
+import tempfile
+import unittest
+
+from output import Output, NullOutput, WavOutput, open_output
+
+
+class RecordingOutput(Output):
+    def __init__(self, period):
+        Output.__init__(self, period)
+        self.writes = []
+
+    def _write(self, data):
+        self.writes.append(data)
+
+
+class OutputTest(unittest.TestCase):
+    def test_whole_periods(self):
+        out = RecordingOutput(4)
+        for frames in (3, 5, 20, 1, 6):
+            out.play("\x01" * frames * 4)
+        self.assertEqual([ len(data) for data in out.writes ], [32, 80, 16])
+        # three frames are left over until flush()
+        out.flush()
+        self.assertEqual(len(out.writes[-1]), 12)
+        self.assertEqual(sum([ len(data) for data in out.writes ]), 35 * 4)
+
+    def test_decoder_chunks(self):
+        # the decoder hands out buffer() views, and bytearrays for chunks spanning two blocks
+        out = RecordingOutput(1024)
+        out.play(buffer("a" * 8192, 0, 4096))
+        out.play(bytearray("b" * 100))
+        out.play("c" * 4000)
+        self.assertEqual(out.writes[0], "a" * 4096)
+        self.assertEqual(out.writes[1], "b" * 100 + "c" * 3996)
+        self.assertTrue(all([ isinstance(data, str) for data in out.writes ]))
+
+    def test_null(self):
+        out = open_output("null")
+        self.assertTrue(isinstance(out, NullOutput))
+        self.assertEqual(out.latency, 0)
+        out.play(buffer("x" * 10000))
+        out.close()
+        self.assertEqual(out.written, 10000)
+
+    def test_wav(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fpath = os.path.join(tmpdir, "out.wav")
+            out = open_output("wav:" + fpath, 256)
+            self.assertTrue(isinstance(out, WavOutput))
+            for i in range(10):
+                out.play(bytearray(1000 * 4))
+            out.close()
+            wav = wave.open(fpath)
+            self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (2, 2, 44100))
+            self.assertEqual(wav.getnframes(), 10000)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_wav_needs_a_path(self):
+        self.assertRaises(ValueError, open_output, "wav:")
+
+
+if __name__ == '__main__':
+    unittest.main()
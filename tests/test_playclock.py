@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import unittest
+
+from playclock import PlaybackClock
+
+
+class PlaybackClockTest(unittest.TestCase):
+    def test_nothing_written(self):
+        self.assertEqual(PlaybackClock().current(), (None, 0.))
+
+    def test_no_latency(self):
+        clock = PlaybackClock(latency=0)
+        clock.wrote(44100 * 4, "a")
+        clock.wrote(44100 * 4, "b")
+        entry, remaining = clock.current()
+        self.assertEqual(entry, "b")
+        self.assertTrue(remaining < 0.1)
+
+    def test_latency(self):
+        # with two seconds buffered, the first of two one second chunks is being heard
+        clock = PlaybackClock(latency=2)
+        clock.wrote(44100 * 4, "a")
+        clock.wrote(44100 * 4, "b")
+        entry, remaining = clock.current()
+        self.assertEqual(entry, "a")
+        self.assertTrue(0.9 < remaining <= 1.)
+        self.assertEqual(clock.latency_seconds, 2)
+
+    def test_reset(self):
+        clock = PlaybackClock(latency=1)
+        clock.wrote(4096, "a")
+        clock.reset()
+        self.assertEqual(clock.current(), (None, 0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+from playlistfile import read_pls, read_m3u, read_playlist, write_playlist
+
+
+class ReadPlsTest(unittest.TestCase):
+    def test_sorted_by_number(self):
+        paths, options = read_pls(BytesIO(
+            "[playlist]\nFile2=/b.mp3\nTitle2=b\nFile10=/c.mp3\nFile1=/a.mp3\nNumberOfEntries=3\n"
+            "[failplay]\nCurrent=2\nQueue=3 1\n"))
+        self.assertEqual(paths, [u"/a.mp3", u"/b.mp3", u"/c.mp3"])
+        self.assertEqual(options, {"current": "2", "queue": "3 1"})
+
+    def test_garbage(self):
+        paths, options = read_pls(BytesIO("; comment\n[playlist]\nnonsense\nFileX=/x.mp3\nFile1=/a.mp3\n"))
+        self.assertEqual(paths, [u"/a.mp3"])
+
+
+class RoundTripTest(unittest.TestCase):
+    paths   = [u"/music/a.mp3", u"/music/b\xe4r.ogg", u"/music/sub/c.flac"]
+    options = [("StopAfter", None), ("Current", 2), ("Position", "12.500"), ("Queue", "3 1")]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def roundtrip(self, name):
+        fpath = os.path.join(self.tmpdir, name)
+        write_playlist(fpath, self.paths, lambda path: path.rsplit("/", 1)[1], self.options)
+        self.assertFalse(os.path.exists(fpath + ".tmp"))
+        paths, options = read_playlist(fpath)
+        self.assertEqual(paths, self.paths)
+        self.assertEqual(options, dict([ (key.lower(), str(value)) for key, value in self.options ]))
+
+    def test_pls(self):
+        self.roundtrip("list.pls")
+
+    def test_m3u(self):
+        self.roundtrip("list.m3u")
+
+    def test_overwrite(self):
+        self.roundtrip("list.pls")
+        self.paths = self.paths[:1]
+        self.roundtrip("list.pls")
+
+
+class ReadM3uTest(unittest.TestCase):
+    def test_relative_paths(self):
+        paths, options = read_m3u(BytesIO("#EXTM3U\n#EXTINF:-1,A\na.mp3\n/abs/b.mp3\n"), u"/music")
+        self.assertEqual(paths, [u"/music/a.mp3", u"/abs/b.mp3"])
+        self.assertEqual(options, {})
+
+    def test_options(self):
+        paths, options = read_m3u(BytesIO("#FAILPLAY:Current=2\n#FAILPLAY:Queue=1 2\na.mp3\n"), u"/music")
+        self.assertEqual(options, {"current": "2", "queue": "1 2"})
+
+    def test_non_ascii_basedir(self):
+        paths, options = read_m3u(BytesIO("a.mp3\nb\xc3\xa4.mp3\n"), "/home/m\xc3\xbcsik")
+        self.assertEqual(paths, [u"/home/m\xfcsik/a.mp3", u"/home/m\xfcsik/b\xe4.mp3"])
+
+    def test_non_ascii_playlist_path(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dirpath = os.path.join(tmpdir, "m\xc3\xbcsik")
+            os.mkdir(dirpath)
+            with open(os.path.join(dirpath, "list.m3u"), "wb") as fd:
+                fd.write("a.mp3\n")
+            paths, options = read_playlist(os.path.join(dirpath, "list.m3u"))
+            self.assertEqual(paths, [ os.path.join(dirpath, "a.mp3").decode("utf-8") ])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()